@@ -0,0 +1,79 @@
+# active_medications.py - Each patient's current medications, kept for prescribe-time screening
+
+from datetime import timedelta
+from django.utils import timezone
+import re
+from .models import PatientActiveMedication
+from .interactions import interaction_index
+
+# Without a readable duration a dispensed medication counts as active for this long
+DEFAULT_COURSE = timedelta(days=30)
+# Courses are rarely finished on the day they should be; keep screening a little longer
+GRACE = timedelta(days=7)
+_UNITS = {'day': 1, 'd': 1, 'week': 7, 'wk': 7, 'w': 7, 'month': 30, 'mo': 30, 'm': 30, 'year': 365, 'y': 365}
+# Clinical shorthand: 5/7 is five days, 2/52 two weeks, 3/12 three months
+_FRACTIONS = {'7': 1, '52': 7, '12': 30}
+
+def course_length(duration):
+    """Read '7 days', '2 weeks', '5/7', '3/12' and the like; DEFAULT_COURSE when unreadable"""
+    text = (duration or '').strip().lower()
+    match = re.match(r'^(\d+)\s*/\s*(7|52|12)\b', text)
+    if match:
+        return timedelta(days=int(match.group(1)) * _FRACTIONS[match.group(2)])
+    match = re.match(r'^(\d+)\s*([a-z]+)', text)
+    if match:
+        unit = match.group(2) if match.group(2) in _UNITS else match.group(2).rstrip('s')
+        if unit in _UNITS:
+            return timedelta(days=int(match.group(1)) * _UNITS[unit])
+    return DEFAULT_COURSE
+
+def record_dispensed(prescription, items, dispensed_at=None):
+    """Mark the medications actually dispensed (substitutes included) active for the prescription's patient"""
+    dispensed_at = dispensed_at or timezone.now()
+    patient_id = prescription.visit.patient_id
+    rows = {}
+    for item in items:
+        rows[item.dispensed_medication_id] = PatientActiveMedication(
+            patient_id=patient_id,
+            medication_id=item.dispensed_medication_id,
+            prescription=prescription,
+            dispensed_at=dispensed_at,
+            active_until=dispensed_at + course_length(item.duration) + GRACE,
+        )
+    # The latest dispense of a medication replaces any earlier course of it
+    PatientActiveMedication.objects.bulk_create(
+        rows.values(),
+        update_conflicts=True,
+        unique_fields=['patient', 'medication'],
+        update_fields=['prescription', 'dispensed_at', 'active_until'],
+    )
+
+def release_prescription(prescription):
+    """A cancelled prescription no longer contributes to anyone's active medications"""
+    PatientActiveMedication.objects.filter(prescription=prescription).delete()
+
+def active_medications(patient_id, now=None):
+    return [
+        active.medication for active in PatientActiveMedication.objects.filter(
+            patient_id=patient_id, active_until__gte=now or timezone.now()
+        ).select_related('medication')
+    ]
+
+def screen(patient_id, medications):
+    """
+    Interactions of `medications` (about to be prescribed) with each other and with the
+    patient's active medications. Interactions only among active medications are left out;
+    they were accepted when those were prescribed.
+    """
+    new_ids = {medication.pk for medication in medications}
+    active = [medication for medication in active_medications(patient_id) if medication.pk not in new_ids]
+    active_ids = {str(medication.pk) for medication in active}
+
+    warnings = []
+    for interaction in interaction_index().interactions(list(medications) + active):
+        involved = {interaction['drug1_id'], interaction['drug2_id']}
+        if involved <= active_ids:
+            continue
+        interaction['with_active_medication'] = bool(involved & active_ids)
+        warnings.append(interaction)
+    return warnings
@@ -0,0 +1,123 @@
+# consultation_queue.py - Per-room consultation queues stored as ConsultationQueueEntry rows
+
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Max
+from .models import ConsultationRoom, ConsultationQueueEntry
+
+class QueueError(Exception):
+    """Raised when a queue operation refers to a visit that is not where the caller expects"""
+
+def room_queue(room):
+    """Entries waiting for `room`, head first"""
+    return list(room.queue_entries.select_related('visit').order_by('position'))
+
+def enqueue(room, visit, priority=None):
+    """
+    Append `visit` to the end of `room`'s queue, moving it out of any other room's queue
+
+    The room row is locked so concurrent enqueues to the same room take consecutive
+    positions; other rooms and the entries already waiting are untouched.
+    """
+    with transaction.atomic():
+        ConsultationRoom.objects.select_for_update().filter(pk=room.pk).first()
+
+        existing = ConsultationQueueEntry.objects.filter(visit=visit).first()
+        if existing is not None:
+            if existing.room_id == room.pk:
+                raise QueueError(f'Visit {visit.pk} is already queued for {room.name}.')
+            existing.delete()
+
+        last_position = room.queue_entries.aggregate(last=Max('position'))['last'] or 0
+        entry = ConsultationQueueEntry.objects.create(
+            room=room,
+            visit=visit,
+            position=last_position + 1,
+            priority=priority or visit.priority,
+        )
+
+        if visit.consultation_room_id != room.pk:
+            visit.consultation_room = room
+            visit.save(update_fields=['consultation_room', 'updated_at'])
+        return entry
+
+def dequeue(room, visit):
+    """
+    Remove `visit` from `room`'s queue and unassign it from the room, which returns it to
+    its clinic's triage pool; the gap it leaves does not need renumbering
+    """
+    with transaction.atomic():
+        deleted, _ = ConsultationQueueEntry.objects.filter(room=room, visit=visit).delete()
+        if not deleted:
+            raise QueueError(f'Visit {visit.pk} is not queued for {room.name}.')
+
+        if visit.consultation_room_id == room.pk:
+            visit.consultation_room = None
+            visit.save(update_fields=['consultation_room', 'updated_at'])
+
+def reorder(room, visit_ids):
+    """
+    Put the listed visits first, in the given order, followed by every other entry in its
+    current order, and renumber the room from 1
+
+    Entries enqueued after the caller last read the queue are kept (at the end) rather
+    than dropped, so a stale reorder cannot lose patients.
+    """
+    with transaction.atomic():
+        entries = list(
+            ConsultationQueueEntry.objects.select_for_update().filter(room=room).order_by('position')
+        )
+        by_visit = {entry.visit_id: entry for entry in entries}
+        unknown = [visit_id for visit_id in visit_ids if visit_id not in by_visit]
+        if unknown:
+            raise QueueError(f'Visit {unknown[0]} is not queued for {room.name}.')
+
+        listed = list(dict.fromkeys(visit_ids))
+        ordered = [by_visit[visit_id] for visit_id in listed]
+        listed = set(listed)
+        ordered += [entry for entry in entries if entry.visit_id not in listed]
+        changed = []
+        for position, entry in enumerate(ordered, start=1):
+            if entry.position != position:
+                entry.position = position
+                changed.append(entry)
+        ConsultationQueueEntry.objects.bulk_update(changed, ['position'])
+        return ordered
+
+def move(room, visit_id, position):
+    """Move one visit to 1-based `position` in `room`'s queue"""
+    order = [entry.visit_id for entry in room_queue(room) if entry.visit_id != visit_id]
+    order.insert(max(position - 1, 0), visit_id)
+    return reorder(room, order)
+
+def next_patient(room):
+    """
+    Take the visit at the head of `room`'s queue and start its consultation
+
+    The head is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so two doctors calling
+    at once get different patients instead of one waiting on the other. Returns None
+    when nobody is waiting.
+    """
+    with transaction.atomic():
+        entry = (
+            ConsultationQueueEntry.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(room=room)
+            .select_related('visit', 'visit__patient')
+            .order_by('position')
+            .first()
+        )
+        if entry is None:
+            return None
+        entry.delete()
+
+        now = timezone.now()
+        visit = entry.visit
+        visit.status = 'In Progress'
+        visit.save(update_fields=['status', 'updated_at'])
+        ConsultationRoom.objects.filter(pk=room.pk).update(
+            status='occupied',
+            current_patient=visit.patient,
+            start_time=now,
+            updated_at=now,
+        )
+        return visit
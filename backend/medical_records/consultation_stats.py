@@ -0,0 +1,150 @@
+# consultation_stats.py - Consultation durations folded into daily per-room and per-doctor buckets
+
+from bisect import bisect_left
+from datetime import timedelta
+from math import sqrt
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import ConsultationRoom, ConsultationStats
+
+EDGES = ConsultationStats.HISTOGRAM_EDGES
+# A room's average switches to today's mean once today has this many consultations;
+# until then it keeps the value carried over by reset_consultation_stats
+MIN_DAILY_SAMPLES = 5
+PERCENTILES = (50, 90, 95)
+
+def session_minutes(session):
+    """Length of a finished session in minutes, or None if it has not (sensibly) ended"""
+    if not session.start_time or not session.end_time:
+        return None
+    minutes = (session.end_time - session.start_time).total_seconds() / 60
+    return minutes if minutes >= 0 else None
+
+def empty_histogram():
+    return [0] * (len(EDGES) + 1)
+
+def add_sample(stats, minutes):
+    """Welford update of one bucket with a single duration"""
+    histogram = list(stats.histogram) or empty_histogram()
+    histogram[bisect_left(EDGES, minutes)] += 1
+    stats.histogram = histogram
+    stats.count += 1
+    delta = minutes - stats.mean
+    stats.mean += delta / stats.count
+    stats.m2 += delta * (minutes - stats.mean)
+    stats.minimum = minutes if stats.minimum is None else min(stats.minimum, minutes)
+    stats.maximum = minutes if stats.maximum is None else max(stats.maximum, minutes)
+
+def _locked_bucket(day, room=None, doctor=None):
+    # Insert-if-missing first so two sessions ending together share one row
+    ConsultationStats.objects.bulk_create(
+        [ConsultationStats(room=room, doctor=doctor, date=day, histogram=empty_histogram())],
+        ignore_conflicts=True,
+    )
+    return ConsultationStats.objects.select_for_update().get(room=room, doctor=doctor, date=day)
+
+def record_session(session):
+    """
+    Fold a finished session into its room's and its doctor's bucket for the day it ended
+
+    Room counters for today are refreshed from the room bucket in the same transaction,
+    so dashboards and wait estimates read plain columns. Returns the room bucket, or
+    None when the session has no usable duration.
+    """
+    minutes = session_minutes(session)
+    if minutes is None:
+        return None
+    day = timezone.localdate(session.end_time)
+
+    with transaction.atomic():
+        # Room bucket before doctor bucket, always, so concurrent sessions cannot deadlock
+        room_stats = _locked_bucket(day, room=session.room)
+        doctor_stats = _locked_bucket(day, doctor=session.doctor)
+        for stats in (room_stats, doctor_stats):
+            add_sample(stats, minutes)
+            stats.save()
+
+        if day == timezone.localdate():
+            average = round(room_stats.mean)
+            if room_stats.count < MIN_DAILY_SAMPLES:
+                average = Coalesce(F('average_consultation_time'), Value(average))
+            ConsultationRoom.objects.filter(pk=session.room_id).update(
+                total_consultations_today=room_stats.count,
+                average_consultation_time=average,
+            )
+    return room_stats
+
+def merge(buckets):
+    """Combine buckets into one summary using the pairwise (Chan et al.) variance update"""
+    count, mean, m2 = 0, 0.0, 0.0
+    minimum = maximum = None
+    histogram = empty_histogram()
+    for stats in buckets:
+        if not stats.count:
+            continue
+        total = count + stats.count
+        delta = stats.mean - mean
+        mean += delta * stats.count / total
+        m2 += stats.m2 + delta * delta * count * stats.count / total
+        count = total
+        minimum = stats.minimum if minimum is None else min(minimum, stats.minimum)
+        maximum = stats.maximum if maximum is None else max(maximum, stats.maximum)
+        for index, value in enumerate(stats.histogram):
+            histogram[index] += value
+    return {'count': count, 'mean': mean, 'm2': m2, 'minimum': minimum, 'maximum': maximum, 'histogram': histogram}
+
+def percentile(summary, q):
+    """q-th percentile estimated from the histogram, interpolating linearly within a bin"""
+    if not summary['count']:
+        return None
+    rank = q / 100 * summary['count']
+    seen = 0
+    for index, value in enumerate(summary['histogram']):
+        if value and seen + value >= rank:
+            lower = max(EDGES[index - 1] if index else 0, summary['minimum'])
+            upper = min(EDGES[index] if index < len(EDGES) else summary['maximum'], summary['maximum'])
+            return lower + (upper - lower) * max(rank - seen, 0) / value
+        seen += value
+    return summary['maximum']
+
+def window_stats(days, room=None, doctor=None):
+    """Duration statistics for a room or a doctor over the last `days` days, today included"""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    buckets = ConsultationStats.objects.filter(date__gte=since)
+    buckets = list(buckets.filter(room=room) if room is not None else buckets.filter(doctor=doctor))
+    summary = merge(buckets)
+
+    count = summary['count']
+    return {
+        'days': days,
+        'count': count,
+        'mean': round(summary['mean'], 1) if count else None,
+        'stddev': round(sqrt(summary['m2'] / (count - 1)), 1) if count > 1 else None,
+        'min': summary['minimum'],
+        'max': summary['maximum'],
+        'percentiles': {f'p{q}': round(percentile(summary, q), 1) if count else None for q in PERCENTILES},
+        'daily': [{'date': stats.date, 'count': stats.count, 'mean': round(stats.mean, 1)} for stats in buckets],
+    }
+
+def start_day(window_days=7, keep_days=400):
+    """
+    Daily reset: zero every room's count for today and carry over its mean over the last
+    `window_days` days as the average until today has enough consultations of its own.
+    Buckets older than `keep_days` are deleted.
+    """
+    today = timezone.localdate()
+    since = today - timedelta(days=window_days)
+    by_room = {}
+    for stats in ConsultationStats.objects.filter(room__isnull=False, date__gte=since, date__lt=today):
+        by_room.setdefault(stats.room_id, []).append(stats)
+
+    with transaction.atomic():
+        reset = ConsultationRoom.objects.update(total_consultations_today=0)
+        for room_id, buckets in by_room.items():
+            summary = merge(buckets)
+            if summary['count']:
+                ConsultationRoom.objects.filter(pk=room_id).update(average_consultation_time=round(summary['mean']))
+        pruned, _ = ConsultationStats.objects.filter(date__lt=today - timedelta(days=keep_days)).delete()
+    return {'rooms': reset, 'averaged': len(by_room), 'pruned': pruned}
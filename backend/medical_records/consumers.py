@@ -1,9 +1,24 @@
 import json
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.core.serializers.json import DjangoJSONEncoder
+from .events import EARLY_WARNING_GROUP, PHARMACY_QUEUE_GROUP, visit_group
+from .models import PharmacyQueue
+from .serializers import PharmacyQueueSerializer
 
 class VisitConsumer(AsyncWebsocketConsumer):
+    """
+    Visit lifecycle events for one scope, chosen by query string:
+    ?room=<id>, or any of ?clinic=<name>&location=<name>; no filters is the global feed.
+    """
     async def connect(self):
-        self.room_group_name = 'visits'
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.room_group_name = visit_group(
+            clinic=params.get('clinic', [None])[0],
+            location=params.get('location', [None])[0],
+            room=params.get('room', [None])[0],
+        )
 
         # Join room group
         await self.channel_layer.group_add(
@@ -24,11 +39,60 @@ class VisitConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         pass
 
-    # Receive message from room group
-    async def visit_update(self, event):
-        message = event['message']
+    # Receive event from the visit group
+    async def broadcast(self, event):
+        await self.send(text_data=json.dumps({
+            'type': event['event'],
+            'data': event['data']
+        }, cls=DjangoJSONEncoder))
+
+class PharmacyQueueConsumer(AsyncWebsocketConsumer):
+    """
+    Live pharmacy queue: a snapshot of open entries on connect, then the diffs
+    published by the queue transitions (see events.py) instead of client polling.
+    """
+    CLOSED_STATUSES = ['Dispensed']
+
+    async def connect(self):
+        # Join before reading the snapshot so no transition falls between the two
+        await self.channel_layer.group_add(PHARMACY_QUEUE_GROUP, self.channel_name)
+        await self.accept()
+        await self.send_json('queue.snapshot', await self.get_snapshot())
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(PHARMACY_QUEUE_GROUP, self.channel_name)
+
+    async def receive(self, text_data):
+        pass
+
+    @database_sync_to_async
+    def get_snapshot(self):
+        queryset = PharmacyQueue.objects.exclude(status__in=self.CLOSED_STATUSES).order_by('created_at')
+        return PharmacyQueueSerializer(PharmacyQueueSerializer.with_related(queryset), many=True).data
+
+    async def send_json(self, event_type, data):
+        await self.send(text_data=json.dumps({'type': event_type, 'data': data}, cls=DjangoJSONEncoder))
+
+    # Receive event from the pharmacy queue group
+    async def broadcast(self, event):
+        await self.send_json(event['event'], event['data'])
+
+class EarlyWarningConsumer(AsyncWebsocketConsumer):
+    """Early-warning risk band changes for every patient, as their vitals are recorded"""
+
+    async def connect(self):
+        await self.channel_layer.group_add(EARLY_WARNING_GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(EARLY_WARNING_GROUP, self.channel_name)
+
+    async def receive(self, text_data):
+        pass
 
-        # Send message to WebSocket
+    # Receive event from the early warning group
+    async def broadcast(self, event):
         await self.send(text_data=json.dumps({
-            'message': message
-        }))
\ No newline at end of file
+            'type': event['event'],
+            'data': event['data']
+        }, cls=DjangoJSONEncoder))
@@ -0,0 +1,90 @@
+# early_warning.py - Patients' current early-warning scores, kept as their vitals are written
+#
+# Readings are scored on the way in (VitalReading.score); record() then moves each
+# patient's PatientEarlyWarning row to their newest scored reading and pushes an alert
+# whenever that changes the patient's risk band.
+
+from django.db import transaction
+from .events import publish_early_warning
+from .models import PatientEarlyWarning, VitalReading
+
+RISK_RANK = {'Low': 0, 'Low-Medium': 1, 'Medium': 2, 'High': 3}
+
+def record(readings):
+    """
+    Make each patient's newest scored reading among `readings` their current score, unless
+    a newer one is already recorded. Returns the alerts published for changed risk bands.
+    """
+    newest = {}
+    for reading in readings:
+        if reading.early_warning_score is None:
+            continue
+        current = newest.get(reading.patient_id)
+        if current is None or (reading.date, reading.pk) > (current.date, current.pk):
+            newest[reading.patient_id] = reading
+    if not newest:
+        return []
+
+    alerts = []
+    with transaction.atomic():
+        previous = {
+            warning.patient_id: warning for warning in
+            PatientEarlyWarning.objects.select_for_update().filter(patient_id__in=newest).order_by('patient_id')
+        }
+        rows = []
+        for patient_id, reading in newest.items():
+            before = previous.get(patient_id)
+            # Readings from a monitor's buffer can arrive after a later manual one
+            if before is not None and before.scored_at > reading.date:
+                continue
+            rows.append(PatientEarlyWarning(
+                patient_id=patient_id, reading=reading, score=reading.early_warning_score,
+                risk=reading.early_warning_risk, scored_at=reading.date,
+            ))
+            previous_risk = before.risk if before is not None else 'Low'
+            if reading.early_warning_risk != previous_risk:
+                alerts.append({
+                    'patient': patient_id,
+                    'reading': reading.pk,
+                    'score': reading.early_warning_score,
+                    'risk': reading.early_warning_risk,
+                    'previous_score': before.score if before is not None else None,
+                    'previous_risk': before.risk if before is not None else None,
+                    'escalated': RISK_RANK[reading.early_warning_risk] > RISK_RANK[previous_risk],
+                    'scored_at': reading.date.isoformat(),
+                })
+        PatientEarlyWarning.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['patient'],
+            update_fields=['reading', 'score', 'risk', 'scored_at', 'updated_at'],
+        )
+        for alert in alerts:
+            publish_early_warning(alert)
+    return alerts
+
+def refresh(patient_id):
+    """Recompute a patient's current score from their remaining readings, e.g. after a delete"""
+    latest = VitalReading.objects.filter(
+        patient_id=patient_id, early_warning_score__isnull=False
+    ).order_by('-date', '-id').first()
+    if latest is None:
+        PatientEarlyWarning.objects.filter(patient_id=patient_id).delete()
+        return None
+    warning, _ = PatientEarlyWarning.objects.update_or_create(patient_id=patient_id, defaults={
+        'reading': latest, 'score': latest.early_warning_score,
+        'risk': latest.early_warning_risk, 'scored_at': latest.date,
+    })
+    return warning
+
+def at_risk(patient_ids=None, min_score=None):
+    """
+    Current warnings above Low (a score of 5 or more, or any single extreme parameter),
+    highest score first, optionally limited to `patient_ids` (a list or subquery)
+    """
+    warnings = PatientEarlyWarning.objects.exclude(risk='Low')
+    if patient_ids is not None:
+        warnings = warnings.filter(patient_id__in=patient_ids)
+    if min_score is not None:
+        warnings = warnings.filter(score__gte=min_score)
+    return warnings.select_related('patient').order_by('-score', '-scored_at')
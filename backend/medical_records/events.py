@@ -0,0 +1,149 @@
+# events.py - Push state changes to WebSocket groups once the writing transaction commits
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils.text import slugify
+import logging
+from .serializers import PharmacyQueueSerializer
+
+logger = logging.getLogger(__name__)
+
+PHARMACY_QUEUE_GROUP = 'pharmacy_queue'
+VISITS_GROUP = 'visits'
+EARLY_WARNING_GROUP = 'early_warnings'
+
+async def send_to_groups(channel_layer, groups, event_type, data):
+    """Deliver one event to each group; consumers relay it through their `broadcast` handler"""
+    message = {'type': 'broadcast', 'event': event_type, 'data': data}
+    for group in groups:
+        await channel_layer.group_send(group, message)
+
+def publish(groups, event_type, data):
+    """
+    Send {"type": event_type, "data": data} to every socket in `groups` after commit.
+
+    `groups` is a group name or an iterable of them. Publishing never fails the request:
+    a rolled back transaction sends nothing and a channel layer error is logged.
+    """
+    if isinstance(groups, str):
+        groups = [groups]
+    groups = sorted(groups)
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            async_to_sync(send_to_groups)(channel_layer, groups, event_type, data)
+        except Exception as e:
+            logger.error(f"Failed to publish {event_type} to {', '.join(groups)}: {str(e)}")
+
+    transaction.on_commit(send)
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+# PHARMACY QUEUE
+def pharmacy_queue_state(queue_item, items=None):
+    """Compact diff for a queue entry: its own state and, optionally, the items that changed"""
+    pharmacist = queue_item.assigned_pharmacist
+    state = {
+        'id': str(queue_item.id),
+        'status': queue_item.status,
+        'priority': queue_item.priority,
+        'assigned_pharmacist': str(pharmacist.id) if pharmacist else None,
+        'assigned_pharmacist_name': pharmacist.name if pharmacist else None,
+        'updated_at': _isoformat(queue_item.updated_at),
+    }
+    if items is not None:
+        state['items'] = [{
+            'id': str(item.id),
+            'status': item.status,
+            'dispensed_quantity': item.dispensed_quantity,
+            'dispensed_date': _isoformat(item.dispensed_date),
+            'substituted_with': str(item.substituted_with_id) if item.substituted_with_id else None,
+        } for item in items]
+    return state
+
+def publish_pharmacy_queue_created(queue_item):
+    # New entries go out in full once, so screens never need to refetch the nested tree
+    queue_item = PharmacyQueueSerializer.with_related(
+        type(queue_item).objects.filter(pk=queue_item.pk)
+    ).get()
+    publish(PHARMACY_QUEUE_GROUP, 'queue.created', PharmacyQueueSerializer(queue_item).data)
+
+def publish_pharmacy_queue_change(event, queue_item, items=None):
+    publish(PHARMACY_QUEUE_GROUP, f'queue.{event}', pharmacy_queue_state(queue_item, items))
+
+def publish_pharmacy_queue_removed(queue_id):
+    publish(PHARMACY_QUEUE_GROUP, 'queue.removed', {'id': str(queue_id)})
+
+# VISITS
+VISIT_EVENT_FIELDS = (
+    'patient_name', 'personal_number', 'clinic', 'visit_location', 'visit_type',
+    'priority', 'status', 'special_instructions', 'assigned_nurse',
+)
+
+def visit_group(clinic=None, location=None, room=None):
+    """
+    The single group a visit screen subscribes to for its scope.
+
+    A room screen only cares about its room; otherwise the scope is the location,
+    the clinic, both, or neither (the global feed).
+    """
+    if room:
+        return f'{VISITS_GROUP}.room.{slugify(str(room))}'
+    parts = [VISITS_GROUP]
+    if location:
+        parts += ['location', slugify(location)]
+    if clinic:
+        parts += ['clinic', slugify(clinic)]
+    return '.'.join(parts)
+
+def visit_groups(visit):
+    """Every scope a visit is visible in, so each subscriber receives it exactly once"""
+    groups = {
+        visit_group(),
+        visit_group(clinic=visit.clinic),
+        visit_group(location=visit.visit_location),
+        visit_group(clinic=visit.clinic, location=visit.visit_location),
+    }
+    if visit.consultation_room_id:
+        groups.add(visit_group(room=visit.consultation_room_id))
+    return groups
+
+def visit_state(visit):
+    """Compact visit representation built from the row alone (no related lookups)"""
+    state = {
+        'id': visit.id,
+        'patient': visit.patient_id,
+        'visit_date': _isoformat(visit.visit_date),
+        'visit_time': _isoformat(visit.visit_time),
+        'consultation_room': str(visit.consultation_room_id) if visit.consultation_room_id else None,
+        'nursing_received_at': _isoformat(visit.nursing_received_at),
+        'created_at': _isoformat(visit.created_at),
+        'updated_at': _isoformat(visit.updated_at),
+    }
+    state.update({field: getattr(visit, field) for field in VISIT_EVENT_FIELDS})
+    return state
+
+def publish_visit_event(change, visit, previous_groups=()):
+    """
+    Publish a visit lifecycle change ('created', 'updated', 'status' or 'deleted').
+
+    Pass the groups the visit was in before an update as `previous_groups` so screens
+    it moved away from (another room or clinic) hear about it too.
+    """
+    data = visit_state(visit)
+    data['change'] = change
+    event_type = 'visit.deleted' if change == 'deleted' else 'visit.update'
+    publish(visit_groups(visit) | set(previous_groups), event_type, data)
+
+def publish_room_queue(room, queue):
+    """Send a room's whole (short) queue to the screens subscribed to that room"""
+    publish(visit_group(room=room.pk), 'queue.update', {'room': str(room.pk), 'queue': queue})
+
+# EARLY WARNINGS
+def publish_early_warning(alert):
+    """A patient's early-warning risk band changed (see early_warning.record)"""
+    publish(EARLY_WARNING_GROUP, 'early_warning.changed', alert)
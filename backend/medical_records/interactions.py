@@ -0,0 +1,146 @@
+# interactions.py - Drug-interaction screening against the DrugInteraction rule table
+#
+# Every pattern term of every active rule is compiled into one Aho-Corasick automaton.
+# A medication is classified with a single pass over its normalized name, giving the set
+# of (rule, side) classes it belongs to; a list of medications then interacts wherever a
+# rule has members on both sides, so no medication pair or pattern is compared directly.
+# The compiled index is rebuilt only when the rule table changes.
+
+from collections import deque
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import Count, TextField, Value
+from django.db.models.functions import Cast, Concat, MD5
+import re
+import threading
+from .models import DrugInteraction
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+def normalize(text):
+    """Lowercase with runs of punctuation and whitespace collapsed to one space"""
+    return _NON_WORD.sub(' ', (text or '').lower()).strip()
+
+class PatternIndex:
+    """Aho-Corasick automaton mapping terms to labels; search() finds every term in one pass"""
+
+    def __init__(self, terms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [frozenset()]
+        for term, labels in terms.items():
+            node = 0
+            for char in term:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(frozenset())
+                node = child
+            self.output[node] |= labels
+
+        # Breadth-first, so each failure link points at an already finished node
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+
+    def search(self, text):
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            found |= self.output[node]
+        return found
+
+class InteractionIndex:
+    """Compiled active rules: the pattern automaton plus the rules by id"""
+
+    def __init__(self, rules):
+        self.rules = {rule.id: rule for rule in rules}
+        terms = {}
+        for rule in rules:
+            for side, patterns in ((1, rule.drug1_patterns), (2, rule.drug2_patterns)):
+                for pattern in patterns:
+                    term = normalize(pattern)
+                    if term:
+                        terms[term] = terms.get(term, frozenset()) | {(rule.id, side)}
+        self.patterns = PatternIndex(terms)
+
+    def classify(self, medication):
+        """(rule id, side) classes `medication` belongs to, from its name and generic name"""
+        return self.patterns.search(f'{normalize(medication.name)} | {normalize(medication.generic_name)}')
+
+    def interactions(self, medications):
+        """Interacting pairs among `medications`, earlier medication first, in rule order"""
+        medications = list({medication.pk: medication for medication in medications}.values())
+        members = {}
+        for position, medication in enumerate(medications):
+            for rule_id, side in self.classify(medication):
+                members.setdefault(rule_id, ({}, {}))[side - 1][position] = medication
+
+        found = []
+        for rule_id in sorted(members):
+            first, second = members[rule_id]
+            if not first or not second:
+                continue
+            rule = self.rules[rule_id]
+            pairs = {
+                tuple(sorted((a, b))) for a in first for b in second if a != b
+            }
+            for a, b in sorted(pairs):
+                found.append(interaction_data(rule, medications[a], medications[b]))
+        return found
+
+def interaction_data(rule, drug1, drug2):
+    return {
+        'drug1': drug1.name,
+        'drug2': drug2.name,
+        'drug1_id': str(drug1.pk),
+        'drug2_id': str(drug2.pk),
+        'severity': rule.severity,
+        'description': rule.description,
+        'recommendation': rule.recommendation,
+    }
+
+_cache = {'version': None, 'index': None}
+_cache_lock = threading.Lock()
+
+def rules_version():
+    """
+    Changes whenever a rule is added, edited or deleted
+
+    The signature hashes the rule columns themselves rather than trusting updated_at, which
+    a queryset update() leaves untouched.
+    """
+    row = Concat(
+        Cast('id', TextField()), Value('|'), Cast('is_active', TextField()), Value('|'), 'severity', Value('|'),
+        Cast('drug1_patterns', TextField()), Value('|'), Cast('drug2_patterns', TextField()), Value('|'),
+        'description', Value('|'), 'recommendation',
+        output_field=TextField()
+    )
+    state = DrugInteraction.objects.aggregate(
+        count=Count('id'), signature=MD5(StringAgg(row, delimiter='\n', ordering='id'))
+    )
+    return state['count'], state['signature']
+
+def interaction_index():
+    """The compiled index for the current rule table, rebuilt only after the rules change"""
+    version = rules_version()
+    with _cache_lock:
+        if _cache['version'] != version:
+            _cache['index'] = InteractionIndex(list(DrugInteraction.objects.filter(is_active=True)))
+            _cache['version'] = version
+        return _cache['index']
+
+def find_interactions(medications):
+    return interaction_index().interactions(medications)
@@ -0,0 +1,18 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from medical_records.usage_rollup import rebuild
+
+class Command(BaseCommand):
+    help = "Rebuild the daily medication usage rollup from the stock transaction ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only rebuild the last N days (default: the whole ledger)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days']:
+            since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        written = rebuild(since)
+        covered = f"since {since}" if since else "for the whole ledger"
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} medication usage day(s) {covered}."))
@@ -0,0 +1,114 @@
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer, channel_layers
+from django.core.management.base import BaseCommand
+from datetime import date, time
+from statistics import median, quantiles
+from time import perf_counter
+from urllib.parse import urlencode
+import asyncio
+import random
+from medical_records.consumers import VisitConsumer
+from medical_records.events import send_to_groups, visit_group, visit_groups, visit_state
+from medical_records.models import Visit
+
+BENCHMARK_LAYER = 'visit-fanout-benchmark'
+
+class BenchmarkVisitConsumer(VisitConsumer):
+    channel_layer_alias = BENCHMARK_LAYER
+
+class Command(BaseCommand):
+    help = "Measure visit event fan-out to scoped VisitConsumer sockets over an in-memory channel layer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=500, help='Concurrent sockets to connect')
+        parser.add_argument('--events', type=int, default=200, help='Visit events to publish')
+        parser.add_argument('--rooms', type=int, default=20, help='Consultation rooms to spread room screens over')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        stats = asyncio.run(self.run(options['sockets'], options['events'], options['rooms'], random.Random(options['seed'])))
+
+        self.stdout.write(
+            f"{options['sockets']} sockets, {options['events']} events, "
+            f"{stats['deliveries']} deliveries ({stats['deliveries'] / options['events']:.1f} per event)"
+        )
+        self.stdout.write(f"publish  p50 {stats['publish_p50']:.2f} ms  p95 {stats['publish_p95']:.2f} ms")
+        self.stdout.write(f"delivery p50 {stats['delivery_p50']:.2f} ms  p95 {stats['delivery_p95']:.2f} ms")
+        self.stdout.write(f"throughput {stats['deliveries'] / stats['elapsed']:.0f} deliveries/s")
+        if stats['misrouted']:
+            self.stdout.write(self.style.ERROR(f"{stats['misrouted']} socket(s) received events outside their scope"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Every socket received exactly the events in its scope."))
+
+    def subscription(self, index, rooms, rng):
+        """Mix of screen scopes: room screens, clinic, location, clinic at a location and a few global dashboards"""
+        clinic = rng.choice(Visit.CLINICS)[0]
+        location = rng.choice(Visit.LOCATIONS)[0]
+        return [
+            {'room': rng.randint(1, rooms)},
+            {'clinic': clinic},
+            {'location': location},
+            {'clinic': clinic, 'location': location},
+            {} if index % 25 == 0 else {'room': rng.randint(1, rooms)},
+        ][index % 5]
+
+    async def run(self, socket_count, event_count, rooms, rng):
+        layer = InMemoryChannelLayer(capacity=max(100, event_count))
+        channel_layers.set(BENCHMARK_LAYER, layer)
+        application = BenchmarkVisitConsumer.as_asgi()
+
+        sockets = []
+        for index in range(socket_count):
+            filters = self.subscription(index, rooms, rng)
+            communicator = ApplicationCommunicator(application, {
+                'type': 'websocket', 'path': '/ws/visits/', 'headers': [], 'subprotocols': [],
+                'query_string': urlencode(filters).encode(),
+            })
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(timeout=5)
+            sockets.append((communicator, visit_group(**filters)))
+
+        publish_times, delivery_times, deliveries = [], [], 0
+        started = perf_counter()
+        for event_id in range(1, event_count + 1):
+            visit = Visit(
+                id=event_id, patient_id=event_id, visit_date=date.today(), visit_time=time(9, 0),
+                clinic=rng.choice(Visit.CLINICS)[0], visit_location=rng.choice(Visit.LOCATIONS)[0],
+                consultation_room_id=rng.choice([None, rng.randint(1, rooms)]),
+                visit_type='consultation', status='Scheduled', patient_name='Benchmark Patient',
+            )
+            groups = visit_groups(visit)
+            recipients = [communicator for communicator, group in sockets if group in groups]
+
+            start = perf_counter()
+            await send_to_groups(layer, groups, 'visit.update', visit_state(visit))
+            published = perf_counter()
+            for communicator in recipients:
+                await communicator.receive_output(timeout=5)
+            delivered = perf_counter()
+
+            publish_times.append((published - start) * 1000)
+            delivery_times.append((delivered - start) * 1000)
+            deliveries += len(recipients)
+        elapsed = perf_counter() - started
+
+        # Anything still queued went to a socket outside the event's scope
+        stray = await asyncio.gather(*[communicator.receive_nothing(timeout=0.2) for communicator, _ in sockets])
+        misrouted = stray.count(False)
+
+        for communicator, _ in sockets:
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+
+        def p95(samples):
+            return quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+
+        return {
+            'deliveries': deliveries,
+            'elapsed': elapsed,
+            'misrouted': misrouted,
+            'publish_p50': median(publish_times),
+            'publish_p95': p95(publish_times),
+            'delivery_p50': median(delivery_times),
+            'delivery_p95': p95(delivery_times),
+        }
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from medical_records.patient_import import PatientImporter, ROW_READERS
+
+class Command(BaseCommand):
+    help = "Stream an HR roster export (CSV or NDJSON) into the patient register"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the CSV or NDJSON file')
+        parser.add_argument('--format', choices=list(ROW_READERS), help='File format (defaults to the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows validated and written per chunk')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        try:
+            with open(path, 'rb') as stream:
+                report = PatientImporter(chunk_size=options['chunk_size']).run(ROW_READERS[file_format](stream))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']}, updated {report['updated']}, {len(report['errors'])} row(s) rejected."
+        ))
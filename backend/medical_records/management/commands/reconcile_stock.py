@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from medical_records.stock_ledger import reconcile_stock
+
+class Command(BaseCommand):
+    help = "Compare Medication.current_stock against the batch table and optionally correct drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Overwrite drifted totals and record Adjusted transactions')
+
+    def handle(self, *args, **options):
+        results = reconcile_stock(fix=options['fix'])
+
+        for medication, recorded_stock, batch_stock in results:
+            self.stdout.write(f"{medication}: recorded {recorded_stock}, batches {batch_stock} ({batch_stock - recorded_stock:+d})")
+
+        if not results:
+            self.stdout.write(self.style.SUCCESS("All medication stock totals match their batches."))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Corrected {len(results)} medication(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(results)} medication(s) drifted; rerun with --fix to correct."))
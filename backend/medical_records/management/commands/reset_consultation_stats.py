@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from medical_records.consultation_stats import start_day
+
+class Command(BaseCommand):
+    help = "Reset rooms' daily consultation counters and carry over their recent average (run just after midnight)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, default=7, help='Days of history the carried-over average covers')
+        parser.add_argument('--keep-days', type=int, default=400, help='Delete daily buckets older than this')
+
+    def handle(self, *args, **options):
+        result = start_day(options['window_days'], options['keep_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Reset {result['rooms']} room(s); carried over averages for {result['averaged']}; "
+            f"pruned {result['pruned']} old bucket(s)."
+        ))
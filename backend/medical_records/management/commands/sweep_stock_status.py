@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from medical_records.stock_ledger import sweep_expiry
+
+class Command(BaseCommand):
+    help = "Roll batch and medication expiry statuses forward and write off expired stock (run nightly)"
+
+    def handle(self, *args, **options):
+        result = sweep_expiry()
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {result['expired']}, near expiry {result['near_expiry']}, depleted {result['depleted']} batch(es); "
+            f"refreshed {result['medications']} medication status(es)."
+        ))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:43
+
+from django.db import migrations, models
+from django.db.models import Case, Exists, F, OuterRef, Value, When
+
+
+def populate_medication_status(apps, schema_editor):
+    Medication = apps.get_model('medical_records', 'Medication')
+    MedicationBatch = apps.get_model('medical_records', 'MedicationBatch')
+
+    def has_batches(batch_status):
+        return Exists(MedicationBatch.objects.filter(
+            medication=OuterRef('pk'), status=batch_status, remaining_tablets__gt=0
+        ))
+
+    Medication.objects.update(status=Case(
+        When(has_batches('Expired'), then=Value('Expired')),
+        When(current_stock__lte=0, then=Value('Out of Stock')),
+        When(has_batches('Near Expiry'), then=Value('Near Expiry')),
+        When(current_stock__lte=F('minimum_stock'), then=Value('Low Stock')),
+        default=Value('In Stock')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0012_alter_patient_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medication',
+            name='status',
+            field=models.CharField(choices=[('In Stock', 'In Stock'), ('Low Stock', 'Low Stock'), ('Out of Stock', 'Out of Stock'), ('Near Expiry', 'Near Expiry'), ('Expired', 'Expired')], default='Out of Stock', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='medicationbatch',
+            name='status',
+            field=models.CharField(choices=[('Active', 'Active'), ('Near Expiry', 'Near Expiry'), ('Depleted', 'Depleted'), ('Expired', 'Expired'), ('Recalled', 'Recalled')], default='Active', max_length=20),
+        ),
+        migrations.RunPython(populate_medication_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0013_medication_status_alter_medicationbatch_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicationbatch',
+            index=models.Index(fields=['medication', 'status', 'remaining_tablets'], name='medical_rec_medicat_35913e_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:44
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    Patient = apps.get_model('medical_records', 'Patient')
+    PatientIdSequence = apps.get_model('medical_records', 'PatientIdSequence')
+
+    last_values = {}
+    for patient_id in Patient.objects.exclude(patient_id__isnull=True).values_list('patient_id', flat=True).iterator():
+        prefix, _, serial = patient_id.rpartition('-')
+        if prefix and serial.isdigit():
+            last_values[prefix] = max(last_values.get(prefix, 0), int(serial))
+
+    PatientIdSequence.objects.bulk_create(
+        [PatientIdSequence(prefix=prefix, last_value=last_value) for prefix, last_value in last_values.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0014_medicationbatch_medical_rec_medicat_35913e_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientIdSequence',
+            fields=[
+                ('prefix', models.CharField(max_length=120, primary_key=True, serialize=False)),
+                ('last_value', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Patient ID Sequence',
+                'verbose_name_plural': 'Patient ID Sequences',
+                'db_table': 'patient_id_sequences',
+            },
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:46
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0016_patient_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medication',
+            name='barcode',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='medication',
+            name='category',
+            field=models.CharField(choices=[('Antibiotics', 'Antibiotics'), ('Analgesics', 'Analgesics'), ('Cardiovascular', 'Cardiovascular'), ('Diabetes', 'Diabetes'), ('Respiratory', 'Respiratory'), ('Vitamins', 'Vitamins'), ('Gastrointestinal', 'Gastrointestinal'), ('Dermatology', 'Dermatology'), ('Neurology', 'Neurology'), ('Other', 'Other')], db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='medication',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='medication_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='medication',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('generic_name'), name='gin_trgm_ops'), name='medication_generic_name_trgm'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0017_medication_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='medicalreport',
+            options={'ordering': ['-date', '-id'], 'verbose_name': 'Medical Report', 'verbose_name_plural': 'Medical Reports'},
+        ),
+        migrations.AlterModelOptions(
+            name='stocktransaction',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AlterModelOptions(
+            name='timelineevent',
+            options={'ordering': ['-date', '-time', '-id'], 'verbose_name': 'Timeline Event', 'verbose_name_plural': 'Timeline Events'},
+        ),
+        migrations.AlterModelOptions(
+            name='visit',
+            options={'ordering': ['-visit_date', '-visit_time', '-id'], 'verbose_name': 'Visit', 'verbose_name_plural': 'Visits'},
+        ),
+        migrations.AlterModelOptions(
+            name='vitalreading',
+            options={'ordering': ['-date', '-id'], 'verbose_name': 'Vital Reading', 'verbose_name_plural': 'Vital Readings'},
+        ),
+        migrations.AddIndex(
+            model_name='medicalreport',
+            index=models.Index(fields=['patient', '-date', '-id'], name='medical_rec_patient_c6917e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalreport',
+            index=models.Index(fields=['-date', '-id'], name='medical_rec_date_92e478_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['-created_at', '-id'], name='medical_rec_created_82bdae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stocktransaction',
+            index=models.Index(fields=['medication', '-created_at', '-id'], name='medical_rec_medicat_27274d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineevent',
+            index=models.Index(fields=['patient', '-date', '-time', '-id'], name='medical_rec_patient_bbedb4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineevent',
+            index=models.Index(fields=['-date', '-time', '-id'], name='medical_rec_date_293d20_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['patient', '-visit_date', '-visit_time', '-id'], name='medical_rec_patient_9c35c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['-visit_date', '-visit_time', '-id'], name='medical_rec_visit_d_7a84ec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vitalreading',
+            index=models.Index(fields=['patient', '-date', '-id'], name='medical_rec_patient_8e71ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vitalreading',
+            index=models.Index(fields=['-date', '-id'], name='medical_rec_date_889ecf_idx'),
+        ),
+    ]
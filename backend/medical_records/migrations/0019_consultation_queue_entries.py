@@ -0,0 +1,108 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:59
+
+import django.db.models.constraints
+import django.db.models.deletion
+import django.utils.timezone
+from django.utils.dateparse import parse_datetime
+from django.db import migrations, models
+
+
+PRIORITIES = ('Low', 'Medium', 'High', 'Emergency')
+
+
+def _queued_visit_id(item):
+    # Screens stored the visit id under 'patient_id'; accept the explicit keys too
+    for key in ('visit_id', 'visit', 'patient_id'):
+        value = item.get(key)
+        if value is not None and str(value).isdigit():
+            return int(value)
+    return None
+
+
+def _enqueued_at(item):
+    try:
+        return parse_datetime(str(item.get('assignedAt') or item.get('enqueued_at') or ''))
+    except ValueError:
+        return None
+
+
+def queue_arrays_to_entries(apps, schema_editor):
+    ConsultationRoom = apps.get_model('medical_records', 'ConsultationRoom')
+    ConsultationQueueEntry = apps.get_model('medical_records', 'ConsultationQueueEntry')
+    Visit = apps.get_model('medical_records', 'Visit')
+
+    rooms = ConsultationRoom.objects.exclude(queue__isnull=True).exclude(queue=[])
+    queued = set()
+    entries = []
+    for room in rooms.iterator():
+        items = [item for item in room.queue if isinstance(item, dict)]
+        # Keep the stored order, using each item's own position where it has one
+        items = sorted(enumerate(items), key=lambda pair: (pair[1].get('position') or pair[0] + 1, pair[0]))
+        visit_ids = [_queued_visit_id(item) for _, item in items]
+        visits = Visit.objects.in_bulk([visit_id for visit_id in visit_ids if visit_id is not None])
+
+        position = 0
+        for (_, item), visit_id in zip(items, visit_ids):
+            visit = visits.get(visit_id)
+            # A visit can only wait in one room; the first room that listed it keeps it
+            if visit is None or visit.pk in queued:
+                continue
+            queued.add(visit.pk)
+            position += 1
+            entries.append(ConsultationQueueEntry(
+                room=room,
+                visit=visit,
+                position=position,
+                priority=item['priority'] if item.get('priority') in PRIORITIES else visit.priority,
+                enqueued_at=_enqueued_at(item) or visit.created_at,
+            ))
+
+    ConsultationQueueEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def entries_to_queue_arrays(apps, schema_editor):
+    ConsultationRoom = apps.get_model('medical_records', 'ConsultationRoom')
+    ConsultationQueueEntry = apps.get_model('medical_records', 'ConsultationQueueEntry')
+
+    queues = {}
+    for room_id, visit_id in ConsultationQueueEntry.objects.order_by('room', 'position').values_list('room_id', 'visit_id'):
+        queue = queues.setdefault(room_id, [])
+        queue.append({'patient_id': str(visit_id), 'position': len(queue) + 1})
+
+    rooms = list(ConsultationRoom.objects.filter(pk__in=queues))
+    for room in rooms:
+        room.queue = queues[room.pk]
+    ConsultationRoom.objects.bulk_update(rooms, ['queue'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0018_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultationQueueEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('priority', models.CharField(choices=[('Low', 'Low'), ('Medium', 'Medium'), ('High', 'High'), ('Emergency', 'Emergency')], default='Medium', max_length=10)),
+                ('enqueued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_entries', to='medical_records.consultationroom')),
+                ('visit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='queue_entry', to='medical_records.visit')),
+            ],
+            options={
+                'verbose_name': 'Consultation Queue Entry',
+                'verbose_name_plural': 'Consultation Queue Entries',
+                'db_table': 'consultation_queue_entries',
+                'ordering': ['room', 'position'],
+                'constraints': [models.UniqueConstraint(deferrable=django.db.models.constraints.Deferrable['DEFERRED'], fields=('room', 'position'), name='unique_queue_position')],
+            },
+        ),
+        migrations.RunPython(queue_arrays_to_entries, entries_to_queue_arrays),
+        migrations.RemoveField(
+            model_name='consultationroom',
+            name='queue',
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:04
+
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import Case, DurationField, ExpressionWrapper, Value, When
+from django.db.models.functions import Coalesce
+
+
+TRIAGE_HEADSTART = {
+    'Low': timedelta(0),
+    'Medium': timedelta(minutes=20),
+    'High': timedelta(hours=1),
+    'Emergency': timedelta(days=1),
+}
+
+
+def fill_triage_due_at(apps, schema_editor):
+    Visit = apps.get_model('medical_records', 'Visit')
+    headstart = Case(
+        *[When(priority=priority, then=Value(delta)) for priority, delta in TRIAGE_HEADSTART.items()],
+        default=Value(timedelta(0)),
+        output_field=DurationField(),
+    )
+    Visit.objects.update(triage_due_at=ExpressionWrapper(
+        Coalesce('nursing_received_at', 'created_at') - headstart,
+        output_field=models.DateTimeField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0019_consultation_queue_entries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='triage_due_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_triage_due_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='visit',
+            name='status',
+            field=models.CharField(choices=[('Scheduled', 'Scheduled'), ('Confirmed', 'Confirmed'), ('In Progress', 'In Progress'), ('In Nursing Pool', 'In Nursing Pool'), ('Queued', 'Queued'), ('Completed', 'Completed'), ('Cancelled', 'Cancelled'), ('Rescheduled', 'Rescheduled')], default='Scheduled', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(condition=models.Q(('consultation_room__isnull', True), ('status', 'In Nursing Pool')), fields=['clinic', 'triage_due_at', 'id'], name='visit_triage_pool_idx'),
+        ),
+    ]
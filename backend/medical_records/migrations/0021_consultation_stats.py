@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:07
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0020_visit_triage_pool'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0)),
+                ('minimum', models.FloatField(blank=True, null=True)),
+                ('maximum', models.FloatField(blank=True, null=True)),
+                ('histogram', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), default=list, size=None)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='consultation_stats', to='medical_records.user')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='consultation_stats', to='medical_records.consultationroom')),
+            ],
+            options={
+                'verbose_name': 'Consultation Stats',
+                'verbose_name_plural': 'Consultation Stats',
+                'db_table': 'consultation_stats',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('room__isnull', False)), fields=('room', 'date'), name='unique_room_stats_day'), models.UniqueConstraint(condition=models.Q(('doctor__isnull', False)), fields=('doctor', 'date'), name='unique_doctor_stats_day'), models.CheckConstraint(condition=models.Q(models.Q(('doctor__isnull', False), ('room__isnull', True)), models.Q(('doctor__isnull', True), ('room__isnull', False)), _connector='OR'), name='stats_room_xor_doctor')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:08
+
+from django.db import migrations, models
+
+
+FILL_COUNTERS = """
+UPDATE medical_records_prescription AS prescription
+SET total_items = counts.total_items,
+    available_items = counts.available_items,
+    out_of_stock_items = counts.out_of_stock_items,
+    dispensed_items = counts.dispensed_items
+FROM (
+    SELECT prescription_id,
+           COUNT(*) AS total_items,
+           COUNT(*) FILTER (WHERE status IN ('Available', 'Substituted')) AS available_items,
+           COUNT(*) FILTER (WHERE status = 'Out of Stock') AS out_of_stock_items,
+           COUNT(*) FILTER (WHERE status = 'Dispensed') AS dispensed_items
+    FROM medical_records_prescriptionitem
+    GROUP BY prescription_id
+) AS counts
+WHERE prescription.id = counts.prescription_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0021_consultation_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prescription',
+            name='available_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='dispensed_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='out_of_stock_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(FILL_COUNTERS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:10
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+# The rules utils.get_drug_interactions used to hardcode
+SEED_RULES = [
+    (['warfarin'], ['aspirin', 'ibuprofen'], 'Major',
+     'Increased risk of bleeding',
+     'Monitor INR closely and consider alternative pain management'),
+    (['metformin'], ['contrast'], 'Major',
+     'Risk of lactic acidosis',
+     'Discontinue metformin 48 hours before contrast administration'),
+    (['ace inhibitor', 'lisinopril', 'losartan'], ['ibuprofen', 'nsaid'], 'Moderate',
+     'NSAIDs may reduce effectiveness of ACE inhibitors/ARBs',
+     'Monitor blood pressure and consider alternative pain relief'),
+    (['digoxin'], ['amiodarone'], 'Major',
+     'Increased digoxin levels leading to toxicity',
+     'Reduce digoxin dose and monitor levels closely'),
+    (['lithium'], ['furosemide', 'thiazide'], 'Major',
+     'Increased risk of lithium toxicity',
+     'Monitor lithium levels and adjust dose as needed'),
+]
+
+
+def seed_rules(apps, schema_editor):
+    DrugInteraction = apps.get_model('medical_records', 'DrugInteraction')
+    DrugInteraction.objects.bulk_create([
+        DrugInteraction(
+            drug1_patterns=drug1, drug2_patterns=drug2, severity=severity,
+            description=description, recommendation=recommendation,
+        ) for drug1, drug2, severity, description, recommendation in SEED_RULES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0022_prescription_item_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugInteraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('drug1_patterns', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), size=None)),
+                ('drug2_patterns', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), size=None)),
+                ('severity', models.CharField(choices=[('Minor', 'Minor'), ('Moderate', 'Moderate'), ('Major', 'Major')], max_length=10)),
+                ('description', models.TextField()),
+                ('recommendation', models.TextField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Drug Interaction',
+                'verbose_name_plural': 'Drug Interactions',
+                'db_table': 'drug_interactions',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(seed_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:11
+
+import django.db.models.deletion
+import re
+from datetime import timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Frozen copy of active_medications.course_length as of this migration
+UNITS = {'day': 1, 'd': 1, 'week': 7, 'wk': 7, 'w': 7, 'month': 30, 'mo': 30, 'm': 30, 'year': 365, 'y': 365}
+FRACTIONS = {'7': 1, '52': 7, '12': 30}
+DEFAULT_COURSE = timedelta(days=30)
+GRACE = timedelta(days=7)
+# Longest course the backfill looks back for
+LOOKBACK = timedelta(days=400)
+
+
+def course_length(duration):
+    text = (duration or '').strip().lower()
+    match = re.match(r'^(\d+)\s*/\s*(7|52|12)\b', text)
+    if match:
+        return timedelta(days=int(match.group(1)) * FRACTIONS[match.group(2)])
+    match = re.match(r'^(\d+)\s*([a-z]+)', text)
+    if match:
+        unit = match.group(2) if match.group(2) in UNITS else match.group(2).rstrip('s')
+        if unit in UNITS:
+            return timedelta(days=int(match.group(1)) * UNITS[unit])
+    return DEFAULT_COURSE
+
+
+def fill_active_medications(apps, schema_editor):
+    PrescriptionItem = apps.get_model('medical_records', 'PrescriptionItem')
+    PatientActiveMedication = apps.get_model('medical_records', 'PatientActiveMedication')
+    now = timezone.now()
+
+    items = PrescriptionItem.objects.filter(
+        status='Dispensed', dispensed_date__gte=now - LOOKBACK
+    ).exclude(prescription__status='Cancelled').select_related('prescription__visit').order_by('dispensed_date')
+    rows = {}
+    for item in items.iterator():
+        active_until = item.dispensed_date + course_length(item.duration) + GRACE
+        if active_until < now:
+            continue
+        # Ordered by dispense date, so the latest course of a medication wins
+        rows[(item.prescription.visit.patient_id, item.medication_id)] = PatientActiveMedication(
+            patient_id=item.prescription.visit.patient_id,
+            medication_id=item.medication_id,
+            prescription_id=item.prescription_id,
+            dispensed_at=item.dispensed_date,
+            active_until=active_until,
+        )
+    PatientActiveMedication.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0023_drug_interactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientActiveMedication',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dispensed_at', models.DateTimeField()),
+                ('active_until', models.DateTimeField()),
+                ('medication', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_patients', to='medical_records.medication')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_medications', to='medical_records.patient')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_medications', to='medical_records.prescription')),
+            ],
+            options={
+                'verbose_name': 'Patient Active Medication',
+                'verbose_name_plural': 'Patient Active Medications',
+                'db_table': 'patient_active_medications',
+                'indexes': [models.Index(fields=['patient', 'active_until'], name='patient_act_patient_c96bed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'medication'), name='unique_patient_active_medication')],
+            },
+        ),
+        migrations.RunPython(fill_active_medications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0024_patient_active_medications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicationUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('dispensed', models.PositiveIntegerField(default=0)),
+                ('dispense_count', models.PositiveIntegerField(default=0)),
+                ('restocked', models.PositiveIntegerField(default=0)),
+                ('expired', models.PositiveIntegerField(default=0)),
+                ('adjusted', models.IntegerField(default=0)),
+                ('returned', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('medication', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_days', to='medical_records.medication')),
+            ],
+            options={
+                'verbose_name': 'Medication Usage (daily)',
+                'verbose_name_plural': 'Medication Usage (daily)',
+                'db_table': 'medication_usage_daily',
+                'ordering': ['medication', 'date'],
+                'indexes': [models.Index(fields=['date', 'medication'], name='usage_daily_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medication', 'date'), name='unique_medication_usage_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0025_medication_usage_daily'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vitalreading',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
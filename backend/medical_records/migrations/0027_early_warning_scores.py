@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:19
+
+import django.db.models.deletion
+from bisect import bisect_left
+from django.db import migrations, models
+
+
+# Frozen copy of VitalReading.EARLY_WARNING_BANDS and VitalReading.score as of this migration
+BANDS = {
+    'respiratory_rate': ((8, 11, 20, 24), (3, 1, 0, 2, 3)),
+    'oxygen_saturation': ((91, 93, 95), (3, 2, 1, 0)),
+    'systolic': ((90, 100, 110, 219), (3, 2, 1, 0, 3)),
+    'heart_rate': ((40, 50, 90, 110, 130), (3, 1, 0, 1, 2, 3)),
+    'temperature': ((35.0, 36.0, 38.0, 39.0), (3, 1, 0, 1, 2)),
+}
+BATCH_SIZE = 1000
+
+
+def early_warning(reading):
+    total, red_flag = None, False
+    for field, (bounds, points) in BANDS.items():
+        value = getattr(reading, field)
+        if value is None:
+            continue
+        scored = points[bisect_left(bounds, value)]
+        total = (total or 0) + scored
+        red_flag = red_flag or scored == 3
+    if total is None:
+        return None, ''
+    if total >= 7:
+        return total, 'High'
+    if total >= 5:
+        return total, 'Medium'
+    return total, 'Low-Medium' if red_flag else 'Low'
+
+
+def score_readings(apps, schema_editor):
+    VitalReading = apps.get_model('medical_records', 'VitalReading')
+    PatientEarlyWarning = apps.get_model('medical_records', 'PatientEarlyWarning')
+
+    scored = models.Q()
+    for field in BANDS:
+        scored |= models.Q(**{f'{field}__isnull': False})
+    batch = []
+    for reading in VitalReading.objects.filter(scored).only('id', *BANDS).iterator(chunk_size=BATCH_SIZE):
+        reading.early_warning_score, reading.early_warning_risk = early_warning(reading)
+        batch.append(reading)
+        if len(batch) == BATCH_SIZE:
+            VitalReading.objects.bulk_update(batch, ['early_warning_score', 'early_warning_risk'])
+            batch = []
+    VitalReading.objects.bulk_update(batch, ['early_warning_score', 'early_warning_risk'])
+
+    latest = VitalReading.objects.filter(early_warning_score__isnull=False).order_by(
+        'patient_id', '-date', '-id'
+    ).distinct('patient_id').only('id', 'patient_id', 'date', 'early_warning_score', 'early_warning_risk')
+    PatientEarlyWarning.objects.bulk_create([
+        PatientEarlyWarning(
+            patient_id=reading.patient_id, reading_id=reading.id, score=reading.early_warning_score,
+            risk=reading.early_warning_risk, scored_at=reading.date,
+        )
+        for reading in latest.iterator(chunk_size=BATCH_SIZE)
+    ], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0026_vital_reading_taken_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vitalreading',
+            name='early_warning_risk',
+            field=models.CharField(blank=True, choices=[('Low', 'Low'), ('Low-Medium', 'Low-Medium'), ('Medium', 'Medium'), ('High', 'High')], editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='vitalreading',
+            name='early_warning_score',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='PatientEarlyWarning',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='early_warning', serialize=False, to='medical_records.patient')),
+                ('score', models.PositiveSmallIntegerField()),
+                ('risk', models.CharField(choices=[('Low', 'Low'), ('Low-Medium', 'Low-Medium'), ('Medium', 'Medium'), ('High', 'High')], max_length=10)),
+                ('scored_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reading', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='medical_records.vitalreading')),
+            ],
+            options={
+                'verbose_name': 'Patient Early Warning',
+                'verbose_name_plural': 'Patient Early Warnings',
+                'db_table': 'patient_early_warnings',
+                'ordering': ['-score', '-scored_at'],
+                'indexes': [models.Index(condition=models.Q(('risk', 'Low'), _negated=True), fields=['-score', '-scored_at'], name='early_warning_at_risk_idx')],
+            },
+        ),
+        migrations.RunPython(score_readings, migrations.RunPython.noop),
+    ]
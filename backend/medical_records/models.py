@@ -1,12 +1,15 @@
 # models.py
-from django.db import models
+from django.db import models, transaction, connection
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import ArrayField
-from django.db.models import Sum, F
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
+from django.db.models import Sum, F, Q, Count
 import uuid
-from datetime import datetime
+from bisect import bisect_left
+from datetime import datetime, timedelta
 
 class User(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -96,46 +99,65 @@ class Patient(models.Model):
         if self.date_of_birth and self.date_of_birth > timezone.now().date():
             raise ValidationError("Date of birth cannot be in the future.")
 
+        sponsor = None
         if self.patient_type == 'Dependent':
             if not self.sponsor_id:
                 raise ValidationError("Sponsor ID is required for dependents.")
-            try:
-                sponsor = Patient.objects.get(id=self.sponsor_id)
-                if sponsor.patient_type not in ['Employee', 'Retiree']:
-                    raise ValidationError("Sponsor must be either Employee or Retiree.")
-                dependent_count = Patient.objects.filter(patient_type='Dependent', sponsor_id=self.sponsor_id).exclude(id=self.pk).count() if self.pk else Patient.objects.filter(patient_type='Dependent', sponsor_id=self.sponsor_id).count()
-                serial = dependent_count + 1
-                serial_str = f"{serial:02d}"
-                self.patient_id = f"ED-{sponsor.personal_number}-{serial_str}" if sponsor.patient_type == 'Employee' else f"RD-{sponsor.personal_number}-{serial_str}"
-            except Patient.DoesNotExist:
-                raise ValidationError("Sponsor not found.")
+            sponsor = self.get_sponsor()
         elif self.patient_type == 'NonNPA':
             if not self.non_npa_type:
                 raise ValidationError("Non-NPA type is required for Non-NPA patients.")
-            nonnpa_count = Patient.objects.filter(patient_type='NonNPA', non_npa_type=self.non_npa_type).exclude(id=self.pk).count() if self.pk else Patient.objects.filter(patient_type='NonNPA', non_npa_type=self.non_npa_type).count()
-            serial = nonnpa_count + 1
-            serial_str = f"{serial:03d}"
-            self.patient_id = f"NN-{self.non_npa_type}-{serial_str}"
-        else:
-            if not self.personal_number:
-                raise ValidationError("Personal number is required for Employee or Retiree.")
-            same_personal_number_count = Patient.objects.filter(patient_type=self.patient_type, personal_number=self.personal_number).exclude(id=self.pk).count() if self.pk else Patient.objects.filter(patient_type=self.patient_type, personal_number=self.personal_number).count()
-            serial = same_personal_number_count + 1
-            serial_str = f"{serial:03d}"
-            self.patient_id = f"E-{self.personal_number}-{serial_str}" if self.patient_type == 'Employee' else f"R-{self.personal_number}-{serial_str}"
+        elif not self.personal_number:
+            raise ValidationError("Personal number is required for Employee or Retiree.")
+
+        # IDs are assigned once on insert and never recomputed on later edits
+        if self._state.adding and not self.patient_id:
+            prefix = self.patient_id_prefix(sponsor)
+            self.patient_id = self.format_patient_id(prefix, PatientIdSequence.allocate(prefix), self.patient_type)
 
         if self.date_of_birth:
-            today = timezone.now().date()
-            self.age = today.year - self.date_of_birth.year - ((today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day))
+            self.age = self.compute_age(self.date_of_birth)
 
         super().save(*args, **kwargs)
 
+    def get_sponsor(self):
+        try:
+            sponsor = Patient.objects.get(id=self.sponsor_id)
+        except (Patient.DoesNotExist, ValueError):
+            raise ValidationError("Sponsor not found.")
+        if sponsor.patient_type not in ['Employee', 'Retiree']:
+            raise ValidationError("Sponsor must be either Employee or Retiree.")
+        return sponsor
+
+    def patient_id_prefix(self, sponsor=None):
+        """Counter key shared by every patient_id of the same family, e.g. ED-<pn>, NN-<type>, E-<pn>"""
+        if self.patient_type == 'Dependent':
+            return f"ED-{sponsor.personal_number}" if sponsor.patient_type == 'Employee' else f"RD-{sponsor.personal_number}"
+        elif self.patient_type == 'NonNPA':
+            return f"NN-{self.non_npa_type}"
+        return f"E-{self.personal_number}" if self.patient_type == 'Employee' else f"R-{self.personal_number}"
+
+    @staticmethod
+    def format_patient_id(prefix, serial, patient_type):
+        return f"{prefix}-{serial:02d}" if patient_type == 'Dependent' else f"{prefix}-{serial:03d}"
+
+    @staticmethod
+    def compute_age(date_of_birth):
+        today = timezone.now().date()
+        return today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+
     def __str__(self):
         return f"{self.surname} {self.first_name}"
 
     class Meta:
         ordering = ['-created_at']
-        indexes = [models.Index(fields=['personal_number', 'surname'])]
+        indexes = [
+            models.Index(fields=['personal_number', 'surname']),
+            # Trigram indexes over UPPER(col) so icontains lookups are index scans
+            GinIndex(OpClass(Upper('surname'), name='gin_trgm_ops'), name='patient_surname_trgm'),
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'), name='patient_first_name_trgm'),
+            GinIndex(OpClass(Upper('personal_number'), name='gin_trgm_ops'), name='patient_pn_trgm'),
+        ]
 
     @property
     def photo_url(self):
@@ -145,9 +167,70 @@ class Patient(models.Model):
     def is_sponsor(self):
         return self.patient_type in ['Employee', 'Retiree']
 
+class PatientIdSequence(models.Model):
+    """Last serial handed out per patient_id prefix; rows are locked while being incremented"""
+    prefix = models.CharField(max_length=120, primary_key=True)
+    last_value = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_id_sequences'
+        verbose_name = "Patient ID Sequence"
+        verbose_name_plural = "Patient ID Sequences"
+
+    def __str__(self):
+        return f"{self.prefix}: {self.last_value}"
+
+    @classmethod
+    def allocate(cls, prefix, count=1):
+        """Reserve `count` consecutive serials for `prefix` and return the first one"""
+        return cls.allocate_bulk({prefix: count})[prefix]
+
+    @classmethod
+    def allocate_bulk(cls, counts):
+        """
+        Reserve serials for many prefixes at once (used by bulk imports)
+
+        Args:
+            counts: dict of prefix -> number of serials needed
+
+        Returns:
+            dict: prefix -> first serial of the reserved block
+        """
+        counts = {prefix: count for prefix, count in counts.items() if count > 0}
+        if not counts:
+            return {}
+
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(prefix=prefix) for prefix in counts], ignore_conflicts=True)
+            # Lock in a stable order so concurrent allocators never deadlock
+            sequences = list(cls.objects.select_for_update().filter(prefix__in=counts).order_by('prefix'))
+            first_values = {}
+            now = timezone.now()
+            for sequence in sequences:
+                first_values[sequence.prefix] = sequence.last_value + 1
+                sequence.last_value += counts[sequence.prefix]
+                sequence.updated_at = now
+            cls.objects.bulk_update(sequences, ['last_value', 'updated_at'])
+
+        return first_values
+
 class VitalReading(models.Model):
+    # NEWS2 bands for the parameters recorded here, as (upper bounds, points): a value up to
+    # bounds[i] scores points[i], anything above the last bound scores points[-1]. Level of
+    # consciousness and supplemental oxygen are not recorded, so they never add points.
+    EARLY_WARNING_BANDS = {
+        'respiratory_rate': ((8, 11, 20, 24), (3, 1, 0, 2, 3)),
+        'oxygen_saturation': ((91, 93, 95), (3, 2, 1, 0)),
+        'systolic': ((90, 100, 110, 219), (3, 2, 1, 0, 3)),
+        'heart_rate': ((40, 50, 90, 110, 130), (3, 1, 0, 1, 2, 3)),
+        'temperature': ((35.0, 36.0, 38.0, 39.0), (3, 1, 0, 1, 2)),
+    }
+    RISK_CHOICES = [('Low', 'Low'), ('Low-Medium', 'Low-Medium'), ('Medium', 'Medium'), ('High', 'High')]
+
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='vitals')
-    date = models.DateTimeField(auto_now_add=True)
+    # When the reading was taken; bulk ingest passes the monitor's or round's own time
+    date = models.DateTimeField(default=timezone.now, editable=False)
     systolic = models.IntegerField(null=True, blank=True)
     diastolic = models.IntegerField(null=True, blank=True)
     heart_rate = models.IntegerField(null=True, blank=True)
@@ -161,15 +244,59 @@ class VitalReading(models.Model):
     pain_scale = models.IntegerField(null=True, blank=True)
     comment = models.TextField(null=True, blank=True)
     recorded_by = models.CharField(max_length=255, default="Unknown")
+    # Aggregate early-warning score of this reading; None when it has none of the scored parameters
+    early_warning_score = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    early_warning_risk = models.CharField(max_length=10, choices=RISK_CHOICES, blank=True, editable=False)
 
     class Meta:
-        ordering = ['-date']
+        ordering = ['-date', '-id']
+        indexes = [
+            # Keyset pagination: per-patient history and the global feed
+            models.Index(fields=['patient', '-date', '-id']),
+            models.Index(fields=['-date', '-id']),
+        ]
         verbose_name = "Vital Reading"
         verbose_name_plural = "Vital Readings"
 
     def __str__(self):
         return f"Vitals for {self.patient} on {self.date}"
 
+    def save(self, *args, **kwargs):
+        self.score([self])
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(self.EARLY_WARNING_BANDS) & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'early_warning_score', 'early_warning_risk'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def score(cls, readings):
+        """
+        Set the early-warning score and risk of each reading, one parameter column at a
+        time so a whole ingest batch is scored in a handful of passes
+        """
+        totals = [None] * len(readings)
+        red_flags = [False] * len(readings)
+        for field, (bounds, points) in cls.EARLY_WARNING_BANDS.items():
+            for index, reading in enumerate(readings):
+                value = getattr(reading, field)
+                if value is None:
+                    continue
+                scored = points[bisect_left(bounds, value)]
+                totals[index] = (totals[index] or 0) + scored
+                red_flags[index] = red_flags[index] or scored == 3
+
+        for reading, total, red_flag in zip(readings, totals, red_flags):
+            reading.early_warning_score = total
+            if total is None:
+                reading.early_warning_risk = ''
+            elif total >= 7:
+                reading.early_warning_risk = 'High'
+            elif total >= 5:
+                reading.early_warning_risk = 'Medium'
+            else:
+                # A single extreme parameter needs an urgent review whatever the total
+                reading.early_warning_risk = 'Low-Medium' if red_flag else 'Low'
+
 class MedicalReport(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='reports')
     file_number = models.CharField(max_length=50)
@@ -186,7 +313,11 @@ class MedicalReport(models.Model):
         return f"{self.report_name} for {self.patient}"
 
     class Meta:
-        ordering = ['-date']
+        ordering = ['-date', '-id']
+        indexes = [
+            models.Index(fields=['patient', '-date', '-id']),
+            models.Index(fields=['-date', '-id']),
+        ]
         verbose_name = "Medical Report"
         verbose_name_plural = "Medical Reports"
 
@@ -217,7 +348,11 @@ class TimelineEvent(models.Model):
         return f"{self.title} for {self.patient} on {self.date}"
 
     class Meta:
-        ordering = ['-date', '-time']
+        ordering = ['-date', '-time', '-id']
+        indexes = [
+            models.Index(fields=['patient', '-date', '-time', '-id']),
+            models.Index(fields=['-date', '-time', '-id']),
+        ]
         verbose_name = "Timeline Event"
         verbose_name_plural = "Timeline Events"
 
@@ -230,8 +365,17 @@ class Visit(models.Model):
     PRIORITIES = [('Low', 'Low'), ('Medium', 'Medium'), ('High', 'High'), ('Emergency', 'Emergency')]
     STATUS_CHOICES = [
         ('Scheduled', 'Scheduled'), ('Confirmed', 'Confirmed'), ('In Progress', 'In Progress'),
-        ('In Nursing Pool', 'In Nursing Pool'), ('Completed', 'Completed'), ('Cancelled', 'Cancelled'), ('Rescheduled', 'Rescheduled'),
+        ('In Nursing Pool', 'In Nursing Pool'), ('Queued', 'Queued'), ('Completed', 'Completed'), ('Cancelled', 'Cancelled'), ('Rescheduled', 'Rescheduled'),
     ]
+    # How far ahead of a Low visit that arrived at the same time each priority is routed.
+    # A Low visit overtakes a Medium one that arrived more than 20 minutes after it, so
+    # waiting ages every visit up and nobody starves; Emergency is a day ahead of everything.
+    TRIAGE_HEADSTART = {
+        'Low': timedelta(0),
+        'Medium': timedelta(minutes=20),
+        'High': timedelta(hours=1),
+        'Emergency': timedelta(days=1),
+    }
     LOCATIONS = [
         ('Bode Thomas Clinic', 'Bode Thomas Clinic'), ('Headquarters', 'Headquarters'), ('Tincan', 'Tincan'),
         ('LPC', 'LPC'), ('Rivers Port Complex', 'Rivers Port Complex'), ('Onne Port Complex', 'Onne Port Complex'),
@@ -252,6 +396,7 @@ class Visit(models.Model):
     patient_name = models.CharField(max_length=200, blank=True, null=True)
     personal_number = models.CharField(max_length=50, blank=True, null=True)
     consultation_room = models.ForeignKey('ConsultationRoom', on_delete=models.SET_NULL, blank=True, null=True, related_name='visits')
+    triage_due_at = models.DateTimeField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -259,13 +404,30 @@ class Visit(models.Model):
         if self.patient:
             self.patient_name = f"{self.patient.surname} {self.patient.first_name}"
             self.personal_number = self.patient.personal_number
+        # Sort key for the triage pool: arrival minus the priority's head start. It does not
+        # change as time passes, so the pool is an index range scan (see triage.py).
+        arrival = self.nursing_received_at or self.created_at or timezone.now()
+        self.triage_due_at = arrival - self.TRIAGE_HEADSTART.get(self.priority, timedelta(0))
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'priority', 'nursing_received_at'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'triage_due_at'}
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Visit for {self.patient} on {self.visit_date}"
 
     class Meta:
-        ordering = ['-visit_date', '-visit_time']
+        ordering = ['-visit_date', '-visit_time', '-id']
+        indexes = [
+            models.Index(fields=['patient', '-visit_date', '-visit_time', '-id']),
+            models.Index(fields=['-visit_date', '-visit_time', '-id']),
+            # Per-clinic triage pool, in routing order; only visits waiting for a room are indexed
+            models.Index(
+                fields=['clinic', 'triage_due_at', 'id'],
+                condition=models.Q(status='In Nursing Pool', consultation_room__isnull=True),
+                name='visit_triage_pool_idx',
+            ),
+        ]
         verbose_name = "Visit"
         verbose_name_plural = "Visits"
 
@@ -281,7 +443,6 @@ class ConsultationRoom(models.Model):
     total_consultations_today = models.IntegerField(default=0)
     average_consultation_time = models.IntegerField(null=True, blank=True)
     last_patient = models.CharField(max_length=255, null=True, blank=True)
-    queue = ArrayField(models.JSONField(), default=list, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -294,6 +455,74 @@ class ConsultationRoom(models.Model):
     def __str__(self):
         return self.name
 
+class ConsultationQueueEntry(models.Model):
+    """
+    One visit waiting for a consultation room.
+
+    Positions only need to sort: enqueueing appends after the room's highest position
+    and taking the head leaves a gap, so neither rewrites the other entries. Reordering
+    renumbers the room from 1 (see consultation_queue.py).
+    """
+    room = models.ForeignKey(ConsultationRoom, on_delete=models.CASCADE, related_name='queue_entries')
+    visit = models.OneToOneField(Visit, on_delete=models.CASCADE, related_name='queue_entry')
+    position = models.PositiveIntegerField()
+    priority = models.CharField(max_length=10, choices=Visit.PRIORITIES, default='Medium')
+    enqueued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'consultation_queue_entries'
+        ordering = ['room', 'position']
+        constraints = [
+            # Deferred so a reorder can swap positions within one statement
+            models.UniqueConstraint(
+                fields=['room', 'position'], name='unique_queue_position', deferrable=models.Deferrable.DEFERRED
+            ),
+        ]
+        verbose_name = "Consultation Queue Entry"
+        verbose_name_plural = "Consultation Queue Entries"
+
+    def __str__(self):
+        return f"{self.visit} in {self.room} at {self.position}"
+
+class ConsultationStats(models.Model):
+    """
+    One day of finished consultation durations (minutes) for a room or for a doctor.
+
+    Updated once per session as it ends: count, running mean and sum of squared
+    deviations (Welford), extremes and a fixed-bin histogram. Windows are answered by
+    merging a handful of these rows instead of scanning consultation_sessions.
+    """
+    # Upper bin edges in minutes; the last bin holds everything above the final edge
+    HISTOGRAM_EDGES = (5, 10, 15, 20, 25, 30, 45, 60, 90, 120)
+
+    room = models.ForeignKey(ConsultationRoom, null=True, blank=True, on_delete=models.CASCADE, related_name='consultation_stats')
+    doctor = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE, related_name='consultation_stats')
+    date = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)
+    minimum = models.FloatField(null=True, blank=True)
+    maximum = models.FloatField(null=True, blank=True)
+    histogram = ArrayField(models.PositiveIntegerField(), default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'consultation_stats'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'date'], condition=models.Q(room__isnull=False), name='unique_room_stats_day'),
+            models.UniqueConstraint(fields=['doctor', 'date'], condition=models.Q(doctor__isnull=False), name='unique_doctor_stats_day'),
+            models.CheckConstraint(
+                condition=models.Q(room__isnull=True, doctor__isnull=False) | models.Q(room__isnull=False, doctor__isnull=True),
+                name='stats_room_xor_doctor',
+            ),
+        ]
+        verbose_name = "Consultation Stats"
+        verbose_name_plural = "Consultation Stats"
+
+    def __str__(self):
+        return f"{self.room or self.doctor} on {self.date}: {self.count} consultations"
+
 class ConsultationSession(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     room = models.ForeignKey(ConsultationRoom, on_delete=models.CASCADE, related_name='sessions')
@@ -325,11 +554,15 @@ class Medication(models.Model):
         ('Diabetes', 'Diabetes'), ('Respiratory', 'Respiratory'), ('Vitamins', 'Vitamins'),
         ('Gastrointestinal', 'Gastrointestinal'), ('Dermatology', 'Dermatology'), ('Neurology', 'Neurology'), ('Other', 'Other'),
     ]
+    STATUS_CHOICES = [
+        ('In Stock', 'In Stock'), ('Low Stock', 'Low Stock'), ('Out of Stock', 'Out of Stock'),
+        ('Near Expiry', 'Near Expiry'), ('Expired', 'Expired'),
+    ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     generic_name = models.CharField(max_length=255, blank=True, null=True)
-    category = models.CharField(max_length=100, choices=CATEGORIES)
+    category = models.CharField(max_length=100, choices=CATEGORIES, db_index=True)
     strength = models.CharField(max_length=100)
     dosage_form = models.CharField(max_length=100)
     manufacturer = models.CharField(max_length=255)
@@ -339,7 +572,8 @@ class Medication(models.Model):
     maximum_stock = models.IntegerField(default=0)
     pack_size = models.IntegerField(default=1)
     location = models.CharField(max_length=100)
-    barcode = models.CharField(max_length=100, blank=True, null=True)
+    barcode = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Out of Stock')
     prescription_required = models.BooleanField(default=True)
     is_generic = models.BooleanField(default=False)
     notes = models.TextField(blank=True, null=True)
@@ -347,18 +581,56 @@ class Medication(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     last_restocked = models.DateField(null=True, blank=True)
 
+    # Maintained by the stock ledger and the nightly sweep, never by a plain save
+    LEDGER_FIELDS = ('current_stock', 'last_restocked', 'status')
+
     def save(self, *args, **kwargs):
-        active_batches = self.batches.filter(status='Active', expiry_date__gte=timezone.now().date())
-        self.current_stock = sum(batch.remaining_tablets for batch in active_batches)
-        if active_batches.exists():
-            self.last_restocked = active_batches.order_by('-date_received').first().date_received
+        # Writing back an in-memory copy of current_stock would undo concurrent dispenses
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.LEDGER_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} {self.strength}"
 
+    class Meta:
+        indexes = [
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='medication_name_trgm'),
+            GinIndex(OpClass(Upper('generic_name'), name='gin_trgm_ops'), name='medication_generic_name_trgm'),
+        ]
+
+class DrugInteraction(models.Model):
+    """
+    An interaction between any drug matching a `drug1_patterns` term and any drug matching
+    a `drug2_patterns` term. Terms are matched as substrings of a medication's normalized
+    name and generic name (see interactions.py).
+    """
+    SEVERITIES = [('Minor', 'Minor'), ('Moderate', 'Moderate'), ('Major', 'Major')]
+
+    drug1_patterns = ArrayField(models.CharField(max_length=100))
+    drug2_patterns = ArrayField(models.CharField(max_length=100))
+    severity = models.CharField(max_length=10, choices=SEVERITIES)
+    description = models.TextField()
+    recommendation = models.TextField()
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'drug_interactions'
+        ordering = ['id']
+        verbose_name = "Drug Interaction"
+        verbose_name_plural = "Drug Interactions"
+
+    def __str__(self):
+        return f"{'/'.join(self.drug1_patterns)} + {'/'.join(self.drug2_patterns)} ({self.severity})"
+
 class MedicationBatch(models.Model):
-    STATUS_CHOICES = [('Active', 'Active'), ('Near Expiry', 'Near Expiry'), ('Expired', 'Expired'), ('Recalled', 'Recalled')]
+    STATUS_CHOICES = [('Active', 'Active'), ('Near Expiry', 'Near Expiry'), ('Depleted', 'Depleted'), ('Expired', 'Expired'), ('Recalled', 'Recalled')]
+    DISPENSABLE_STATUSES = ('Active', 'Near Expiry')
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     medication = models.ForeignKey(Medication, on_delete=models.CASCADE, related_name='batches')
@@ -375,6 +647,24 @@ class MedicationBatch(models.Model):
     status = models.CharField(max_length=20, default='Active', choices=STATUS_CHOICES)
     notes = models.TextField(blank=True, null=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'remaining_tablets', 'status'} <= set(field_names):
+            instance._counted_stock = instance.counted_stock()
+        return instance
+
+    def counted_stock(self):
+        """
+        Tablets this batch contributes to Medication.current_stock
+
+        Counted by stored status alone: a batch past its expiry date keeps counting until
+        the expiry sweep marks it Expired and writes its tablets off in the ledger.
+        """
+        if self.status in self.DISPENSABLE_STATUSES:
+            return max(self.remaining_tablets, 0)
+        return 0
+
     def save(self, *args, **kwargs):
         if isinstance(self.expiry_date, str):
             try:
@@ -382,22 +672,53 @@ class MedicationBatch(models.Model):
             except ValueError:
                 self.expiry_date = timezone.now().date()
         
-        if self.expiry_date < timezone.now().date():
-            self.status = 'Expired'
-        elif self.expiry_date <= timezone.now().date() + timezone.timedelta(days=30):
+        # Expired is left to sweep_expiry, which writes the tablets off as it sets it
+        if self.status == 'Active' and self.expiry_date <= timezone.now().date() + timezone.timedelta(days=30):
             self.status = 'Near Expiry'
         
         if self.total_tablets < self.remaining_tablets:
             self.remaining_tablets = self.total_tablets
-            
-        super().save(*args, **kwargs)
-        
-        if self.medication:
-            self.medication.save()
+
+        adding = self._state.adding
+        if adding:
+            previous_counted = 0
+        elif hasattr(self, '_counted_stock'):
+            previous_counted = self._counted_stock
+        else:
+            previous_counted = MedicationBatch.objects.get(pk=self.pk).counted_stock()
+        delta = self.counted_stock() - previous_counted
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._counted_stock = previous_counted + delta
+
+            changes = {}
+            if delta:
+                changes['current_stock'] = F('current_stock') + delta
+            if adding:
+                changes['last_restocked'] = self.date_received
+            if changes:
+                Medication.objects.filter(pk=self.medication_id).update(**changes)
+
+        if MedicationBatch.medication.is_cached(self):
+            self.medication.current_stock += delta
+            if adding:
+                self.medication.last_restocked = self.date_received
+
+    def delete(self, *args, **kwargs):
+        counted = self._counted_stock if hasattr(self, '_counted_stock') else self.counted_stock()
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            if counted:
+                Medication.objects.filter(pk=self.medication_id).update(current_stock=F('current_stock') - counted)
+        return result
 
     def __str__(self):
         return f"{self.medication.name} - {self.batch_number}"
 
+    class Meta:
+        indexes = [models.Index(fields=['medication', 'status', 'remaining_tablets'])]
+
 class Prescription(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     visit = models.ForeignKey(Visit, on_delete=models.CASCADE, related_name='prescriptions')
@@ -407,6 +728,11 @@ class Prescription(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     prescribed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     prescribed_by_name = models.CharField(max_length=255, blank=True, null=True)
+    # Item counts by status, kept current by update_availability_status
+    total_items = models.PositiveIntegerField(default=0, editable=False)
+    available_items = models.PositiveIntegerField(default=0, editable=False)
+    out_of_stock_items = models.PositiveIntegerField(default=0, editable=False)
+    dispensed_items = models.PositiveIntegerField(default=0, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.prescribed_by_name and self.prescribed_by:
@@ -414,22 +740,39 @@ class Prescription(models.Model):
         super().save(*args, **kwargs)
 
     def update_availability_status(self):
-        if self.items.exists():
-            total_items = self.items.count()
-            available_items = self.items.filter(status__in=['Available', 'Substituted']).count()
-            out_of_stock_items = self.items.filter(status='Out of Stock').count()
-            dispensed_items = self.items.filter(status='Dispensed').count()
-            
-            for item in self.items.filter(status='Pending'):
-                medication = item.medication
-                item.status = 'Available' if medication and medication.current_stock >= item.quantity else 'Out of Stock'
-                item.save()
-            
-            self.total_items = total_items
-            self.available_items = available_items
-            self.out_of_stock_items = out_of_stock_items
-            self.dispensed_items = dispensed_items
-            self.save()
+        """
+        Resolve Pending items against current stock and refresh the item counters
+
+        One UPDATE ... FROM joins the pending items to their medications' stock, one
+        conditional aggregate counts the items by status and one UPDATE stores the counts.
+        """
+        now = timezone.now()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {quote(PrescriptionItem._meta.db_table)} AS item
+                SET status = CASE WHEN medication.current_stock >= item.quantity
+                                  THEN 'Available' ELSE 'Out of Stock' END,
+                    updated_at = %s
+                FROM {quote(Medication._meta.db_table)} AS medication
+                WHERE medication.id = item.medication_id
+                  AND item.prescription_id = %s
+                  AND item.status = 'Pending'
+                """,
+                [now, self.pk],
+            )
+
+        counters = self.items.aggregate(
+            total_items=Count('pk'),
+            available_items=Count('pk', filter=Q(status__in=['Available', 'Substituted'])),
+            out_of_stock_items=Count('pk', filter=Q(status='Out of Stock')),
+            dispensed_items=Count('pk', filter=Q(status='Dispensed')),
+        )
+        Prescription.objects.filter(pk=self.pk).update(**counters, updated_at=now)
+        for field, value in counters.items():
+            setattr(self, field, value)
+        self.updated_at = now
 
     def __str__(self):
         return f"Prescription for {self.visit.patient} on {self.created_at}"
@@ -453,9 +796,38 @@ class PrescriptionItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @property
+    def dispensed_medication_id(self):
+        """The medication actually handed out: the substitute, when one was chosen"""
+        return self.substituted_with_id or self.medication_id
+
     def __str__(self):
         return f"{self.medication.name} - {self.quantity}"
 
+class PatientActiveMedication(models.Model):
+    """
+    A medication a patient is currently taking: one row per patient and medication,
+    written when it is dispensed and removed when its prescription is cancelled.
+    Prescribing screens against these rows instead of the patient's whole history.
+    """
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='active_medications')
+    medication = models.ForeignKey(Medication, on_delete=models.CASCADE, related_name='active_patients')
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='active_medications')
+    dispensed_at = models.DateTimeField()
+    active_until = models.DateTimeField()
+
+    class Meta:
+        db_table = 'patient_active_medications'
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'medication'], name='unique_patient_active_medication'),
+        ]
+        indexes = [models.Index(fields=['patient', 'active_until'])]
+        verbose_name = "Patient Active Medication"
+        verbose_name_plural = "Patient Active Medications"
+
+    def __str__(self):
+        return f"{self.patient} on {self.medication} until {self.active_until:%Y-%m-%d}"
+
 class PharmacyQueue(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='queue')
@@ -489,5 +861,73 @@ class StockTransaction(models.Model):
     batch_number = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['medication', '-created_at', '-id']),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.quantity} of {self.medication.name}"
+
+class MedicationUsageDaily(models.Model):
+    """
+    One medication's stock movements on one day, summed from its StockTransactions.
+
+    The stock ledger folds each batch of new transactions in with a single upsert, and
+    backfill_usage_rollup rebuilds any range from the transactions themselves, so
+    inventory analytics read a few rows per medication instead of the whole ledger.
+    All quantities are tablets; dispensed, restocked and expired are positive.
+    """
+    medication = models.ForeignKey(Medication, on_delete=models.CASCADE, related_name='usage_days')
+    date = models.DateField()
+    dispensed = models.PositiveIntegerField(default=0)
+    dispense_count = models.PositiveIntegerField(default=0)
+    restocked = models.PositiveIntegerField(default=0)
+    expired = models.PositiveIntegerField(default=0)
+    adjusted = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'medication_usage_daily'
+        ordering = ['medication', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['medication', 'date'], name='unique_medication_usage_day'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'medication'], name='usage_daily_date_idx'),
+        ]
+        verbose_name = "Medication Usage (daily)"
+        verbose_name_plural = "Medication Usage (daily)"
+
+    def __str__(self):
+        return f"{self.medication} on {self.date}: {self.dispensed} dispensed"
+
+
+class PatientEarlyWarning(models.Model):
+    """
+    Each patient's current early-warning score: the score of their latest scored reading.
+
+    Kept by early_warning.record as readings are written, so the ward's at-risk list is a
+    scan of the small partial index below rather than of everyone's latest vitals.
+    """
+    patient = models.OneToOneField(Patient, primary_key=True, on_delete=models.CASCADE, related_name='early_warning')
+    reading = models.ForeignKey(VitalReading, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    score = models.PositiveSmallIntegerField()
+    risk = models.CharField(max_length=10, choices=VitalReading.RISK_CHOICES)
+    scored_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'patient_early_warnings'
+        ordering = ['-score', '-scored_at']
+        indexes = [
+            models.Index(fields=['-score', '-scored_at'], condition=~models.Q(risk='Low'), name='early_warning_at_risk_idx'),
+        ]
+        verbose_name = "Patient Early Warning"
+        verbose_name_plural = "Patient Early Warnings"
+
     def __str__(self):
-        return f"{self.type} {self.quantity} of {self.medication.name}"
\ No newline at end of file
+        return f"{self.patient}: score {self.score} ({self.risk})"
@@ -0,0 +1,165 @@
+# pagination.py - Pagination classes for list endpoints and actions
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.db.models import F, Q
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import json
+
+class PatientSearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+class LegacyPagePagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over the model's Meta.ordering plus the primary key.
+
+    The cursor carries the full sort key of the boundary row, so every page is an
+    index range scan of page_size + 1 rows however deep it is - no COUNT(*) and no
+    OFFSET. Ordering fields must be non-null. Requests that still send ?page= are
+    served by page-number pagination so existing clients keep working.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    legacy_query_param = 'page'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.legacy = None
+
+    @staticmethod
+    def ordering_for(model):
+        """(field name, descending) pairs for the model's ordering, ending with the primary key"""
+        ordering = []
+        for term in model._meta.ordering:
+            ordering.append((term.lstrip('-'), term.startswith('-')))
+        pk_name = model._meta.pk.name
+        if not any(name in (pk_name, 'pk') for name, _ in ordering):
+            ordering.append((pk_name, ordering[-1][1] if ordering else False))
+        return ordering
+
+    @classmethod
+    def encode_cursor(cls, instance, reverse=False):
+        model = type(instance)
+        position = [
+            model._meta.get_field(name).value_to_string(instance)
+            for name, _ in cls.ordering_for(model)
+        ]
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @classmethod
+    def cursor_url(cls, url, instance, reverse=False):
+        """`url` with a cursor that continues after (or, reversed, before) `instance`"""
+        return replace_query_param(url, cls.cursor_query_param, cls.encode_cursor(instance, reverse))
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            ordering = self.ordering_for(model)
+            if len(payload['p']) != len(ordering):
+                raise ValueError
+            position = [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(ordering, payload['p'])
+            ]
+            return position, bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    @staticmethod
+    def _beyond(ordering, position, reverse):
+        """Rows strictly after `position` in (reverse = before) the ordering, as a lexicographic Q"""
+        condition = None
+        equal = {}
+        for (name, descending), value in zip(ordering, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            term = Q(**equal, **{f'{name}__{lookup}': value})
+            condition = term if condition is None else condition | term
+            equal[name] = value
+        # Leading bound on the first key so the planner starts the index scan at the cursor
+        name, descending = ordering[0]
+        bound = Q(**{f"{name}__{'lte' if descending != reverse else 'gte'}": position[0]})
+        return bound & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.legacy_query_param in request.query_params:
+            self.legacy = LegacyPagePagination()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        ordering = self.ordering_for(queryset.model)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        queryset = queryset.order_by(*[
+            F(name).desc() if descending != reverse else F(name).asc()
+            for name, descending in ordering
+        ])
+        if position is not None:
+            queryset = queryset.filter(self._beyond(ordering, position, reverse))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # A cursor only exists because there was a page on its other side
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.cursor_url(self.base_url, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.cursor_url(self.base_url, self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
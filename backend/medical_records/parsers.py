@@ -0,0 +1,14 @@
+# parsers.py - Request body parsers beyond DRF's defaults
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+from .patient_import import iter_ndjson_rows
+
+class NDJSONParser(BaseParser):
+    """Newline-delimited JSON, one object per line, parsed into a list of rows"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return []
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        return list(iter_ndjson_rows(stream, encoding))
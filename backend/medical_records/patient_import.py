@@ -0,0 +1,260 @@
+# patient_import.py - Streaming bulk import of HR staff rosters (employees, retirees, dependents)
+
+from django.db import transaction, DatabaseError
+from django.utils import timezone
+from collections import defaultdict
+import codecs
+import csv
+import json
+import logging
+from .models import Patient, PatientIdSequence
+from .serializers import PatientSerializer
+
+logger = logging.getLogger(__name__)
+
+DEPENDENT_LIMITS = {'Employee': 5, 'Retiree': 1}
+
+# Columns that are computed or system-managed and ignored if present in the file
+IGNORED_COLUMNS = {'id', 'patient_id', 'age', 'photo', 'created_at', 'updated_at'}
+
+PARSE_ERROR = '_parse_error'
+
+def iter_csv_rows(stream, encoding='utf-8-sig'):
+    """Yield one dict per CSV row from a binary stream without reading it all into memory"""
+    yield from csv.DictReader(codecs.iterdecode(stream, encoding))
+
+def iter_ndjson_rows(stream, encoding='utf-8'):
+    """Yield one dict per line of newline-delimited JSON from a binary stream"""
+    for line in codecs.iterdecode(stream, encoding):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            # Keep the row numbering intact and report the bad line instead of aborting
+            yield {PARSE_ERROR: f"Invalid JSON: {str(e)}"}
+
+ROW_READERS = {'csv': iter_csv_rows, 'ndjson': iter_ndjson_rows}
+
+class PatientImporter:
+    """
+    Import patients in chunks, upserting Employees/Retirees on (patient_type, personal_number)
+    and Dependents on (sponsor, surname, first_name)
+
+    Sponsors and existing patients are loaded into memory once; every chunk then costs a
+    fixed handful of queries (id allocation, one bulk_create, one fetch and one bulk_update).
+    """
+
+    def __init__(self, chunk_size=500):
+        self.chunk_size = chunk_size
+        self.report = {'created': 0, 'updated': 0, 'errors': []}
+
+        # (patient_type, personal_number) -> pk for Employees and Retirees
+        self.sponsors = {}
+        # sponsor pk -> (patient_type, personal_number)
+        self.sponsor_details = {}
+        # (sponsor pk, surname, first_name) -> pk for Dependents
+        self.dependents = {}
+        self.dependent_counts = defaultdict(int)
+
+        for pk, patient_type, personal_number in Patient.objects.filter(
+            patient_type__in=['Employee', 'Retiree']
+        ).values_list('pk', 'patient_type', 'personal_number').iterator():
+            self.sponsors[(patient_type, personal_number)] = pk
+            self.sponsor_details[str(pk)] = (patient_type, personal_number)
+
+        for pk, sponsor_id, surname, first_name in Patient.objects.filter(
+            patient_type='Dependent'
+        ).values_list('pk', 'sponsor_id', 'surname', 'first_name').iterator():
+            self.dependents[self._dependent_key(sponsor_id, surname, first_name)] = pk
+            self.dependent_counts[str(sponsor_id)] += 1
+
+    @staticmethod
+    def _dependent_key(sponsor_id, surname, first_name):
+        return (str(sponsor_id), (surname or '').strip().lower(), (first_name or '').strip().lower())
+
+    def run(self, rows):
+        """Import an iterable of row dicts and return the report"""
+        chunk = []
+        for row_number, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                self._error(row_number, {'non_field_errors': ['Each row must be an object.']})
+                continue
+            if PARSE_ERROR in row:
+                self._error(row_number, {'non_field_errors': [row[PARSE_ERROR]]})
+                continue
+            chunk.append((row_number, row))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+        return self.report
+
+    def _error(self, row_number, errors):
+        self.report['errors'].append({'row': row_number, 'errors': errors})
+
+    def _import_chunk(self, chunk):
+        # Sponsors first so dependents later in the same chunk can resolve them
+        self._write([item for item in chunk if item[1].get('patient_type') != 'Dependent'])
+        self._write([item for item in chunk if item[1].get('patient_type') == 'Dependent'])
+
+    def _clean(self, row):
+        cleaned = {}
+        for key, value in row.items():
+            if key is None or key in IGNORED_COLUMNS:
+                continue
+            if isinstance(value, str):
+                value = value.strip()
+            cleaned[key] = None if value == '' else value
+        return cleaned
+
+    def _resolve_sponsor(self, data):
+        """Fill sponsor_id from sponsor_personal_number; returns an error dict or None"""
+        sponsor_personal_number = data.pop('sponsor_personal_number', None)
+        if data.get('sponsor_id'):
+            if str(data['sponsor_id']) not in self.sponsor_details:
+                return {'sponsor_id': 'Sponsor not found.'}
+        elif sponsor_personal_number:
+            sponsor_id = (self.sponsors.get(('Employee', sponsor_personal_number)) or
+                          self.sponsors.get(('Retiree', sponsor_personal_number)))
+            if sponsor_id is None:
+                return {'sponsor_personal_number': 'Sponsor not found.'}
+            data['sponsor_id'] = str(sponsor_id)
+        return None
+
+    def _write(self, chunk):
+        if not chunk:
+            return
+
+        new_patients = {}
+        updates = {}
+        # sponsor pk -> dependents this chunk adds, applied to dependent_counts once it commits
+        added_dependents = defaultdict(int)
+
+        for row_number, row in chunk:
+            data = self._clean(row)
+            is_dependent = data.get('patient_type') == 'Dependent'
+
+            if is_dependent:
+                error = self._resolve_sponsor(data)
+                if error:
+                    self._error(row_number, error)
+                    continue
+            else:
+                data.pop('sponsor_personal_number', None)
+
+            serializer = PatientSerializer(data=data)
+            if not serializer.is_valid():
+                self._error(row_number, serializer.errors)
+                continue
+            fields = {
+                key: value for key, value in serializer.validated_data.items()
+                if key not in IGNORED_COLUMNS
+            }
+
+            if is_dependent:
+                key = self._dependent_key(fields['sponsor_id'], fields.get('surname'), fields.get('first_name'))
+                existing_pk = self.dependents.get(key)
+            elif fields['patient_type'] in DEPENDENT_LIMITS:
+                key = (fields['patient_type'], fields['personal_number'])
+                existing_pk = self.sponsors.get(key)
+            else:
+                # Non-NPA patients have no stable HR key, so every row is a new patient
+                key = ('row', row_number)
+                existing_pk = None
+
+            if existing_pk is not None:
+                updates.setdefault(existing_pk, (row_number, {}))[1].update(fields)
+                continue
+
+            if key in new_patients:
+                # A later row for the same person in this chunk wins
+                new_patients[key][1].update(fields)
+                continue
+
+            if is_dependent:
+                sponsor_id = str(fields['sponsor_id'])
+                sponsor_type = self.sponsor_details[sponsor_id][0]
+                if self.dependent_counts[sponsor_id] + added_dependents[sponsor_id] >= DEPENDENT_LIMITS[sponsor_type]:
+                    self._error(row_number, {
+                        'sponsor_id': f"{sponsor_type} already has maximum number of dependents ({DEPENDENT_LIMITS[sponsor_type]})"
+                    })
+                    continue
+                added_dependents[sponsor_id] += 1
+
+            new_patients[key] = (row_number, fields)
+
+        try:
+            with transaction.atomic():
+                created = self._create(new_patients)
+                self._update(updates)
+        except DatabaseError as e:
+            logger.error(f"Patient import chunk failed: {str(e)}", exc_info=True)
+            for row_number, _ in list(new_patients.values()) + list(updates.values()):
+                self._error(row_number, {'non_field_errors': [str(e)]})
+            return
+
+        # Only now that the chunk has committed may later chunks match or count its patients
+        for key, patient in zip(new_patients, created):
+            if patient.patient_type == 'Dependent':
+                self.dependents[key] = patient.pk
+            elif patient.patient_type in DEPENDENT_LIMITS:
+                self.sponsors[key] = patient.pk
+                self.sponsor_details[str(patient.pk)] = key
+        for sponsor_id, count in added_dependents.items():
+            self.dependent_counts[sponsor_id] += count
+
+        self.report['created'] += len(new_patients)
+        self.report['updated'] += len(updates)
+
+    def _create(self, new_patients):
+        """Insert the chunk's new patients with freshly allocated patient_ids and return them"""
+        if not new_patients:
+            return []
+
+        patients = []
+        prefixes = []
+        for row_number, fields in new_patients.values():
+            patient = Patient(**fields)
+            sponsor = None
+            if patient.patient_type == 'Dependent':
+                sponsor_type, sponsor_personal_number = self.sponsor_details[str(patient.sponsor_id)]
+                sponsor = Patient(patient_type=sponsor_type, personal_number=sponsor_personal_number)
+            if patient.date_of_birth:
+                patient.age = Patient.compute_age(patient.date_of_birth)
+            patients.append(patient)
+            prefixes.append(patient.patient_id_prefix(sponsor))
+
+        counts = defaultdict(int)
+        for prefix in prefixes:
+            counts[prefix] += 1
+        next_serials = PatientIdSequence.allocate_bulk(counts)
+        for patient, prefix in zip(patients, prefixes):
+            patient.patient_id = Patient.format_patient_id(prefix, next_serials[prefix], patient.patient_type)
+            next_serials[prefix] += 1
+
+        return Patient.objects.bulk_create(patients)
+
+    def _update(self, updates):
+        if not updates:
+            return
+
+        existing = Patient.objects.in_bulk(list(updates))
+        changed_fields = set()
+        now = timezone.now()
+        for pk, (row_number, fields) in updates.items():
+            patient = existing[pk]
+            patient.updated_at = now
+            for field, value in fields.items():
+                setattr(patient, field, value)
+            if patient.date_of_birth:
+                patient.age = Patient.compute_age(patient.date_of_birth)
+                changed_fields.add('age')
+            changed_fields.update(fields)
+
+        # patient_type and personal_number are the upsert key; never rewrite identity fields
+        changed_fields -= {'patient_type', 'personal_number', 'sponsor_id'}
+        if changed_fields:
+            Patient.objects.bulk_update(existing.values(), sorted(changed_fields | {'updated_at'}))
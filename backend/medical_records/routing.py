@@ -3,4 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/visits/$', consumers.VisitConsumer.as_asgi()),
+    re_path(r'ws/pharmacy-queue/$', consumers.PharmacyQueueConsumer.as_asgi()),
+    re_path(r'ws/early-warnings/$', consumers.EarlyWarningConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,20 +1,52 @@
 from rest_framework import serializers
 from .models import (
     Patient, VitalReading, MedicalReport, TimelineEvent, Visit, 
-    ConsultationRoom, ConsultationSession,
+    ConsultationRoom, ConsultationQueueEntry, ConsultationSession,
     Medication, MedicationBatch, Prescription, PrescriptionItem, 
     PharmacyQueue, StockTransaction
 )
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.urls import reverse
+from .pagination import KeysetPagination
+
+class ConsultationQueueEntrySerializer(serializers.ModelSerializer):
+    patient = serializers.IntegerField(source='visit.patient_id', read_only=True)
+    patient_name = serializers.CharField(source='visit.patient_name', read_only=True)
+    status = serializers.CharField(source='visit.status', read_only=True)
+
+    class Meta:
+        model = ConsultationQueueEntry
+        fields = ['visit', 'patient', 'patient_name', 'status', 'priority', 'position', 'enqueued_at']
 
 class ConsultationRoomSerializer(serializers.ModelSerializer):
     current_patient_name = serializers.CharField(source='current_patient.name', read_only=True)
     doctor_name = serializers.CharField(source='doctor.get_full_name', read_only=True)
+    queue = serializers.SerializerMethodField()
+
     class Meta:
         model = ConsultationRoom
         fields = '__all__'
 
+    @staticmethod
+    def prefetch_plan():
+        return [Prefetch(
+            'queue_entries',
+            queryset=ConsultationQueueEntry.objects.select_related('visit').order_by('position'),
+        )]
+
+    @staticmethod
+    def queue_data(entries):
+        queue = ConsultationQueueEntrySerializer(entries, many=True).data
+        # Stored positions may have gaps; clients see the 1-based place in line
+        for position, entry in enumerate(queue, start=1):
+            entry['position'] = position
+        return queue
+
+    def get_queue(self, obj):
+        return self.queue_data(obj.queue_entries.all())
+
     def validate(self, data):
         if data.get('status') == 'occupied' and not data.get('assigned_doctor'):
             raise ValidationError({"assigned_doctor": "Assigned doctor is required for occupied rooms."})
@@ -26,7 +58,8 @@ class ConsultationSessionSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def validate(self, data):
-        if data.get('start_time') > timezone.now():
+        # Partial updates (ending a session) need not resend start_time
+        if data.get('start_time') and data['start_time'] > timezone.now():
             raise ValidationError({"start_time": "Start time cannot be in the future."})
         return data
 
@@ -89,22 +122,87 @@ class PatientSerializer(serializers.ModelSerializer):
         return data
 
 class PatientDetailSerializer(serializers.ModelSerializer):
+    """
+    Patient with the latest NESTED_LIMIT rows of each clinical collection.
+
+    The view applies prefetch_plan() so the whole payload costs a fixed number of
+    queries; `nested_pagination` tells the client whether older rows exist and where
+    to page through them. Windows use each model's Meta.ordering, the same keys the
+    sub-resources paginate on, so `next` is a cursor that resumes right after the window.
+    """
+    NESTED_LIMIT = 20
+    # name -> (related manager, prefetch attribute, serializer, sub-resource route)
+    NESTED_COLLECTIONS = {
+        'vitals': ('vitals', 'recent_vitals', VitalReadingSerializer, 'patient-vitals'),
+        'reports': ('reports', 'recent_reports', MedicalReportSerializer, 'patient-reports'),
+        'visits': ('visits', 'recent_visits', VisitSerializer, 'patient-visits'),
+        'timeline_events': ('timeline_events', 'recent_timeline_events', TimelineEventSerializer, 'patient-timeline'),
+    }
+
     photo_url = serializers.SerializerMethodField()
-    vitals = VitalReadingSerializer(many=True, read_only=True)
-    reports = MedicalReportSerializer(many=True, read_only=True)
-    visits = VisitSerializer(many=True, read_only=True)
-    timeline_events = TimelineEventSerializer(many=True, read_only=True)
+    vitals = serializers.SerializerMethodField()
+    reports = serializers.SerializerMethodField()
+    visits = serializers.SerializerMethodField()
+    timeline_events = serializers.SerializerMethodField()
+    nested_pagination = serializers.SerializerMethodField()
     dependents = serializers.SerializerMethodField()
 
     class Meta:
         model = Patient
         fields = '__all__'
 
+    @classmethod
+    def prefetch_plan(cls):
+        """Prefetches that load one bounded window (NESTED_LIMIT + 1 rows) per collection"""
+        plan = []
+        for relation, to_attr, _, _ in cls.NESTED_COLLECTIONS.values():
+            queryset = Patient._meta.get_field(relation).related_model.objects.all()
+            if relation == 'visits':
+                queryset = queryset.select_related('consultation_room')
+            plan.append(Prefetch(relation, queryset=queryset[:cls.NESTED_LIMIT + 1], to_attr=to_attr))
+        return plan
+
+    def _window(self, obj, name):
+        relation, to_attr, _, _ = self.NESTED_COLLECTIONS[name]
+        if not hasattr(obj, to_attr):
+            setattr(obj, to_attr, list(getattr(obj, relation).all()[:self.NESTED_LIMIT + 1]))
+        return getattr(obj, to_attr)
+
+    def _serialize_window(self, obj, name):
+        serializer_class = self.NESTED_COLLECTIONS[name][2]
+        return serializer_class(self._window(obj, name)[:self.NESTED_LIMIT], many=True, context=self.context).data
+
     def get_photo_url(self, obj):
         return obj.photo.url if obj.photo else None
+
+    def get_vitals(self, obj):
+        return self._serialize_window(obj, 'vitals')
+
+    def get_reports(self, obj):
+        return self._serialize_window(obj, 'reports')
+
+    def get_visits(self, obj):
+        return self._serialize_window(obj, 'visits')
+
+    def get_timeline_events(self, obj):
+        return self._serialize_window(obj, 'timeline_events')
+
+    def get_nested_pagination(self, obj):
+        request = self.context.get('request')
+        pagination = {}
+        for name, (_, _, _, route) in self.NESTED_COLLECTIONS.items():
+            window = self._window(obj, name)
+            has_more = len(window) > self.NESTED_LIMIT
+            next_url = None
+            if has_more:
+                url = reverse(route, args=[obj.pk])
+                url = request.build_absolute_uri(url) if request else url
+                next_url = KeysetPagination.cursor_url(url, window[self.NESTED_LIMIT - 1])
+            pagination[name] = {'has_more': has_more, 'next': next_url}
+        return pagination
     
     def get_dependents(self, obj):
-        dependents = Patient.objects.filter(patient_type='Dependent', sponsor_id=obj.id)
+        dependents = Patient.objects.filter(patient_type='Dependent', sponsor_id=str(obj.id))
         return PatientSerializer(dependents, many=True).data
 
 # PHARMACY SERIALIZER
@@ -112,6 +210,7 @@ class MedicationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Medication
         fields = '__all__'
+        read_only_fields = Medication.LEDGER_FIELDS
 
     def validate(self, data):
         # Ensure required fields are provided
@@ -204,6 +303,17 @@ class PharmacyQueueSerializer(serializers.ModelSerializer):
         model = PharmacyQueue
         fields = '__all__'
 
+    @staticmethod
+    def with_related(queryset):
+        """Join and prefetch everything the nested representation reads"""
+        return queryset.select_related(
+            'prescription', 
+            'prescription__visit', 
+            'prescription__visit__patient',
+            'prescription__visit__consultation_room',
+            'assigned_pharmacist'
+        ).prefetch_related('prescription__items__medication')
+
 class PrescriptionSerializer(serializers.ModelSerializer):
     visit_id = serializers.CharField(source='visit.id', read_only=True)
     patient_name = serializers.CharField(source='visit.patient.name', read_only=True)
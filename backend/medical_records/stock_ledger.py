@@ -0,0 +1,386 @@
+# stock_ledger.py - Single entry point for every change to medication stock
+
+from django.utils import timezone
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum, Case, When, Value, Exists, OuterRef
+from django.db.models.functions import Coalesce
+from collections import defaultdict
+from datetime import timedelta
+import logging
+from .models import Medication, MedicationBatch, StockTransaction
+from . import usage_rollup
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock key held for the duration of a sweep so overlapping runs skip instead of double-writing
+SWEEP_LOCK_KEY = 0x5707
+
+class InsufficientStockError(Exception):
+    """Raised when the dispensable batches of a medication cannot cover a request"""
+
+    def __init__(self, medication, available, requested):
+        self.medication = medication
+        self.available = available
+        self.requested = requested
+        super().__init__(
+            f'Insufficient stock for {medication.name}. Available: {available}, Required: {requested}'
+        )
+
+def batch_status(batch, today=None):
+    """Status a batch should carry given its expiry date and remaining tablets"""
+    today = today or timezone.now().date()
+    days_until_expiry = (batch.expiry_date - today).days
+
+    if days_until_expiry < 0:
+        return 'Expired'
+    elif days_until_expiry <= 30:
+        return 'Near Expiry'
+    elif batch.remaining_tablets == 0:
+        return 'Depleted'
+    else:
+        return 'Active'
+
+def opened_packs_for(batch, quantity):
+    """Number of sealed packs that taking `quantity` tablets from `batch` opens"""
+    used_before = batch.total_tablets - batch.remaining_tablets
+    used_after = used_before + quantity
+    return max(0, (used_after + batch.pack_size - 1) // batch.pack_size -
+                  (used_before + batch.pack_size - 1) // batch.pack_size)
+
+def dispensable_batches(medication_ids=None, today=None):
+    """Batches that may be dispensed from, in FIFO order (earliest expiry first)"""
+    today = today or timezone.now().date()
+    batches = MedicationBatch.objects.filter(
+        remaining_tablets__gt=0,
+        expiry_date__gte=today,
+        status__in=MedicationBatch.DISPENSABLE_STATUSES
+    )
+    if medication_ids is not None:
+        batches = batches.filter(medication_id__in=medication_ids)
+    return batches.order_by('medication_id', 'expiry_date', 'date_received')
+
+def lock_medications(medication_ids):
+    """
+    Lock medication rows in primary-key order.
+
+    Every stock write takes these locks first and in the same order, so concurrent
+    dispensers of overlapping medications queue behind each other instead of
+    deadlocking or both spending the same batch.
+    """
+    return {
+        medication.pk: medication
+        for medication in Medication.objects.select_for_update().filter(pk__in=medication_ids).order_by('pk')
+    }
+
+def dispense(lines, performed_by, visit=None, prescription=None):
+    """
+    Dispense several (medication, quantity) lines in one set-based pass
+
+    Allocation, batch updates, the stock adjustment and the ledger rows all take a
+    constant number of statements however many batches are involved.
+
+    Args:
+        lines: list of (medication_id, quantity) pairs; a medication may appear more than once
+        performed_by: Name of the user performing the dispensing
+        visit: Visit instance recorded on the stock transactions (optional)
+        prescription: Prescription instance recorded on the stock transactions (optional)
+
+    Returns:
+        list: one list of batch allocations per input line, in the same order
+
+    Raises:
+        InsufficientStockError: if any medication cannot be fully covered; nothing is written
+    """
+    requested = defaultdict(int)
+    for medication_id, quantity in lines:
+        requested[medication_id] += quantity
+
+    if not requested:
+        return []
+
+    today = timezone.now().date()
+
+    with transaction.atomic():
+        medications = lock_medications(requested)
+
+        batches_by_medication = defaultdict(list)
+        for batch in dispensable_batches(requested, today).select_for_update():
+            batches_by_medication[batch.medication_id].append(batch)
+
+        # Validate every medication before touching any row
+        for medication_id, quantity in requested.items():
+            available = sum(batch.remaining_tablets for batch in batches_by_medication[medication_id])
+            if available < quantity:
+                raise InsufficientStockError(medications[medication_id], available, quantity)
+
+        running_stock = {medication_id: medications[medication_id].current_stock for medication_id in requested}
+        allocations = []
+        touched_batches = {}
+        transactions = []
+
+        for medication_id, quantity in lines:
+            line_allocations = []
+            remaining_to_dispense = quantity
+
+            for batch in batches_by_medication[medication_id]:
+                if remaining_to_dispense <= 0:
+                    break
+                if batch.remaining_tablets == 0:
+                    continue
+
+                quantity_from_batch = min(batch.remaining_tablets, remaining_to_dispense)
+                new_opened_packs = opened_packs_for(batch, quantity_from_batch)
+
+                batch.remaining_tablets -= quantity_from_batch
+                batch.opened_packs += new_opened_packs
+                batch.sealed_packs = max(0, batch.sealed_packs - new_opened_packs)
+                batch.status = batch_status(batch, today)
+                touched_batches[batch.pk] = batch
+
+                previous_stock = running_stock[medication_id]
+                running_stock[medication_id] -= quantity_from_batch
+                transactions.append(StockTransaction(
+                    medication_id=medication_id,
+                    type='Dispensed',
+                    quantity=-quantity_from_batch,
+                    previous_stock=previous_stock,
+                    new_stock=running_stock[medication_id],
+                    performed_by=performed_by,
+                    visit=visit,
+                    prescription=prescription,
+                    batch_number=batch.batch_number,
+                    reason=f'Dispensed to patient via prescription {prescription.id if prescription else "N/A"}'
+                ))
+                line_allocations.append({
+                    'batch_id': str(batch.id),
+                    'batch_number': batch.batch_number,
+                    'quantity': quantity_from_batch,
+                    'expiry_date': batch.expiry_date.isoformat()
+                })
+                remaining_to_dispense -= quantity_from_batch
+
+            allocations.append(line_allocations)
+
+        MedicationBatch.objects.bulk_update(
+            touched_batches.values(), ['remaining_tablets', 'opened_packs', 'sealed_packs', 'status']
+        )
+        Medication.objects.filter(pk__in=requested).update(
+            current_stock=F('current_stock') - Case(
+                *[When(pk=medication_id, then=Value(quantity)) for medication_id, quantity in requested.items()],
+                default=Value(0)
+            )
+        )
+        StockTransaction.objects.bulk_create(transactions)
+        usage_rollup.record(transactions)
+
+        refresh_medication_status(requested)
+
+    logger.info(f"Dispensed {sum(requested.values())} tablets across {len(touched_batches)} batches")
+    return allocations
+
+def receive_batch(medication, performed_by, batch_number, expiry_date, pack_size, packs_received):
+    """
+    Receive a new batch into stock and record the restock in the ledger
+
+    The batch insert adjusts current_stock by its own delta (see MedicationBatch.save),
+    so the medication is never re-aggregated.
+
+    Returns:
+        MedicationBatch: the created batch; `medication.current_stock` reflects the new total
+    """
+    total_tablets = pack_size * packs_received
+
+    with transaction.atomic():
+        locked = lock_medications([medication.pk])[medication.pk]
+        previous_stock = locked.current_stock
+
+        batch = MedicationBatch(
+            medication=locked,
+            batch_number=batch_number,
+            expiry_date=expiry_date,
+            total_tablets=total_tablets,
+            remaining_tablets=total_tablets,
+            pack_size=pack_size,
+            packs_received=packs_received,
+            opened_packs=0,
+            sealed_packs=packs_received,
+            supplier=locked.supplier,
+            status='Active'
+        )
+        batch.save()
+
+        restock = StockTransaction.objects.create(
+            medication=locked,
+            type='Restocked',
+            quantity=total_tablets,
+            previous_stock=previous_stock,
+            new_stock=locked.current_stock,
+            performed_by=performed_by,
+            batch_number=batch_number,
+            reason=f'Added batch {batch_number}'
+        )
+        usage_rollup.record([restock])
+        refresh_medication_status([locked.pk])
+
+    medication.current_stock = locked.current_stock
+    medication.last_restocked = locked.last_restocked
+    medication.refresh_from_db(fields=['status'])
+    return batch
+
+def refresh_medication_status(medication_ids=None):
+    """
+    Recompute Medication.status from stored batch statuses in a single UPDATE
+
+    Batch statuses are kept current by the nightly sweep, so no date arithmetic
+    happens here. Pass None to refresh the whole formulary.
+    """
+    medications = Medication.objects.all()
+    if medication_ids is not None:
+        medications = medications.filter(pk__in=medication_ids)
+
+    def has_batches(batch_status):
+        return Exists(MedicationBatch.objects.filter(
+            medication=OuterRef('pk'), status=batch_status, remaining_tablets__gt=0
+        ))
+
+    return medications.update(status=Case(
+        When(has_batches('Expired'), then=Value('Expired')),
+        When(current_stock__lte=0, then=Value('Out of Stock')),
+        When(has_batches('Near Expiry'), then=Value('Near Expiry')),
+        When(current_stock__lte=F('minimum_stock'), then=Value('Low Stock')),
+        default=Value('In Stock')
+    ))
+
+def sweep_expiry(today=None, performed_by='System'):
+    """
+    Roll batch and medication statuses forward to `today` with a few set-based statements
+
+    Batches past their expiry date are marked Expired, their counted tablets are taken out
+    of current_stock and an Expired transaction is written for each; batches inside the
+    30-day window become Near Expiry; empty long-dated batches become Depleted. Every
+    medication status is then recomputed from the stored batch statuses.
+
+    Only one sweep runs at a time: a run that finds another holding the sweep lock returns
+    zero counts without writing anything.
+
+    Returns:
+        dict: number of batches moved into each status and medications refreshed
+    """
+    today = today or timezone.now().date()
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [SWEEP_LOCK_KEY])
+            if not cursor.fetchone()[0]:
+                logger.info(f"Stock sweep for {today} skipped: another sweep is running")
+                return {'expired': 0, 'near_expiry': 0, 'depleted': 0, 'medications': 0}
+
+        expiring_batches = MedicationBatch.objects.filter(
+            expiry_date__lt=today
+        ).exclude(status__in=['Expired', 'Recalled'])
+
+        # Medications first, then batches - the same lock order as dispense - and the batches are
+        # re-read under their locks so a batch is written off at most once
+        medications = lock_medications(set(expiring_batches.values_list('medication_id', flat=True)))
+        expiring = list(expiring_batches.filter(medication_id__in=medications).select_for_update().values(
+            'id', 'medication_id', 'batch_number', 'remaining_tablets', 'status'
+        ))
+
+        written_off = defaultdict(list)
+        for batch in expiring:
+            if batch['status'] in MedicationBatch.DISPENSABLE_STATUSES and batch['remaining_tablets'] > 0:
+                written_off[batch['medication_id']].append(batch)
+
+        if written_off:
+            transactions = []
+            for medication_id, batches in written_off.items():
+                running_stock = medications[medication_id].current_stock
+                for batch in batches:
+                    transactions.append(StockTransaction(
+                        medication_id=medication_id,
+                        type='Expired',
+                        quantity=-batch['remaining_tablets'],
+                        previous_stock=running_stock,
+                        new_stock=running_stock - batch['remaining_tablets'],
+                        performed_by=performed_by,
+                        batch_number=batch['batch_number'],
+                        reason=f'Batch {batch["batch_number"]} expired'
+                    ))
+                    running_stock -= batch['remaining_tablets']
+
+            Medication.objects.filter(pk__in=written_off).update(
+                current_stock=F('current_stock') - Case(
+                    *[When(pk=medication_id, then=Value(sum(batch['remaining_tablets'] for batch in batches)))
+                      for medication_id, batches in written_off.items()],
+                    default=Value(0)
+                )
+            )
+            StockTransaction.objects.bulk_create(transactions)
+            usage_rollup.record(transactions)
+
+        expired = MedicationBatch.objects.filter(pk__in=[batch['id'] for batch in expiring]).update(status='Expired')
+        near_expiry = MedicationBatch.objects.filter(
+            status='Active', expiry_date__gte=today, expiry_date__lte=today + timedelta(days=30)
+        ).update(status='Near Expiry')
+        depleted = MedicationBatch.objects.filter(
+            status='Active', remaining_tablets=0, expiry_date__gt=today + timedelta(days=30)
+        ).update(status='Depleted')
+        medications = refresh_medication_status()
+
+    logger.info(f"Stock sweep for {today}: {expired} expired, {near_expiry} near expiry, {depleted} depleted batches")
+    return {'expired': expired, 'near_expiry': near_expiry, 'depleted': depleted, 'medications': medications}
+
+def _stock_drift(medications):
+    """(medication, recorded_stock, batch_stock) for each medication whose running total drifted"""
+    # Same rule as MedicationBatch.counted_stock; date expiry is the sweep's to write off
+    drifted = medications.annotate(
+        batch_stock=Coalesce(Sum(
+            'batches__remaining_tablets',
+            filter=Q(
+                batches__remaining_tablets__gt=0,
+                batches__status__in=MedicationBatch.DISPENSABLE_STATUSES
+            )
+        ), 0)
+    ).exclude(current_stock=F('batch_stock')).order_by('pk')
+    return [(medication, medication.current_stock, medication.batch_stock) for medication in drifted]
+
+def reconcile_stock(fix=False, performed_by='System'):
+    """
+    Compare every medication's running current_stock against its dispensable batches
+
+    Args:
+        fix: when True, overwrite drifted totals and record an Adjusted transaction for each
+        performed_by: Name recorded on the Adjusted transactions
+
+    Returns:
+        list: (medication, recorded_stock, batch_stock) for every medication that drifted
+    """
+    results = _stock_drift(Medication.objects.all())
+
+    if not fix or not results:
+        return results
+
+    with transaction.atomic():
+        # Re-measure under the medication locks so a concurrent dispense is not overwritten
+        drifted_ids = [medication.pk for medication, _, _ in results]
+        lock_medications(drifted_ids)
+        results = _stock_drift(Medication.objects.filter(pk__in=drifted_ids))
+
+        for medication, recorded_stock, batch_stock in results:
+            medication.current_stock = batch_stock
+        Medication.objects.bulk_update([medication for medication, _, _ in results], ['current_stock'])
+        adjustments = StockTransaction.objects.bulk_create([
+            StockTransaction(
+                medication=medication,
+                type='Adjusted',
+                quantity=batch_stock - recorded_stock,
+                previous_stock=recorded_stock,
+                new_stock=batch_stock,
+                performed_by=performed_by,
+                reason='Reconciled running stock against batches'
+            )
+            for medication, recorded_stock, batch_stock in results
+        ])
+        usage_rollup.record(adjustments)
+
+    return results
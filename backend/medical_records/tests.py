@@ -1,3 +1,1328 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
+import importlib
+import io
+import json
+import tempfile
+from statistics import mean, stdev
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .consultation_stats import start_day
+from .consumers import EarlyWarningConsumer, PharmacyQueueConsumer, VisitConsumer
+from .models import (
+    Patient, VitalReading, MedicalReport, TimelineEvent, Visit, ConsultationRoom, ConsultationSession,
+    DrugInteraction, Medication, MedicationBatch, MedicationUsageDaily, Prescription, PrescriptionItem, PharmacyQueue,
+    PatientActiveMedication, PatientEarlyWarning, PatientIdSequence, StockTransaction, User,
+)
+from .patient_import import PatientImporter, iter_csv_rows, iter_ndjson_rows
+from .serializers import PatientDetailSerializer
+from .stock_ledger import InsufficientStockError, dispense, receive_batch, reconcile_stock, sweep_expiry
+from .usage_rollup import rebuild
 
-# Create your tests here.
+class DispenseTests(TestCase):
+    def setUp(self):
+        today = date.today()
+
+        def medication(name):
+            medication = Medication.objects.create(
+                name=name, category='Antibiotics', strength='500mg', dosage_form='Capsule',
+                manufacturer='Emzor', supplier='Emzor', location='Shelf A', pack_size=28
+            )
+            for days in (300, 100, 200):
+                receive_batch(medication, 'System', f'{name[:3]}-{days}', today + timedelta(days=days), 28, 1)
+            return medication
+        self.amoxicillin = medication('Amoxicillin')
+        self.ampicillin = medication('Ampicillin')
+        self.cefuroxime = medication('Cefuroxime')
+
+        # Neither a recalled nor an expired batch may be dispensed from, however early it expires
+        MedicationBatch.objects.create(
+            medication=self.amoxicillin, batch_number='Amo-RECALLED', expiry_date=today + timedelta(days=50),
+            total_tablets=28, remaining_tablets=28, pack_size=28, packs_received=1, sealed_packs=1,
+            supplier='Emzor', status='Recalled'
+        )
+        receive_batch(self.amoxicillin, 'System', 'Amo-EXPIRED', today - timedelta(days=1), 28, 1)
+        sweep_expiry()
+
+    def remaining(self):
+        return dict(MedicationBatch.objects.filter(medication=self.amoxicillin).values_list('batch_number', 'remaining_tablets'))
+
+    def test_query_count_does_not_grow_with_lines_or_batches(self):
+        # savepoint, two locking reads, batch/stock/ledger/rollup/status writes, release
+        with self.assertNumQueries(9):
+            dispense([(self.amoxicillin.id, 40), (self.ampicillin.id, 40)], 'Pharmacist')
+        with self.assertNumQueries(9):
+            dispense([(self.amoxicillin.id, 30), (self.ampicillin.id, 30), (self.cefuroxime.id, 60)], 'Pharmacist')
+        self.assertEqual(StockTransaction.objects.filter(type='Dispensed').count(), 11)
+
+    def test_partial_dispense_takes_batches_in_expiry_order(self):
+        allocations = dispense([(self.amoxicillin.id, 30), (self.amoxicillin.id, 10)], 'Pharmacist')
+        self.assertEqual(
+            [[(allocation['batch_number'], allocation['quantity']) for allocation in line] for line in allocations],
+            [[('Amo-100', 28), ('Amo-200', 2)], [('Amo-200', 10)]]
+        )
+        self.assertEqual(self.remaining(), {'Amo-100': 0, 'Amo-200': 16, 'Amo-300': 28, 'Amo-RECALLED': 28, 'Amo-EXPIRED': 28})
+
+        emptied = MedicationBatch.objects.get(batch_number='Amo-100')
+        opened = MedicationBatch.objects.get(batch_number='Amo-200')
+        self.assertEqual((emptied.status, emptied.opened_packs, emptied.sealed_packs), ('Depleted', 1, 0))
+        self.assertEqual((opened.status, opened.opened_packs, opened.sealed_packs), ('Active', 1, 0))
+
+        self.amoxicillin.refresh_from_db()
+        self.assertEqual(self.amoxicillin.current_stock, 44)
+        self.assertEqual(
+            list(StockTransaction.objects.filter(type='Dispensed').order_by('-new_stock').values_list(
+                'batch_number', 'quantity', 'previous_stock', 'new_stock'
+            )),
+            [('Amo-100', -28, 84, 56), ('Amo-200', -2, 56, 54), ('Amo-200', -10, 54, 44)]
+        )
+
+    def test_insufficient_stock_writes_nothing(self):
+        before = StockTransaction.objects.count()
+        with self.assertRaises(InsufficientStockError) as raised:
+            dispense([(self.ampicillin.id, 10), (self.amoxicillin.id, 85)], 'Pharmacist')
+        self.assertEqual((raised.exception.available, raised.exception.requested), (84, 85))
+
+        self.assertEqual(StockTransaction.objects.count(), before)
+        self.assertEqual(self.remaining()['Amo-100'], 28)
+        self.assertEqual(
+            list(Medication.objects.order_by('name').values_list('current_stock', flat=True)), [84, 84, 84]
+        )
+
+class RunningStockTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.medication = Medication.objects.create(
+            name='Metformin', category='Antidiabetics', strength='500mg', dosage_form='Tablet',
+            manufacturer='Emzor', supplier='Emzor', location='Shelf F', pack_size=28, minimum_stock=10
+        )
+        self.batch = receive_batch(self.medication, 'System', 'MET-1', self.today + timedelta(days=365), 28, 1)
+
+    def stock(self):
+        return Medication.objects.get(pk=self.medication.pk).current_stock
+
+    def test_medication_save_leaves_ledger_fields_alone(self):
+        stale = Medication.objects.get(pk=self.medication.pk)
+        dispense([(self.medication.id, 10)], 'Pharmacist')
+        stale.location = 'Shelf G'
+        with self.assertNumQueries(1):
+            stale.save()
+
+        stored = Medication.objects.get(pk=self.medication.pk)
+        self.assertEqual((stored.location, stored.current_stock, stored.last_restocked), ('Shelf G', 18, self.today))
+
+    def test_batch_writes_apply_their_delta(self):
+        batch = MedicationBatch.objects.get(pk=self.batch.pk)
+        batch.remaining_tablets = 20
+        batch.save()
+        self.assertEqual(self.stock(), 20)
+        batch.status = 'Recalled'
+        batch.save()
+        self.assertEqual(self.stock(), 0)
+        batch.status = 'Active'
+        batch.save()
+        self.assertEqual(self.stock(), 20)
+
+        receive_batch(self.medication, 'System', 'MET-2', self.today + timedelta(days=200), 28, 1)
+        self.assertEqual(self.stock(), 48)
+        batch.delete()
+        self.assertEqual(self.stock(), 28)
+
+    def test_past_dated_batch_counts_until_the_sweep_writes_it_off(self):
+        # A batch whose expiry date has passed but that the nightly sweep has not reached yet
+        lapsed = receive_batch(self.medication, 'System', 'MET-0', self.today - timedelta(days=1), 28, 1)
+        lapsed = MedicationBatch.objects.get(pk=lapsed.pk)
+        lapsed.notes = 'Checked on shelf'
+        lapsed.save()
+        self.assertEqual((lapsed.status, self.stock()), ('Near Expiry', 56))
+
+        # Reconciling in that window agrees with the running total, so nothing is deducted twice
+        self.assertEqual(reconcile_stock(fix=True), [])
+        self.assertEqual(sweep_expiry()['expired'], 1)
+        self.assertEqual(self.stock(), 28)
+        self.assertEqual(list(StockTransaction.objects.filter(type='Expired').values_list('quantity', flat=True)), [-28])
+        self.assertEqual(reconcile_stock(), [])
+        self.assertFalse(StockTransaction.objects.filter(type='Adjusted').exists())
+
+    def test_reconcile_command_reports_then_fixes_drift(self):
+        Medication.objects.filter(pk=self.medication.pk).update(current_stock=50)
+
+        out = io.StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn('Metformin 500mg: recorded 50, batches 28 (-22)', out.getvalue())
+        self.assertIn('1 medication(s) drifted', out.getvalue())
+        self.assertEqual(self.stock(), 50)
+        self.assertFalse(StockTransaction.objects.filter(type='Adjusted').exists())
+
+        out = io.StringIO()
+        call_command('reconcile_stock', '--fix', stdout=out)
+        self.assertIn('Corrected 1 medication(s).', out.getvalue())
+        self.assertEqual(self.stock(), 28)
+        adjusted = StockTransaction.objects.get(type='Adjusted')
+        self.assertEqual((adjusted.quantity, adjusted.previous_stock, adjusted.new_stock), (-22, 50, 28))
+        self.assertEqual(MedicationUsageDaily.objects.get(medication=self.medication).adjusted, -22)
+
+        out = io.StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn('All medication stock totals match their batches.', out.getvalue())
+
+class StockStatusTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        today = date.today()
+
+        def medication(name, location, minimum_stock=0, batches=()):
+            medication = Medication.objects.create(
+                name=name, category='Analgesics', strength='500mg', dosage_form='Tablet', manufacturer='Emzor',
+                supplier='Emzor', location=location, pack_size=28, minimum_stock=minimum_stock
+            )
+            for days in batches:
+                receive_batch(medication, 'System', f'{name[:3]}{days}', today + timedelta(days=days), 28, 1)
+        medication('Paracetamol', 'Shelf A', minimum_stock=50, batches=[365])
+        medication('Ibuprofen', 'Shelf A', minimum_stock=10, batches=[20])
+        medication('Aspirin', 'Shelf B')
+        medication('Diclofenac', 'Shelf B', batches=[-1, 365])
+        sweep_expiry()
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            summary = self.client.get('/api/medications/stock_status/').json()
+        self.assertEqual(summary, {
+            'total_items': 4, 'in_stock': 3, 'low_stock': 1, 'out_of_stock': 1, 'near_expiry': 1, 'expired': 1
+        })
+
+        summary = self.client.get('/api/medications/stock_status/', {'location': 'Shelf B'}).json()
+        self.assertEqual(summary, {
+            'total_items': 2, 'in_stock': 1, 'low_stock': 0, 'out_of_stock': 1, 'near_expiry': 0, 'expired': 1
+        })
+
+class PatientIdAllocationTests(TestCase):
+    def patient(self, patient_type, **fields):
+        return Patient.objects.create(patient_type=patient_type, surname='Adebayo', first_name='Tola', **fields)
+
+    def test_serials_are_sequential_per_prefix(self):
+        employee = self.patient('Employee', personal_number='NPA6001')
+        ids = [
+            employee.patient_id,
+            self.patient('Employee', personal_number='NPA6001').patient_id,
+            self.patient('Retiree', personal_number='NPA6001').patient_id,
+            self.patient('Dependent', sponsor_id=str(employee.pk)).patient_id,
+            self.patient('Dependent', sponsor_id=str(employee.pk)).patient_id,
+            self.patient('NonNPA', non_npa_type='IT').patient_id,
+            self.patient('NonNPA', non_npa_type='Police').patient_id,
+        ]
+        self.assertEqual(ids, [
+            'E-NPA6001-001', 'E-NPA6001-002', 'R-NPA6001-001', 'ED-NPA6001-01', 'ED-NPA6001-02', 'NN-IT-001', 'NN-Police-001'
+        ])
+
+    def test_allocate_bulk_reserves_contiguous_blocks(self):
+        self.assertEqual(PatientIdSequence.allocate('NN-IT'), 1)
+        self.assertEqual(PatientIdSequence.allocate_bulk({'NN-IT': 3, 'NN-CSR': 2, 'NN-NYSC': 0}), {'NN-IT': 2, 'NN-CSR': 1})
+        self.assertEqual(PatientIdSequence.allocate('NN-IT'), 5)
+        self.assertEqual(PatientIdSequence.allocate('NN-CSR', count=2), 3)
+        self.assertEqual(PatientIdSequence.objects.get(prefix='NN-CSR').last_value, 4)
+        self.assertFalse(PatientIdSequence.objects.filter(prefix='NN-NYSC').exists())
+
+    def test_updates_keep_patient_id_and_revalidate_sponsor(self):
+        employee = self.patient('Employee', personal_number='NPA6002')
+        dependent = self.patient('Dependent', sponsor_id=str(employee.pk))
+        employee.personal_number = 'NPA6003'
+        employee.save()
+        dependent.first_name = 'Femi'
+        dependent.save()
+
+        employee.refresh_from_db()
+        dependent.refresh_from_db()
+        self.assertEqual((employee.patient_id, dependent.patient_id), ('E-NPA6002-001', 'ED-NPA6002-01'))
+        self.assertFalse(PatientIdSequence.objects.filter(prefix='E-NPA6003').exists())
+
+        dependent.sponsor_id = str(self.patient('NonNPA', non_npa_type='IT').pk)
+        with self.assertRaisesMessage(ValidationError, 'Sponsor must be either Employee or Retiree.'):
+            dependent.save()
+
+    def test_seeded_sequences_continue_after_legacy_ids(self):
+        for patient_id in ('E-NPA6004-004', 'E-NPA6004-002', 'ED-NPA6004-03', 'LEGACY'):
+            self.patient('NonNPA', non_npa_type='Seaview', patient_id=patient_id)
+        PatientIdSequence.objects.all().delete()
+        importlib.import_module('medical_records.migrations.0015_patientidsequence').seed_sequences(apps, None)
+
+        employee = self.patient('Employee', personal_number='NPA6004')
+        dependent = self.patient('Dependent', sponsor_id=str(employee.pk))
+        self.assertEqual((employee.patient_id, dependent.patient_id), ('E-NPA6004-005', 'ED-NPA6004-04'))
+
+class PatientImportTests(TestCase):
+    ROSTER = (
+        b'patient_type,personal_number,surname,first_name,sponsor_personal_number,non_npa_type,patient_id\n'
+        b'Employee,NPA9001,Okon,Efemena,,,X-1\n'
+        b'Employee,NPA9010,Bello,Sade,,,\n'
+        b'Dependent,,Bello,Tayo,NPA9010,,\n'
+        b'Dependent,,Okon,Ada,NPA9999,,\n'
+        b'NonNPA,,Musa,Ali,,IT,\n'
+        b'Employee,,Nope,Nobody,,,\n'
+    )
+
+    def setUp(self):
+        self.employee = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA9001', surname='Okon', first_name='Efe'
+        )
+        self.retiree = Patient.objects.create(
+            patient_type='Retiree', personal_number='NPA9005', surname='Eze', first_name='Chuka'
+        )
+
+    def dependent(self, first_name, **fields):
+        return {'patient_type': 'Dependent', 'sponsor_personal_number': 'NPA9005', 'surname': 'Eze', 'first_name': first_name, **fields}
+
+    def test_csv_upserts_on_personal_number_and_resolves_sponsors(self):
+        report = PatientImporter().run(iter_csv_rows(io.BytesIO(self.ROSTER)))
+        self.assertEqual((report['created'], report['updated']), (3, 1))
+        self.assertEqual(
+            [(error['row'], list(error['errors'])) for error in report['errors']],
+            [(4, ['sponsor_personal_number']), (6, ['personal_number'])]
+        )
+
+        self.employee.refresh_from_db()
+        self.assertEqual((self.employee.first_name, self.employee.patient_id), ('Efemena', 'E-NPA9001-001'))
+        sponsor = Patient.objects.get(personal_number='NPA9010')
+        dependent = Patient.objects.get(first_name='Tayo')
+        self.assertEqual(sponsor.patient_id, 'E-NPA9010-001')
+        self.assertEqual((dependent.sponsor_id, dependent.patient_id), (str(sponsor.pk), 'ED-NPA9010-01'))
+        self.assertEqual(Patient.objects.get(first_name='Ali').patient_id, 'NN-IT-001')
+
+        # Re-importing the roster updates the keyed patients; Non-NPA rows have no key and are added again
+        report = PatientImporter().run(iter_csv_rows(io.BytesIO(self.ROSTER)))
+        self.assertEqual((report['created'], report['updated'], len(report['errors'])), (1, 3, 2))
+        self.assertEqual(Patient.objects.filter(personal_number='NPA9010').count(), 1)
+
+    def test_ndjson_rows_and_dependent_limit(self):
+        lines = [
+            json.dumps(self.dependent('Obi')),
+            '{not json',
+            json.dumps(self.dependent('Ada')),
+            '["a list"]',
+            json.dumps(self.dependent(' obi ', surname='EZE', phone='0803')),
+        ]
+        report = PatientImporter().run(iter_ndjson_rows(io.BytesIO('\n'.join(lines).encode())))
+        self.assertEqual((report['created'], report['updated']), (1, 0))
+        errors = {error['row']: error['errors'] for error in report['errors']}
+        self.assertEqual(sorted(errors), [2, 3, 4])
+        self.assertIn('maximum number of dependents (1)', errors[3]['sponsor_id'])
+
+        dependent = Patient.objects.get(patient_type='Dependent')
+        self.assertEqual((dependent.sponsor_id, dependent.phone), (str(self.retiree.pk), '0803'))
+        self.assertEqual(dependent.patient_id, 'RD-NPA9005-01')
+
+    def test_failed_chunk_leaves_no_phantom_patients(self):
+        # Legacy rows already holding the ids the sequences hand out next make both inserts fail
+        blockers = [
+            Patient.objects.create(patient_type='NonNPA', non_npa_type='IT', surname='Legacy', first_name=str(i), patient_id=patient_id)
+            for i, patient_id in enumerate(['E-NPA9020-001', 'RD-NPA9005-01'])
+        ]
+        rows = [
+            {'patient_type': 'Employee', 'personal_number': 'NPA9020', 'surname': 'Ade', 'first_name': 'Kemi'},
+            self.dependent('Obi'),
+        ]
+        importer = PatientImporter(chunk_size=1)
+        report = importer.run(rows)
+        self.assertEqual(report['created'], 0)
+        self.assertEqual([(error['row'], list(error['errors'])) for error in report['errors']], [(1, ['non_field_errors']), (2, ['non_field_errors'])])
+
+        # The rolled-back rows are neither matched for update nor counted against the retiree's limit
+        Patient.objects.filter(pk__in=[blocker.pk for blocker in blockers]).delete()
+        report = importer.run(rows)
+        self.assertEqual((report['created'], report['updated'], len(report['errors'])), (2, 0, 2))
+        self.assertTrue(Patient.objects.filter(personal_number='NPA9020', patient_type='Employee').exists())
+
+    def test_bulk_import_endpoint_and_command(self):
+        upload = SimpleUploadedFile('roster.ndjson', json.dumps(self.dependent('Obi')).encode())
+        response = APIClient().post('/api/patients/bulk_import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['created'], response.json()['errors']), (1, []))
+        self.assertEqual(APIClient().post('/api/patients/bulk_import/', {}, format='multipart').status_code, 400)
+
+        with tempfile.NamedTemporaryFile(suffix='.csv') as roster:
+            roster.write(self.ROSTER)
+            roster.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('import_patients', roster.name, stdout=out, stderr=err)
+        self.assertIn('Created 3, updated 1, 2 row(s) rejected.', out.getvalue())
+        self.assertIn('Row 4:', err.getvalue())
+
+class PatientTypeaheadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Patient.objects.create(patient_type='Employee', personal_number='NPA7002', surname='Okaforiwe', first_name='Ben')
+        sponsor = Patient.objects.create(patient_type='Employee', personal_number='NPA7001', surname='Okafor', first_name='Ada')
+        Patient.objects.create(patient_type='Dependent', sponsor_id=str(sponsor.id), surname='Okafor', first_name='Chidi')
+        Patient.objects.create(patient_type='Employee', personal_number='NPA7003', surname='Bello', first_name='Sade')
+
+    def names(self, **params):
+        response = self.client.get('/api/patients/typeahead/', {'q': 'okafor', **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()]
+
+    def test_ranked_and_filtered_by_patient_type(self):
+        self.assertEqual(self.names(), ['Okafor Ada', 'Okafor Chidi', 'Okaforiwe Ben'])
+        self.assertEqual(self.names(patient_type='Employee, Retiree'), ['Okafor Ada', 'Okaforiwe Ben'])
+        self.assertEqual(self.client.get('/api/patients/typeahead/', {'q': ' '}).json(), [])
+
+    def test_limit_is_clamped(self):
+        self.assertEqual(self.names(limit=2), ['Okafor Ada', 'Okafor Chidi'])
+        self.assertEqual(self.names(limit=-1), ['Okafor Ada'])
+        self.assertEqual(self.names(limit=0), ['Okafor Ada'])
+        self.assertEqual(len(self.names(limit='many')), 3)
+
+class MedicationLookupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        def medication(name, generic_name=None, barcode=None):
+            return Medication.objects.create(
+                name=name, generic_name=generic_name, barcode=barcode, category='Analgesics', strength='500mg',
+                dosage_form='Tablet', manufacturer='Emzor', supplier='Emzor', location='Shelf A', pack_size=28
+            )
+        self.paracetamol = medication('Paracetamol', barcode='6151100012345')
+        medication('Panadol', 'Paracetamol')
+        medication('Paracetamol Extra', 'Paracetamol and Caffeine')
+        medication('Ibuprofen')
+        today = date.today()
+        receive_batch(self.paracetamol, 'System', 'PA-LATE', today + timedelta(days=365), 28, 1)
+        receive_batch(self.paracetamol, 'System', 'PA-SOON', today + timedelta(days=20), 28, 1)
+        receive_batch(self.paracetamol, 'System', 'PA-OLD', today - timedelta(days=1), 28, 1)
+
+    def test_barcode_returns_dispensable_batches_in_fifo_order(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/medications/barcode/', {'code': ' 6151100012345 '})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['name'], 'Paracetamol')
+        self.assertEqual([batch['batch_number'] for batch in data['active_batches']], ['PA-SOON', 'PA-LATE'])
+
+        self.assertEqual(self.client.get('/api/medications/barcode/', {'code': '000'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/medications/barcode/').status_code, 400)
+
+    def test_typeahead_ranks_names_and_generic_names(self):
+        def names(**params):
+            response = self.client.get('/api/medications/typeahead/', {'q': 'paracetamol', **params})
+            self.assertEqual(response.status_code, 200)
+            return [row['name'] for row in response.json()]
+
+        self.assertEqual(names(), ['Panadol', 'Paracetamol', 'Paracetamol Extra'])
+        self.assertEqual(names(limit=1), ['Panadol'])
+        self.assertEqual(names(limit=-5), ['Panadol'])
+        self.assertEqual(len(names(limit='all')), 3)
+        self.assertEqual(self.client.get('/api/medications/typeahead/').json(), [])
+
+class PatientDetailQueryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA1001', surname='Okafor', first_name='Ada'
+        )
+        room = ConsultationRoom.objects.create(name='Room 1')
+
+        VitalReading.objects.bulk_create([
+            VitalReading(patient=self.patient, systolic=120, diastolic=80) for _ in range(30)
+        ])
+        MedicalReport.objects.bulk_create([
+            MedicalReport(
+                patient=self.patient, file_number='F1', report_name=f'Report {i}', report_type='Lab',
+                date=date.today() - timedelta(days=i), doctor='Dr. Bello', status='completed'
+            ) for i in range(3)
+        ])
+        Visit.objects.bulk_create([
+            Visit(
+                patient=self.patient, visit_date=date.today() - timedelta(days=i), visit_time=time(9, 0),
+                visit_location='Headquarters', visit_type='consultation', clinic='General', consultation_room=room
+            ) for i in range(25)
+        ])
+        TimelineEvent.objects.bulk_create([
+            TimelineEvent(
+                patient=self.patient, date=date.today(), time=time(10, i), type='nursing', title=f'Event {i}',
+                description='Vitals taken', location='Ward', staff='Nurse'
+            ) for i in range(5)
+        ])
+        for first_name in ('Chidi', 'Ngozi'):
+            Patient.objects.create(
+                patient_type='Dependent', sponsor_id=str(self.patient.id), surname='Okafor', first_name=first_name
+            )
+
+    def test_retrieve_query_count_is_constant(self):
+        # patient, four bounded prefetches, dependents
+        with self.assertNumQueries(6):
+            response = self.client.get(f'/api/patients/{self.patient.id}/')
+        self.assertEqual(response.status_code, 200)
+
+        VitalReading.objects.bulk_create([VitalReading(patient=self.patient, heart_rate=70) for _ in range(50)])
+        with self.assertNumQueries(6):
+            self.client.get(f'/api/patients/{self.patient.id}/')
+
+    def test_nested_collections_are_bounded(self):
+        data = self.client.get(f'/api/patients/{self.patient.id}/').json()
+        limit = PatientDetailSerializer.NESTED_LIMIT
+
+        self.assertEqual(len(data['vitals']), limit)
+        self.assertEqual(len(data['visits']), limit)
+        self.assertEqual(len(data['reports']), 3)
+        self.assertTrue(data['nested_pagination']['vitals']['has_more'])
+        self.assertIsNotNone(data['nested_pagination']['vitals']['next'])
+        self.assertFalse(data['nested_pagination']['reports']['has_more'])
+        self.assertEqual(len(data['dependents']), 2)
+
+    def test_nested_next_cursor_resumes_after_window(self):
+        data = self.client.get(f'/api/patients/{self.patient.id}/').json()
+        window_ids = [vital['id'] for vital in data['vitals']]
+
+        page = self.client.get(data['nested_pagination']['vitals']['next']).json()
+        expected = list(VitalReading.objects.filter(patient=self.patient).values_list('id', flat=True))
+        self.assertEqual(window_ids + [vital['id'] for vital in page['results']], expected)
+        self.assertIsNone(page['next'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA2001', surname='Bello', first_name='Tunde'
+        )
+        # Several visits share a date so the walk has to break ties on time and id
+        Visit.objects.bulk_create([
+            Visit(
+                patient=self.patient, visit_date=date.today() - timedelta(days=i // 4), visit_time=time(9, i % 2),
+                visit_location='Headquarters', visit_type='consultation', clinic='General'
+            ) for i in range(23)
+        ])
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(visit['id'] for visit in page['results'])
+            url = page['next']
+            pages += 1
+        return ids, pages
+
+    def test_cursor_walk_matches_model_ordering(self):
+        expected = list(Visit.objects.values_list('id', flat=True))
+        ids, pages = self.walk('/api/visits/?page_size=5')
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 5)
+
+        ids, _ = self.walk(f'/api/patients/{self.patient.id}/visits/?page_size=7')
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/visits/?page_size=5').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_deep_page_is_a_single_query(self):
+        url = self.client.get('/api/visits/?page_size=20').json()['next']
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    def test_page_number_requests_keep_count(self):
+        data = self.client.get('/api/visits/?page=2&page_size=10').json()
+        self.assertEqual(data['count'], 23)
+        self.assertEqual(len(data['results']), 10)
+
+    def test_invalid_cursor_is_404(self):
+        self.assertEqual(self.client.get('/api/visits/?cursor=bogus').status_code, 404)
+
+
+async def open_socket(test, consumer, path, query_string=''):
+    communicator = ApplicationCommunicator(consumer.as_asgi(), {
+        'type': 'websocket', 'path': path, 'headers': [], 'query_string': query_string.encode(), 'subprotocols': [],
+    })
+    await communicator.send_input({'type': 'websocket.connect'})
+    test.assertEqual((await communicator.receive_output(timeout=2))['type'], 'websocket.accept')
+    return communicator
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PharmacyQueueStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA3001', surname='Eze', first_name='Obi'
+        )
+        self.visit = Visit.objects.create(
+            patient=patient, visit_date=date.today(), visit_time=time(9, 0),
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+        self.queue_item = PharmacyQueue.objects.create(prescription=Prescription.objects.create(visit=self.visit))
+        PharmacyQueue.objects.create(prescription=Prescription.objects.create(visit=self.visit), status='Dispensed')
+
+    async def connect(self):
+        return await open_socket(self, PharmacyQueueConsumer, '/ws/pharmacy-queue/')
+
+    async def receive_json(self, communicator):
+        return json.loads((await communicator.receive_output(timeout=2))['text'])
+
+    async def test_snapshot_then_transition_diffs(self):
+        communicator = await self.connect()
+        snapshot = await self.receive_json(communicator)
+        self.assertEqual(snapshot['type'], 'queue.snapshot')
+        self.assertEqual([entry['id'] for entry in snapshot['data']], [str(self.queue_item.id)])
+
+        await sync_to_async(self.client.post)(f'/api/pharmacy-queue/{self.queue_item.id}/assign_to_me/')
+        event = await self.receive_json(communicator)
+        self.assertEqual(event['type'], 'queue.assigned')
+        self.assertEqual(event['data']['status'], 'Processing')
+        self.assertEqual(event['data']['assigned_pharmacist_name'], 'Default Pharmacist')
+        self.assertNotIn('prescription_details', event['data'])
+
+        await sync_to_async(self.client.post)(f'/api/pharmacy-queue/{self.queue_item.id}/mark_ready/')
+        event = await self.receive_json(communicator)
+        self.assertEqual((event['type'], event['data']['status']), ('queue.ready', 'Ready'))
+
+        await sync_to_async(self.client.post)('/api/prescriptions/', {'visit': self.visit.id, 'items': []}, format='json')
+        event = await self.receive_json(communicator)
+        self.assertEqual(event['type'], 'queue.created')
+        self.assertIn('prescription_details', event['data'])
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class VisitEventTests(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA4001', surname='Adeyemi', first_name='Sola'
+        )
+        self.room = ConsultationRoom.objects.create(name='Room 2')
+        self.visit = Visit.objects.create(
+            patient=self.patient, visit_date=date.today(), visit_time=time(9, 0),
+            visit_location='Headquarters', visit_type='consultation', clinic='Dental'
+        )
+
+    async def test_events_reach_only_matching_scopes(self):
+        everything = await open_socket(self, VisitConsumer, '/ws/visits/')
+        dental = await open_socket(self, VisitConsumer, '/ws/visits/', 'clinic=Dental&location=Headquarters')
+        cardiology = await open_socket(self, VisitConsumer, '/ws/visits/', 'clinic=Cardiology')
+        room = await open_socket(self, VisitConsumer, '/ws/visits/', f'room={self.room.id}')
+
+        await sync_to_async(self.client.patch)(
+            f'/api/visits/{self.visit.id}/', {'status': 'Confirmed', 'consultation_room': self.room.id}, format='json'
+        )
+        for communicator in (everything, dental, room):
+            event = json.loads((await communicator.receive_output(timeout=2))['text'])
+            self.assertEqual(event['type'], 'visit.update')
+            self.assertEqual((event['data']['id'], event['data']['change']), (self.visit.id, 'status'))
+            self.assertEqual(event['data']['consultation_room'], str(self.room.id))
+        self.assertTrue(await cardiology.receive_nothing())
+
+        # Moving the visit out of the room still tells the room screen
+        await sync_to_async(self.client.patch)(f'/api/visits/{self.visit.id}/', {'consultation_room': None}, format='json')
+        event = json.loads((await room.receive_output(timeout=2))['text'])
+        self.assertEqual((event['data']['change'], event['data']['consultation_room']), ('updated', None))
+
+        for communicator in (everything, dental, cardiology, room):
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+
+
+class ConsultationQueueTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.room = ConsultationRoom.objects.create(name='Room A')
+        self.other_room = ConsultationRoom.objects.create(name='Room B')
+        patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA5001', surname='Nwosu', first_name='Ifeoma'
+        )
+        self.visits = [
+            Visit.objects.create(
+                patient=patient, visit_date=date.today(), visit_time=time(8, i),
+                visit_location='Headquarters', visit_type='consultation', clinic='General'
+            ) for i in range(4)
+        ]
+
+    def post(self, room, action, data=None):
+        return self.client.post(f'/api/rooms/{room.id}/{action}/', data or {}, format='json')
+
+    def queued(self, room):
+        return [entry['visit'] for entry in self.client.get(f'/api/rooms/{room.id}/').json()['queue']]
+
+    def test_enqueue_appends_and_moves_between_rooms(self):
+        for visit in self.visits[:3]:
+            self.assertEqual(self.post(self.room, 'enqueue', {'visit': visit.id}).status_code, 201)
+        self.assertEqual(self.queued(self.room), [visit.id for visit in self.visits[:3]])
+        self.assertEqual(self.post(self.room, 'enqueue', {'visit': self.visits[0].id}).status_code, 400)
+
+        response = self.post(self.other_room, 'enqueue', {'visit': self.visits[1].id, 'priority': 'Emergency'})
+        self.assertEqual(response.json()['queue'][0]['priority'], 'Emergency')
+        self.assertEqual(self.queued(self.room), [self.visits[0].id, self.visits[2].id])
+        self.visits[1].refresh_from_db()
+        self.assertEqual(self.visits[1].consultation_room_id, self.other_room.id)
+
+    def test_reorder_keeps_unlisted_entries(self):
+        for visit in self.visits:
+            self.post(self.room, 'enqueue', {'visit': visit.id})
+        ids = [visit.id for visit in self.visits]
+
+        response = self.post(self.room, 'reorder', {'order': [ids[2], ids[0]]})
+        self.assertEqual([entry['visit'] for entry in response.json()['queue']], [ids[2], ids[0], ids[1], ids[3]])
+        self.assertEqual([entry['position'] for entry in response.json()['queue']], [1, 2, 3, 4])
+
+        response = self.post(self.room, 'reorder', {'visit': ids[3], 'position': 1})
+        self.assertEqual([entry['visit'] for entry in response.json()['queue']], [ids[3], ids[2], ids[0], ids[1]])
+        self.assertEqual(self.post(self.room, 'reorder', {'order': [999999]}).status_code, 400)
+
+    def test_next_patient_takes_head_and_starts_consultation(self):
+        for visit in self.visits[:2]:
+            self.post(self.room, 'enqueue', {'visit': visit.id})
+        self.post(self.room, 'dequeue', {'visit': self.visits[0].id})
+        self.visits[0].refresh_from_db()
+        self.assertIsNone(self.visits[0].consultation_room_id)
+        self.assertEqual(self.post(self.room, 'dequeue', {'visit': self.visits[0].id}).status_code, 404)
+        self.post(self.room, 'enqueue', {'visit': self.visits[2].id})
+
+        response = self.post(self.room, 'next_patient')
+        self.assertEqual(response.json()['visit']['id'], self.visits[1].id)
+        self.assertEqual(response.json()['queue'][0]['visit'], self.visits[2].id)
+        self.visits[1].refresh_from_db()
+        self.room.refresh_from_db()
+        self.assertEqual(self.visits[1].status, 'In Progress')
+        self.assertEqual((self.room.status, self.room.current_patient_id), ('occupied', self.visits[1].patient_id))
+
+        self.post(self.room, 'next_patient')
+        self.assertEqual(self.post(self.room, 'next_patient').status_code, 404)
+
+class TriageTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA6001', surname='Eze', first_name='Chidi'
+        )
+        self.now = timezone.now()
+
+    def waiting(self, priority, minutes_ago, clinic='General'):
+        return Visit.objects.create(
+            patient=self.patient, visit_date=date.today(), visit_time=time(8, 0), visit_location='Headquarters',
+            visit_type='consultation', clinic=clinic, priority=priority, status='In Nursing Pool',
+            nursing_received_at=self.now - timedelta(minutes=minutes_ago),
+        )
+
+    def test_pool_ages_low_priority_visits_ahead(self):
+        low = self.waiting('Low', 30)
+        medium = self.waiting('Medium', 0)
+        high = self.waiting('High', 0)
+        emergency = self.waiting('Emergency', 0)
+        ConsultationRoom.objects.create(name='General 1', average_consultation_time=10)
+
+        response = self.client.get('/api/rooms/triage/', {'clinic': 'General'})
+        waiting = response.json()['waiting']
+        self.assertEqual([entry['id'] for entry in waiting], [emergency.id, high.id, low.id, medium.id])
+        self.assertEqual([entry['estimated_wait'] for entry in waiting], [0, 10, 20, 30])
+        self.assertEqual(self.client.get('/api/rooms/triage/', {'clinic': 'Nowhere'}).status_code, 400)
+
+    def test_assign_next_routes_to_least_loaded_matching_room(self):
+        eye_room = ConsultationRoom.objects.create(name='Eye 1', specialty_focus='Eye', status='occupied')
+        busy = ConsultationRoom.objects.create(name='General 1', average_consultation_time=12)
+        idle = ConsultationRoom.objects.create(name='General 2', specialty_focus='General')
+        ConsultationRoom.objects.create(name='General 3', status='maintenance')
+        self.client.post(f'/api/rooms/{busy.id}/enqueue/', {'visit': self.waiting('Low', 90).id}, format='json')
+
+        eye_visit = self.waiting('Medium', 5, clinic='Eye')
+        response = self.client.post('/api/rooms/assign_next/', {'clinic': 'Eye'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['consultation_room'], response.json()['estimated_wait']), (str(eye_room.id), 15))
+        eye_visit.refresh_from_db()
+        self.assertEqual((eye_visit.status, eye_visit.consultation_room_id), ('Queued', eye_room.id))
+
+        first, second = self.waiting('High', 0), self.waiting('Medium', 0)
+        response = self.client.post('/api/rooms/assign_next/', {'clinic': 'General'}, format='json')
+        self.assertEqual((response.json()['visit']['id'], response.json()['consultation_room']), (first.id, str(idle.id)))
+        response = self.client.post('/api/rooms/assign_next/', {'clinic': 'General'}, format='json')
+        self.assertEqual((response.json()['visit']['id'], response.json()['consultation_room']), (second.id, str(busy.id)))
+        self.assertEqual((response.json()['position'], response.json()['estimated_wait']), (2, 12))
+        self.assertEqual(self.client.post('/api/rooms/assign_next/', {'clinic': 'General'}, format='json').status_code, 404)
+
+class ConsultationStatsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.room = ConsultationRoom.objects.create(name='General 1')
+        self.doctor = User.objects.create(name='Dr Bello', email='bello@npa.test', role='doctor')
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA7001', surname='Okoro', first_name='Ada'
+        )
+
+    def end_session(self, minutes, ended=None):
+        ended = ended or timezone.now()
+        session = ConsultationSession.objects.create(
+            room=self.room, doctor=self.doctor, patient=self.patient, start_time=ended - timedelta(minutes=minutes)
+        )
+        response = self.client.patch(f'/api/sessions/{session.id}/', {'end_time': ended.isoformat(), 'status': 'completed'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return session
+
+    def test_ending_sessions_updates_room_counters_once(self):
+        durations = [10, 20, 30, 40, 50, 12]
+        for minutes in durations[:4]:
+            session = self.end_session(minutes)
+        self.room.refresh_from_db()
+        # Too few consultations today to replace the (missing) average with today's mean yet
+        self.assertEqual((self.room.total_consultations_today, self.room.average_consultation_time), (4, 10))
+
+        self.client.patch(f'/api/sessions/{session.id}/', {'notes': 'Reviewed'}, format='json')
+        for minutes in durations[4:]:
+            self.end_session(minutes)
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.total_consultations_today, self.room.average_consultation_time), (6, 27))
+
+    def test_window_merges_daily_buckets(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        durations = [8, 14, 22, 35]
+        for minutes in durations[:2]:
+            self.end_session(minutes, ended=yesterday)
+        for minutes in durations[2:]:
+            self.end_session(minutes)
+
+        stats = self.client.get('/api/sessions/stats/', {'room': self.room.id, 'days': 2}).json()
+        self.assertEqual((stats['count'], len(stats['daily'])), (4, 2))
+        self.assertAlmostEqual(stats['mean'], mean(durations), delta=0.1)
+        self.assertAlmostEqual(stats['stddev'], stdev(durations), delta=0.1)
+        self.assertEqual((stats['min'], stats['max']), (8, 35))
+        self.assertTrue(8 <= stats['percentiles']['p50'] <= stats['percentiles']['p95'] <= 35)
+        self.assertEqual(self.client.get('/api/sessions/stats/', {'doctor': self.doctor.id, 'days': 1}).json()['count'], 2)
+        self.assertEqual(self.client.get('/api/sessions/stats/').status_code, 400)
+
+        start_day()
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.total_consultations_today, self.room.average_consultation_time), (0, 11))
+
+class PrescriptionAvailabilityTests(TestCase):
+    def setUp(self):
+        patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8001', surname='Adeyemi', first_name='Tunde'
+        )
+        visit = Visit.objects.create(
+            patient=patient, visit_date=date.today(), visit_time=time(9, 0),
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+        self.prescription = Prescription.objects.create(visit=visit)
+        medication = Medication.objects.create(
+            name='Amoxicillin', category='Antibiotics', strength='500mg', dosage_form='Capsule',
+            manufacturer='Emzor', supplier='Emzor', location='Shelf A', current_stock=20
+        )
+        for quantity, item_status in [(10, 'Pending'), (30, 'Pending'), (5, 'Dispensed'), (5, 'Substituted')]:
+            PrescriptionItem.objects.create(
+                prescription=self.prescription, medication=medication, dosage='1 cap', frequency='TDS',
+                duration='5 days', route='Oral', quantity=quantity, status=item_status
+            )
+
+    def test_pending_items_resolved_and_counters_persisted(self):
+        with self.assertNumQueries(3):
+            self.prescription.update_availability_status()
+
+        statuses = sorted(self.prescription.items.values_list('status', flat=True))
+        self.assertEqual(statuses, ['Available', 'Dispensed', 'Out of Stock', 'Substituted'])
+        stored = Prescription.objects.get(pk=self.prescription.pk)
+        self.assertEqual(
+            (stored.total_items, stored.available_items, stored.out_of_stock_items, stored.dispensed_items),
+            (4, 2, 1, 1)
+        )
+
+class PrescriptionItemWriteTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8101', surname='Bassey', first_name='Eno'
+        )
+        self.visit = Visit.objects.create(
+            patient=patient, visit_date=date.today(), visit_time=time(9, 0),
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+        self.medications = [
+            Medication.objects.create(
+                name=f'Drug {i}', category='Other', strength='10mg', dosage_form='Tablet',
+                manufacturer='Emzor', supplier='Emzor', location='Shelf B', current_stock=15
+            ) for i in range(10)
+        ]
+
+    def item(self, medication, quantity=10):
+        return {
+            'medication': str(medication.id), 'dosage': '1 tab', 'frequency': 'BD',
+            'duration': '7 days', 'route': 'Oral', 'quantity': quantity,
+        }
+
+    def test_create_and_diffed_update_use_a_handful_of_queries(self):
+        items = [self.item(medication) for medication in self.medications]
+        with self.assertNumQueries(18):
+            response = self.client.post('/api/prescriptions/', {'visit': self.visit.id, 'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        prescription = Prescription.objects.get()
+        self.assertEqual((prescription.total_items, prescription.available_items), (10, 10))
+        before = dict(prescription.items.values_list('medication_id', 'id'))
+
+        # Raise one quantity past stock, drop one item and add nothing else
+        items[0]['quantity'] = 20
+        with self.assertNumQueries(11):
+            response = self.client.patch(f'/api/prescriptions/{prescription.id}/', {'items': items[:9]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        after = dict(prescription.items.values_list('medication_id', 'id'))
+        self.assertEqual(after, {medication_id: before[medication_id] for medication_id in after})
+        self.assertEqual(len(after), 9)
+        prescription.refresh_from_db()
+        self.assertEqual((prescription.total_items, prescription.out_of_stock_items), (9, 1))
+
+        response = self.client.patch(
+            f'/api/prescriptions/{prescription.id}/', {'items': [{**items[0], 'medication': str(self.visit.patient_id)}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_blank_and_missing_instructions_are_unchanged(self):
+        items = [self.item(medication) for medication in self.medications[:3]]
+        self.client.post('/api/prescriptions/', {'visit': self.visit.id, 'items': items}, format='json')
+        prescription = Prescription.objects.get()
+        prescription.items.update(instructions=None)
+        before = dict(prescription.items.values_list('id', 'updated_at'))
+
+        items[0]['instructions'] = None
+        items[1]['instructions'] = ''
+        response = self.client.patch(f'/api/prescriptions/{prescription.id}/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict(prescription.items.values_list('id', 'updated_at')), before)
+
+class DrugInteractionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        def medication(name, generic_name=None):
+            return Medication.objects.create(
+                name=name, generic_name=generic_name, category='Other', strength='10mg', dosage_form='Tablet',
+                manufacturer='Emzor', supplier='Emzor', location='Shelf C', current_stock=50
+            )
+        self.warfarin = medication('Coumadin', 'Warfarin Sodium')
+        self.aspirin = medication('Aspirin 75')
+        self.lithium = medication('Priadel', 'Lithium Carbonate')
+        self.thiazide = medication('Hydrochlorothiazide')
+        self.paracetamol = medication('Paracetamol')
+
+    def check(self, data):
+        return self.client.post('/api/medications/check-interactions/', data, format='json').json()
+
+    def test_rules_match_names_generic_names_and_substrings(self):
+        ids = [str(m.id) for m in (self.warfarin, self.paracetamol, self.lithium, self.aspirin, self.thiazide)]
+        interactions = self.check({'medication_ids': ids})['interactions']
+        self.assertEqual(
+            [(i['drug1'], i['drug2'], i['severity']) for i in interactions],
+            [('Coumadin', 'Aspirin 75', 'Major'), ('Priadel', 'Hydrochlorothiazide', 'Major')]
+        )
+        self.assertEqual(self.check({'medication_ids': [str(self.paracetamol.id), str(self.aspirin.id)]})['interactions'], [])
+
+    def test_index_is_reused_until_rules_change(self):
+        ids = [str(self.warfarin.id), str(self.paracetamol.id)]
+        self.check({'medication_ids': ids})
+        # One query for the rules version, one for the medications; no recompilation
+        with self.assertNumQueries(2):
+            self.assertEqual(self.check({'medication_ids': ids})['interactions'], [])
+
+        rule = DrugInteraction.objects.create(
+            drug1_patterns=['warfarin'], drug2_patterns=['paracetamol', 'acetaminophen'], severity='Moderate',
+            description='Raised INR with regular use', recommendation='Monitor INR'
+        )
+        self.assertEqual(len(self.check({'medication_ids': ids})['interactions']), 1)
+
+        # Bulk edits bypass updated_at but still retire the cached index
+        DrugInteraction.objects.filter(pk=rule.pk).update(is_active=False)
+        self.assertEqual(self.check({'medication_ids': ids})['interactions'], [])
+
+    def test_prescriptions_checked_in_one_batch(self):
+        patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8201', surname='Okafor', first_name='Nneka'
+        )
+        visit = Visit.objects.create(
+            patient=patient, visit_date=date.today(), visit_time=time(9, 0),
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+        risky, safe = Prescription.objects.create(visit=visit), Prescription.objects.create(visit=visit)
+        for prescription, medications in ((risky, [self.lithium, self.thiazide]), (safe, [self.paracetamol, self.aspirin])):
+            for medication in medications:
+                PrescriptionItem.objects.create(
+                    prescription=prescription, medication=medication, dosage='1 tab', frequency='OD',
+                    duration='7 days', route='Oral', quantity=7
+                )
+
+        results = self.check({'prescriptions': [str(risky.id), str(safe.id)]})['results']
+        self.assertEqual((len(results[str(risky.id)]), results[str(safe.id)]), (1, []))
+        self.assertEqual(len(self.check({'prescription': str(risky.id)})['interactions']), 1)
+
+class ActiveMedicationScreeningTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8301', surname='Ibrahim', first_name='Musa'
+        )
+        self.visit = Visit.objects.create(
+            patient=patient, visit_date=date.today(), visit_time=time(9, 0),
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+
+        def medication(name, generic_name=None):
+            return Medication.objects.create(
+                name=name, generic_name=generic_name, category='Other', strength='10mg', dosage_form='Tablet',
+                manufacturer='Emzor', supplier='Emzor', location='Shelf D'
+            )
+        self.lithium = medication('Priadel', 'Lithium Carbonate')
+        self.thiazide = medication('Hydrochlorothiazide')
+        receive_batch(self.lithium, 'System', 'LI-1', date.today() + timedelta(days=365), 28, 2)
+
+    def prescribe(self, medication, duration='7 days'):
+        item = {
+            'medication': str(medication.id), 'dosage': '1 tab', 'frequency': 'OD',
+            'duration': duration, 'route': 'Oral', 'quantity': 14,
+        }
+        return self.client.post('/api/prescriptions/', {'visit': self.visit.id, 'items': [item]}, format='json')
+
+    def test_new_items_screened_against_dispensed_medications(self):
+        self.assertEqual(self.prescribe(self.lithium, duration='2/52').json()['interaction_warnings'], [])
+        prescription = Prescription.objects.get()
+        item = prescription.items.get()
+        response = self.client.post(
+            f'/api/pharmacy-queue/{prescription.queue.get().id}/dispense_items/',
+            {'items': [{'item_id': str(item.id), 'quantity_to_dispense': 14}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        active = PatientActiveMedication.objects.get()
+        self.assertEqual(active.medication_id, self.lithium.id)
+        self.assertEqual((active.active_until - active.dispensed_at).days, 21)
+
+        warnings = self.prescribe(self.thiazide).json()['interaction_warnings']
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual((warnings[0]['severity'], warnings[0]['with_active_medication']), ('Major', True))
+
+        self.client.patch(f'/api/prescriptions/{prescription.id}/cancel/')
+        self.assertFalse(PatientActiveMedication.objects.exists())
+        self.assertEqual(self.prescribe(self.thiazide).json()['interaction_warnings'], [])
+
+    def test_substituted_items_dispense_and_count_the_substitute(self):
+        self.prescribe(self.thiazide)
+        prescription = Prescription.objects.get()
+        item = prescription.items.get()
+        item.substituted_with = self.lithium
+        item.status = 'Substituted'
+        item.save()
+
+        response = self.client.post(
+            f'/api/pharmacy-queue/{prescription.queue.get().id}/dispense_items/',
+            {'items': [{'item_id': str(item.id), 'quantity_to_dispense': 14}]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PatientActiveMedication.objects.get().medication_id, self.lithium.id)
+        self.assertEqual(StockTransaction.objects.get(type='Dispensed').medication_id, self.lithium.id)
+        self.assertEqual(MedicationUsageDaily.objects.get(medication=self.lithium).dispensed, 14)
+        self.assertFalse(MedicationUsageDaily.objects.filter(medication=self.thiazide).exists())
+        self.lithium.refresh_from_db()
+        self.assertEqual(self.lithium.current_stock, 42)
+
+
+class UsageRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+        def medication(name):
+            medication = Medication.objects.create(
+                name=name, category='Analgesics', strength='500mg', dosage_form='Tablet',
+                manufacturer='Emzor', supplier='Emzor', location='Shelf A', pack_size=28
+            )
+            receive_batch(medication, 'System', f'{name[:3]}-1', date.today() + timedelta(days=365), 28, 10)
+            return medication
+        self.paracetamol = medication('Paracetamol')
+        self.ibuprofen = medication('Ibuprofen')
+        self.idle = medication('Aspirin')
+
+    def days(self):
+        return list(MedicationUsageDaily.objects.values_list('medication_id', 'dispensed', 'dispense_count', 'restocked'))
+
+    def test_ledger_writes_fold_into_daily_rows(self):
+        dispense([(self.paracetamol.id, 60), (self.ibuprofen.id, 20)], 'Pharmacist')
+        dispense([(self.paracetamol.id, 70)], 'Pharmacist')
+        today = MedicationUsageDaily.objects.get(medication=self.paracetamol, date=timezone.localdate())
+        self.assertEqual((today.dispensed, today.dispense_count, today.restocked), (130, 2, 280))
+
+        live = self.days()
+        self.assertEqual(rebuild(), 3)
+        self.assertEqual(sorted(self.days()), sorted(live))
+
+    def test_analytics_endpoints(self):
+        dispense([(self.paracetamol.id, 150), (self.ibuprofen.id, 20)], 'Pharmacist')
+        # A dispense from months ago, known only to the ledger until the rollup is rebuilt
+        old = StockTransaction.objects.create(
+            medication=self.idle, type='Dispensed', quantity=-5, previous_stock=280, new_stock=275
+        )
+        StockTransaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=120))
+        rebuild(since=timezone.localdate() - timedelta(days=200))
+
+        fast = self.client.get('/api/medications/fast_moving/').json()['results']
+        self.assertEqual([(row['medication_name'], row['total_dispensed']) for row in fast], [('Paracetamol', 150)])
+
+        slow = self.client.get('/api/medications/slow_moving/', {'days': 90}).json()['results']
+        self.assertEqual([row['name'] for row in slow], ['Aspirin'])
+        self.assertEqual(slow[0]['last_dispensed'], str(timezone.localdate() - timedelta(days=120)))
+        self.assertEqual(self.client.get('/api/medications/slow_moving/').json()['results'], [])
+
+        usage = self.client.get(f'/api/medications/{self.paracetamol.id}/usage/', {'days': 90}).json()
+        self.assertEqual((usage['total_dispensed'], len(usage['daily'])), (150, 1))
+        self.assertEqual(usage['recommendations']['monthly_usage'], 50)
+        self.assertEqual(self.client.get('/api/medications/fast_moving/', {'days': 'x'}).status_code, 400)
+
+    def test_manual_ledger_entries_are_append_only(self):
+        response = self.client.post('/api/stock-transactions/', {
+            'medication': str(self.idle.id), 'type': 'Adjusted', 'quantity': -3, 'previous_stock': 280, 'new_stock': 277
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        url = f"/api/stock-transactions/{response.json()['id']}/"
+
+        self.assertEqual(self.client.patch(url, {'quantity': -300}, format='json').status_code, 405)
+        self.assertEqual(self.client.put(url, {**response.json(), 'quantity': -300}, format='json').status_code, 405)
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertEqual(self.client.get(url).json()['quantity'], -3)
+        self.assertEqual(MedicationUsageDaily.objects.get(medication=self.idle).adjusted, -3)
+
+class ExpirySweepTests(TestCase):
+    def setUp(self):
+        def medication(name):
+            return Medication.objects.create(
+                name=name, category='Analgesics', strength='500mg', dosage_form='Tablet',
+                manufacturer='Emzor', supplier='Emzor', location='Shelf E', pack_size=28
+            )
+        self.today = date.today()
+        self.paracetamol = medication('Paracetamol')
+        self.short = receive_batch(self.paracetamol, 'System', 'PA-1', self.today + timedelta(days=60), 28, 1)
+        self.long = receive_batch(self.paracetamol, 'System', 'PA-2', self.today + timedelta(days=90), 28, 2)
+        # An emptied batch still marked Active, as one edited by hand would be
+        self.ibuprofen = medication('Ibuprofen')
+        self.empty = receive_batch(self.ibuprofen, 'System', 'IB-1', self.today + timedelta(days=365), 28, 1)
+        MedicationBatch.objects.filter(pk=self.empty.pk).update(remaining_tablets=0)
+        Medication.objects.filter(pk=self.ibuprofen.pk).update(current_stock=0)
+
+    def statuses(self):
+        return dict(MedicationBatch.objects.values_list('batch_number', 'status'))
+
+    def test_expired_batches_written_off_once(self):
+        result = sweep_expiry(today=self.today + timedelta(days=61))
+        self.assertEqual((result['expired'], result['near_expiry'], result['depleted']), (1, 1, 1))
+        self.assertEqual(self.statuses(), {'PA-1': 'Expired', 'PA-2': 'Near Expiry', 'IB-1': 'Depleted'})
+
+        written_off = StockTransaction.objects.get(type='Expired')
+        self.assertEqual(
+            (written_off.medication_id, written_off.quantity, written_off.previous_stock, written_off.new_stock),
+            (self.paracetamol.id, -28, 84, 56)
+        )
+        self.paracetamol.refresh_from_db()
+        self.ibuprofen.refresh_from_db()
+        self.assertEqual((self.paracetamol.current_stock, self.paracetamol.status), (56, 'Expired'))
+        self.assertEqual(self.ibuprofen.status, 'Out of Stock')
+        self.assertEqual(MedicationUsageDaily.objects.get(medication=self.paracetamol).expired, 28)
+
+        # A second run over the same day finds nothing left to move or write off
+        result = sweep_expiry(today=self.today + timedelta(days=61))
+        self.assertEqual((result['expired'], result['near_expiry'], result['depleted']), (0, 0, 0))
+        self.assertEqual(StockTransaction.objects.filter(type='Expired').count(), 1)
+        self.paracetamol.refresh_from_db()
+        self.assertEqual(self.paracetamol.current_stock, 56)
+        self.assertEqual(MedicationUsageDaily.objects.get(medication=self.paracetamol).expired, 28)
+
+    def test_near_expiry_then_expired(self):
+        result = sweep_expiry(today=self.today + timedelta(days=40))
+        self.assertEqual((result['expired'], result['near_expiry'], result['depleted']), (0, 1, 1))
+        self.assertEqual(self.statuses(), {'PA-1': 'Near Expiry', 'PA-2': 'Active', 'IB-1': 'Depleted'})
+        self.paracetamol.refresh_from_db()
+        self.assertEqual((self.paracetamol.current_stock, self.paracetamol.status), (84, 'Near Expiry'))
+
+        # Near Expiry batches still count toward stock, so they are written off when they lapse
+        result = sweep_expiry(today=self.today + timedelta(days=61))
+        self.assertEqual((result['expired'], result['near_expiry']), (1, 1))
+        self.assertEqual(StockTransaction.objects.get(type='Expired').quantity, -28)
+
+class VitalSeriesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8401', surname='Eze', first_name='Chidi'
+        )
+        self.end = timezone.now().replace(microsecond=0)
+        self.start = self.end - timedelta(hours=24)
+        # A reading every 15 minutes for a day, heart rate climbing by one each time
+        readings = VitalReading.objects.bulk_create([
+            VitalReading(patient=self.patient, heart_rate=60 + index, systolic=120) for index in range(96)
+        ])
+        for index, reading in enumerate(readings):
+            VitalReading.objects.filter(pk=reading.pk).update(date=self.start + timedelta(minutes=15 * index))
+
+    def get(self, **params):
+        params = {'start': self.start.isoformat(), 'end': self.end.isoformat(), **params}
+        return self.client.get(f'/api/patients/{self.patient.id}/vitals/series/', params)
+
+    def test_buckets_are_bounded_and_summarised(self):
+        with self.assertNumQueries(2):
+            data = self.get(metrics='heart_rate', points=12).json()
+        self.assertEqual(data['bucket_seconds'], 7200)
+        self.assertEqual(len(data['series']), 12)
+        first = data['series'][0]
+        self.assertEqual(first['count'], 8)
+        self.assertEqual(first['heart_rate'], {'min': 60, 'max': 67, 'mean': 63.5})
+        self.assertNotIn('systolic', first)
+
+    def test_sparse_metrics_and_bad_parameters(self):
+        data = self.get(metrics='heart_rate,pain_scale', points=1000).json()
+        self.assertEqual(len(data['series']), 96)
+        self.assertIsNone(data['series'][0]['pain_scale'])
+        self.assertEqual(self.get(metrics='pain_scale').json()['series'], [])
+        self.assertEqual(self.get(metrics='cholesterol').status_code, 400)
+        self.assertEqual(self.get(start=self.end.isoformat()).status_code, 400)
+        self.assertEqual(self.get(end='yesterday').status_code, 400)
+        response = self.client.get(f'/api/patients/{self.patient.id}/vitals/series/', {'end': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+class VitalIngestTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patients = [
+            Patient.objects.create(patient_type='Employee', personal_number=f'NPA85{index:02}', surname='Bello', first_name=f'Ward{index}')
+            for index in range(3)
+        ]
+
+    def test_json_array_across_patients(self):
+        taken = (timezone.now() - timedelta(hours=1)).replace(microsecond=0)
+        rows = [
+            {'patient': patient.id, 'date': taken.isoformat(), 'heart_rate': 70 + index, 'oxygen_saturation': '97.5'}
+            for index, patient in enumerate(self.patients)
+        ] * 20
+        rows += [
+            {'patient': 999999, 'heart_rate': 80},
+            {'patient': self.patients[0].id, 'systolic': -5, 'pulse': 80},
+            {'heart_rate': 'fast'},
+        ]
+        with self.assertNumQueries(8):
+            data = self.client.post('/api/vitals/bulk/', rows, format='json').json()
+        self.assertEqual((data['created'], data['failed']), (60, 3))
+        self.assertEqual(data['results'][60]['errors'], {'patient': 'Patient not found.'})
+        self.assertEqual(set(data['results'][61]['errors']), {'systolic', 'pulse'})
+        self.assertEqual(set(data['results'][62]['errors']), {'patient', 'heart_rate'})
+        reading = VitalReading.objects.get(pk=data['results'][1]['id'])
+        self.assertEqual((reading.patient_id, reading.heart_rate, reading.oxygen_saturation, reading.date),
+                         (self.patients[1].id, 71, 97.5, taken))
+
+    def test_ndjson_body(self):
+        body = '\n'.join([
+            json.dumps({'patient': self.patients[0].id, 'temperature': 38.2}),
+            '{not json',
+            '',
+            json.dumps({'patient': self.patients[1].id, 'respiratory_rate': 22, 'comment': 'Round 2'}),
+        ])
+        response = self.client.post('/api/vitals/bulk/', body, content_type='application/x-ndjson')
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 1))
+        self.assertEqual([result['row'] for result in data['results']], [1, 2, 3])
+        self.assertIn('Invalid JSON', data['results'][1]['errors']['row'])
+        self.assertEqual(VitalReading.objects.get(patient=self.patients[1]).comment, 'Round 2')
+        self.assertEqual(self.client.post('/api/vitals/bulk/', {'patient': 1}, format='json').status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class EarlyWarningTests(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8601', surname='Okafor', first_name='Ada'
+        )
+        self.other = Patient.objects.create(
+            patient_type='Employee', personal_number='NPA8602', surname='Musa', first_name='Bala'
+        )
+        Visit.objects.create(
+            patient=self.patient, visit_date=date.today(), visit_time=time(9, 0), status='In Progress',
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+
+    def test_readings_scored_by_news2_bands(self):
+        def scored(**values):
+            reading = VitalReading(patient=self.patient, **values)
+            VitalReading.score([reading])
+            return reading.early_warning_score, reading.early_warning_risk
+        self.assertEqual(scored(respiratory_rate=16, oxygen_saturation=98, systolic=120, heart_rate=70, temperature=36.8), (0, 'Low'))
+        self.assertEqual(scored(respiratory_rate=22, oxygen_saturation=95, systolic=105, heart_rate=115, temperature=38.5), (7, 'High'))
+        self.assertEqual(scored(heart_rate=95, temperature=39.2, oxygen_saturation=94), (4, 'Low'))
+        self.assertEqual(scored(respiratory_rate=26), (3, 'Low-Medium'))
+        self.assertEqual(scored(systolic=100, heart_rate=112, temperature=35.5), (5, 'Medium'))
+        self.assertEqual(scored(weight=70), (None, ''))
+
+    async def test_risk_changes_pushed_and_listed(self):
+        communicator = await open_socket(self, EarlyWarningConsumer, '/ws/early-warnings/')
+        now = timezone.now()
+        rows = [
+            {'patient': self.patient.id, 'date': (now - timedelta(minutes=30)).isoformat(), 'heart_rate': 72, 'respiratory_rate': 16},
+            {'patient': self.patient.id, 'date': (now - timedelta(minutes=15)).isoformat(), 'heart_rate': 135, 'respiratory_rate': 26, 'systolic': 95},
+            {'patient': self.other.id, 'heart_rate': 70, 'respiratory_rate': 26},
+        ]
+        data = (await sync_to_async(self.client.post)('/api/vitals/bulk/', rows, format='json')).json()
+        self.assertEqual([result['early_warning_score'] for result in data['results']], [0, 8, 3])
+
+        alerts = {}
+        for _ in range(2):
+            event = json.loads((await communicator.receive_output(timeout=2))['text'])
+            self.assertEqual(event['type'], 'early_warning.changed')
+            alerts[event['data']['patient']] = event['data']
+        self.assertEqual((alerts[self.patient.id]['risk'], alerts[self.patient.id]['escalated']), ('High', True))
+        self.assertEqual(alerts[self.other.id]['risk'], 'Low-Medium')
+
+        # An older reading arriving late does not replace the current score
+        await sync_to_async(self.client.post)('/api/vitals/bulk/', [
+            {'patient': self.patient.id, 'date': (now - timedelta(hours=2)).isoformat(), 'heart_rate': 70},
+        ], format='json')
+        self.assertTrue(await communicator.receive_nothing())
+        warning = await sync_to_async(PatientEarlyWarning.objects.get)(patient=self.patient)
+        self.assertEqual(
+            (warning.score, warning.risk, warning.scored_at), (8, 'High', now - timedelta(minutes=15))
+        )
+
+        at_risk = (await sync_to_async(self.client.get)('/api/patients/at_risk/')).json()
+        self.assertEqual([(entry['patient'], entry['score']) for entry in at_risk], [(self.patient.id, 8), (self.other.id, 3)])
+        ward = (await sync_to_async(self.client.get)('/api/patients/at_risk/', {'clinic': 'General'})).json()
+        self.assertEqual([entry['patient'] for entry in ward], [self.patient.id])
+
+        # Recovery is pushed too, and drops the patient from the list
+        await sync_to_async(self.client.post)('/api/vitals/', {'patient': self.patient.id, 'heart_rate': 80, 'respiratory_rate': 18}, format='json')
+        event = json.loads((await communicator.receive_output(timeout=2))['text'])
+        self.assertEqual((event['data']['risk'], event['data']['previous_risk'], event['data']['escalated']), ('Low', 'High', False))
+        at_risk = (await sync_to_async(self.client.get)('/api/patients/at_risk/')).json()
+        self.assertEqual([entry['patient'] for entry in at_risk], [self.other.id])
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait()
+
+class LatestVitalsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patients = [
+            Patient.objects.create(patient_type='Employee', personal_number=f'NPA87{index:02}', surname='Yusuf', first_name=f'Bed{index}')
+            for index in range(3)
+        ]
+        Visit.objects.create(
+            patient=self.patients[0], visit_date=date.today(), visit_time=time(9, 0), status='In Nursing Pool',
+            visit_location='Headquarters', visit_type='consultation', clinic='General'
+        )
+        now = timezone.now()
+        for patient in self.patients[:2]:
+            for hours in (3, 1, 2):
+                VitalReading.objects.create(patient=patient, date=now - timedelta(hours=hours), heart_rate=60 + hours)
+
+    def test_latest_per_patient_in_one_query(self):
+        ids = ','.join(str(patient.id) for patient in self.patients)
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/vitals/latest/', {'patients': ids}).json()
+        self.assertEqual([(row['patient'], row['heart_rate']) for row in data], [(self.patients[0].id, 61), (self.patients[1].id, 61)])
+
+        ward = self.client.get('/api/vitals/latest/', {'clinic': 'General', 'location': 'Headquarters'}).json()
+        self.assertEqual([row['patient'] for row in ward], [self.patients[0].id])
+        self.assertEqual(self.client.get('/api/vitals/latest/').status_code, 400)
+        self.assertEqual(self.client.get('/api/vitals/latest/', {'patients': 'a,b'}).status_code, 400)
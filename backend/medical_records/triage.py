@@ -0,0 +1,94 @@
+# triage.py - Route visits waiting in a clinic's triage pool to consultation rooms
+#
+# The pool for a clinic is every 'In Nursing Pool' visit without a room, ordered by
+# Visit.triage_due_at (arrival minus the priority's head start). Because that key is
+# fixed when the visit is saved, aging costs nothing at decision time and the next
+# visit is the first row of the visit_triage_pool_idx partial index.
+
+from collections import namedtuple
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from .models import ConsultationRoom, Visit
+from .consultation_queue import enqueue
+
+POOL_STATUS = 'In Nursing Pool'
+QUEUED_STATUS = 'Queued'
+OPEN_ROOM_STATUSES = ('available', 'occupied')
+GENERAL_SPECIALTIES = ('', 'General')
+DEFAULT_CONSULTATION_MINUTES = 15
+
+Assignment = namedtuple('Assignment', ['visit', 'room', 'position', 'estimated_wait'])
+
+def triage_pool(clinic):
+    """Visits in `clinic` waiting for a room, next to be routed first"""
+    return Visit.objects.filter(
+        clinic=clinic, status=POOL_STATUS, consultation_room__isnull=True
+    ).order_by('triage_due_at', 'id')
+
+def open_rooms(clinic):
+    """
+    Open rooms that can see `clinic`'s patients, least loaded first
+
+    Rooms whose specialty_focus names the clinic are preferred; a clinic with no such room
+    falls back to general rooms (no specialty, or 'General'). Load is the room's queue plus the patient
+    currently being seen.
+    """
+    rooms = ConsultationRoom.objects.filter(status__in=OPEN_ROOM_STATUSES).annotate(
+        queued=Count('queue_entries'),
+        load=F('queued') + Case(
+            When(status='occupied', then=Value(1)), default=Value(0), output_field=IntegerField()
+        ),
+    ).order_by('load', 'total_consultations_today', 'name')
+
+    if clinic not in GENERAL_SPECIALTIES:
+        specialists = rooms.filter(specialty_focus__iexact=clinic)
+        if specialists.exists():
+            return specialists
+    general = Q(specialty_focus__isnull=True)
+    for name in GENERAL_SPECIALTIES:
+        general |= Q(specialty_focus__iexact=name)
+    return rooms.filter(general)
+
+def estimated_wait(room, ahead):
+    """Minutes until a patient with `ahead` people in front of them is seen in `room`"""
+    return ahead * (room.average_consultation_time or DEFAULT_CONSULTATION_MINUTES)
+
+def pool_waits(rooms, count):
+    """
+    Estimated minutes until each of the first `count` pool visits is seen, if they are
+    routed in order to `rooms` (from open_rooms). The rooms are treated as one server
+    whose rate is the sum of their rolling consultation rates.
+    """
+    if not rooms:
+        return [None] * count
+    per_minute = sum(1 / (room.average_consultation_time or DEFAULT_CONSULTATION_MINUTES) for room in rooms)
+    load = sum(room.load for room in rooms)
+    return [round((load + index) / per_minute) for index in range(count)]
+
+def assign_next(clinic):
+    """
+    Route the next visit in `clinic`'s pool to the least-loaded open room
+
+    The visit is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent schedulers
+    route different visits. Returns an Assignment, or None when nobody is waiting or no
+    room can take the clinic's patients (the visit then stays in the pool).
+    """
+    with transaction.atomic():
+        room = open_rooms(clinic).first()
+        if room is None:
+            return None
+        visit = (
+            triage_pool(clinic).select_for_update(skip_locked=True, of=('self',))
+            .select_related('patient').first()
+        )
+        if visit is None:
+            return None
+
+        enqueue(room, visit)
+        visit.status = QUEUED_STATUS
+        visit.save(update_fields=['status', 'updated_at'])
+        # The room is locked by enqueue, so its queue length is this visit's rank; everyone
+        # queued before it and the patient in the consultation are ahead of it
+        position = room.queue_entries.count()
+        ahead = position - 1 + (room.load - room.queued)
+        return Assignment(visit, room, position, estimated_wait(room, ahead))
@@ -0,0 +1,98 @@
+# usage_rollup.py - Daily per-medication usage, folded in from the stock ledger as it is written
+
+from itertools import islice
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Abs, Coalesce, TruncDate
+from django.utils import timezone
+from .models import MedicationUsageDaily, StockTransaction
+
+# Rollup column each transaction type adds to, and whether its quantity is counted as a magnitude
+COLUMNS = {
+    'Dispensed': ('dispensed', True),
+    'Restocked': ('restocked', True),
+    'Expired': ('expired', True),
+    'Adjusted': ('adjusted', False),
+    'Returned': ('returned', False),
+}
+FIELDS = ('dispensed', 'dispense_count', 'restocked', 'expired', 'adjusted', 'returned')
+BATCH_SIZE = 1000
+
+def record(transactions):
+    """
+    Add freshly written StockTransactions to their medications' rollup days
+
+    Call inside the transaction that wrote them so the ledger and the rollup commit
+    together. One INSERT ... ON CONFLICT DO UPDATE covers every (medication, day) touched.
+    """
+    days = {}
+    for entry in transactions:
+        if entry.type not in COLUMNS:
+            continue
+        column, magnitude = COLUMNS[entry.type]
+        key = (entry.medication_id, timezone.localdate(entry.created_at))
+        totals = days.setdefault(key, dict.fromkeys(FIELDS, 0))
+        totals[column] += abs(entry.quantity) if magnitude else entry.quantity
+        if entry.type == 'Dispensed':
+            totals['dispense_count'] += 1
+    if not days:
+        return 0
+
+    table = connection.ops.quote_name(MedicationUsageDaily._meta.db_table)
+    columns = ', '.join(FIELDS)
+    increments = ', '.join(f'{field} = rollup.{field} + EXCLUDED.{field}' for field in FIELDS)
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(days))
+    now = timezone.now()
+    params = []
+    # Sorted so concurrent writers take the row locks in the same order
+    for (medication_id, day), totals in sorted(days.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+        params.extend([medication_id, day, *(totals[field] for field in FIELDS), now])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} AS rollup (medication_id, date, {columns}, updated_at) '
+            f'VALUES {placeholders} '
+            f'ON CONFLICT (medication_id, date) DO UPDATE SET {increments}, updated_at = EXCLUDED.updated_at',
+            params,
+        )
+    return len(days)
+
+def _summed(transaction_type, magnitude=True):
+    quantity = Abs('quantity') if magnitude else 'quantity'
+    return Coalesce(Sum(quantity, filter=Q(type=transaction_type)), Value(0))
+
+def rebuild(since=None):
+    """
+    Recompute the rollup from StockTransaction for every day from `since` (all days when
+    None). The table is locked against the ledger's upserts meanwhile, so a transaction
+    committed during the rebuild is counted exactly once. Returns the number of days written.
+    """
+    stale = MedicationUsageDaily.objects.all()
+    transactions = StockTransaction.objects.filter(type__in=COLUMNS)
+    if since is not None:
+        stale = stale.filter(date__gte=since)
+        transactions = transactions.filter(created_at__date__gte=since)
+
+    days = transactions.annotate(day=TruncDate('created_at')).values('medication_id', 'day').annotate(
+        dispensed=_summed('Dispensed'),
+        dispense_count=Count('id', filter=Q(type='Dispensed')),
+        restocked=_summed('Restocked'),
+        expired=_summed('Expired'),
+        adjusted=_summed('Adjusted', magnitude=False),
+        returned=_summed('Returned', magnitude=False),
+    ).order_by()
+
+    written = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {connection.ops.quote_name(MedicationUsageDaily._meta.db_table)} IN EXCLUSIVE MODE'
+            )
+        stale.delete()
+        rows = (
+            MedicationUsageDaily(medication_id=row['medication_id'], date=row['day'], **{field: row[field] for field in FIELDS})
+            for row in days.iterator(chunk_size=BATCH_SIZE)
+        )
+        while batch := list(islice(rows, BATCH_SIZE)):
+            MedicationUsageDaily.objects.bulk_create(batch)
+            written += len(batch)
+    return written
@@ -1,16 +1,16 @@
 # utils.py - Utility functions for prescription and pharmacy management
 
 from django.utils import timezone
-from django.db import transaction
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
-from django.db.models import Sum, Count, F
-from .models import Medication, MedicationBatch, StockTransaction, Prescription, PrescriptionItem
+from django.db.models import Sum, F, Exists, OuterRef, Subquery
+from .models import Medication, MedicationUsageDaily
+from . import stock_ledger, interactions
 
 logger = logging.getLogger(__name__)
 
 class FIFODispensing:
-    """First In, First Out dispensing logic for medications"""
+    """First In, First Out dispensing logic for medications (delegates to stock_ledger)"""
     
     def dispense_medication(self, medication, quantity, performed_by, prescription_item=None):
         """
@@ -26,128 +26,32 @@ class FIFODispensing:
             tuple: (success: bool, batches_used: list)
         """
         try:
-            with transaction.atomic():
-                # Get available batches sorted by expiry date (FIFO)
-                available_batches = medication.batches.filter(
-                    remaining_tablets__gt=0,
-                    expiry_date__gt=timezone.now().date(),
-                    status='Active'
-                ).order_by('expiry_date')
-                
-                # Check if we have enough stock
-                total_available = sum(batch.remaining_tablets for batch in available_batches)
-                if total_available < quantity:
-                    logger.warning(f"Insufficient stock for {medication.name}. Need {quantity}, have {total_available}")
-                    return False, []
-                
-                # Dispense from batches using FIFO
-                remaining_to_dispense = quantity
-                batches_used = []
-                
-                for batch in available_batches:
-                    if remaining_to_dispense <= 0:
-                        break
-                    
-                    # Calculate how much to take from this batch
-                    quantity_from_batch = min(batch.remaining_tablets, remaining_to_dispense)
-                    
-                    # Update batch
-                    batch.remaining_tablets -= quantity_from_batch
-                    
-                    # Update pack counts
-                    tablets_used_total = batch.total_tablets - batch.remaining_tablets
-                    new_opened_packs = max(0, (tablets_used_total + batch.pack_size - 1) // batch.pack_size - 
-                                         (batch.total_tablets - batch.remaining_tablets - quantity_from_batch + batch.pack_size - 1) // batch.pack_size)
-                    batch.opened_packs += new_opened_packs
-                    batch.sealed_packs = max(0, batch.sealed_packs - new_opened_packs)
-                    
-                    # Update batch status
-                    batch.status = update_batch_status(batch)
-                    batch.save()
-                    
-                    # Track batch usage
-                    batches_used.append({
-                        'batch_id': str(batch.id),
-                        'batch_number': batch.batch_number,
-                        'quantity': quantity_from_batch,
-                        'expiry_date': batch.expiry_date.isoformat()
-                    })
-                    
-                    remaining_to_dispense -= quantity_from_batch
-                
-                # Update medication stock
-                previous_stock = medication.current_stock
-                medication.current_stock -= quantity
-                medication.last_dispensed = timezone.now().date()
-                medication.save()
-                
-                # Update medication status
-                update_medication_status(medication)
-                
-                # Create stock transaction
-                StockTransaction.objects.create(
-                    medication=medication,
-                    type='Dispensed',
-                    quantity=-quantity,
-                    previous_stock=previous_stock,
-                    new_stock=medication.current_stock,
-                    performed_by=performed_by,
-                    prescription=prescription_item,
-                    reason=f'Dispensed to patient via prescription {prescription_item.prescription.id if prescription_item else "N/A"}'
-                )
-                
-                logger.info(f"Successfully dispensed {quantity} tablets of {medication.name}")
-                return True, batches_used
-                
+            allocations = stock_ledger.dispense(
+                [(medication.pk, quantity)],
+                performed_by=performed_by,
+                prescription=prescription_item.prescription if prescription_item else None
+            )
+        except stock_ledger.InsufficientStockError as e:
+            logger.warning(str(e))
+            return False, []
         except Exception as e:
             logger.error(f"Error dispensing medication {medication.name}: {str(e)}")
             return False, []
 
+        medication.refresh_from_db(fields=['current_stock'])
+        update_medication_status(medication)
+        logger.info(f"Successfully dispensed {quantity} tablets of {medication.name}")
+        return True, allocations[0]
+
 def update_medication_status(medication):
     """Update medication status based on current conditions"""
-    # Check for expired batches with remaining stock
-    expired_batches = medication.batches.filter(
-        remaining_tablets__gt=0,
-        expiry_date__lt=timezone.now().date()
-    )
-    
-    if expired_batches.exists():
-        medication.status = 'Expired'
-        medication.save()
-        return medication.status
-    
-    # Check for near expiry (within 30 days)
-    near_expiry_batches = medication.batches.filter(
-        remaining_tablets__gt=0,
-        expiry_date__lte=timezone.now().date() + timedelta(days=30),
-        expiry_date__gt=timezone.now().date()
-    )
-    
-    if medication.current_stock == 0:
-        medication.status = 'Out of Stock'
-    elif near_expiry_batches.exists():
-        medication.status = 'Near Expiry'
-    elif medication.current_stock <= medication.minimum_stock:
-        medication.status = 'Low Stock'
-    else:
-        medication.status = 'In Stock'
-    
-    medication.save()
+    stock_ledger.refresh_medication_status([medication.pk])
+    medication.refresh_from_db(fields=['status'])
     return medication.status
 
 def update_batch_status(batch):
     """Update batch status based on expiry date and remaining tablets"""
-    today = timezone.now().date()
-    days_until_expiry = (batch.expiry_date - today).days
-    
-    if days_until_expiry < 0:
-        return 'Expired'
-    elif days_until_expiry <= 30:
-        return 'Near Expiry'
-    elif batch.remaining_tablets == 0:
-        return 'Depleted'
-    else:
-        return 'Active'
+    return stock_ledger.batch_status(batch)
 
 def calculate_estimated_completion_time(prescription):
     """Calculate estimated completion time for a prescription"""
@@ -175,70 +79,8 @@ def calculate_estimated_completion_time(prescription):
     return timezone.now() + timedelta(minutes=total_minutes)
 
 def get_drug_interactions(medications):
-    """Check for potential drug interactions"""
-    interactions = []
-    
-    # Common drug interaction patterns
-    interaction_patterns = [
-        {
-            'drug1_patterns': ['warfarin'],
-            'drug2_patterns': ['aspirin', 'ibuprofen'],
-            'severity': 'Major',
-            'description': 'Increased risk of bleeding',
-            'recommendation': 'Monitor INR closely and consider alternative pain management'
-        },
-        {
-            'drug1_patterns': ['metformin'],
-            'drug2_patterns': ['contrast'],
-            'severity': 'Major',
-            'description': 'Risk of lactic acidosis',
-            'recommendation': 'Discontinue metformin 48 hours before contrast administration'
-        },
-        {
-            'drug1_patterns': ['ace inhibitor', 'lisinopril', 'losartan'],
-            'drug2_patterns': ['ibuprofen', 'nsaid'],
-            'severity': 'Moderate',
-            'description': 'NSAIDs may reduce effectiveness of ACE inhibitors/ARBs',
-            'recommendation': 'Monitor blood pressure and consider alternative pain relief'
-        },
-        {
-            'drug1_patterns': ['digoxin'],
-            'drug2_patterns': ['amiodarone'],
-            'severity': 'Major',
-            'description': 'Increased digoxin levels leading to toxicity',
-            'recommendation': 'Reduce digoxin dose and monitor levels closely'
-        },
-        {
-            'drug1_patterns': ['lithium'],
-            'drug2_patterns': ['furosemide', 'thiazide'],
-            'severity': 'Major',
-            'description': 'Increased risk of lithium toxicity',
-            'recommendation': 'Monitor lithium levels and adjust dose as needed'
-        }
-    ]
-    
-    # Check each pair of medications
-    for i, med1 in enumerate(medications):
-        for med2 in medications[i+1:]:
-            med1_name = med1.name.lower()
-            med2_name = med2.name.lower()
-            
-            for pattern in interaction_patterns:
-                # Check if med1 matches drug1 pattern and med2 matches drug2 pattern
-                if (any(p in med1_name for p in pattern['drug1_patterns']) and
-                    any(p in med2_name for p in pattern['drug2_patterns'])) or \
-                   (any(p in med2_name for p in pattern['drug1_patterns']) and
-                    any(p in med1_name for p in pattern['drug2_patterns'])):
-                    
-                    interactions.append({
-                        'drug1': med1.name,
-                        'drug2': med2.name,
-                        'severity': pattern['severity'],
-                        'description': pattern['description'],
-                        'recommendation': pattern['recommendation']
-                    })
-    
-    return interactions
+    """Check for potential drug interactions (delegates to the compiled rule index)"""
+    return interactions.find_interactions(medications)
 
 def generate_prescription_summary(prescription):
     """Generate a summary of the prescription for reporting"""
@@ -332,21 +174,14 @@ def check_medication_alerts(medication):
     
     return alerts
 
-def optimize_inventory_levels(medication):
+def optimize_inventory_levels(medication, days=90):
     """Suggest optimal inventory levels based on usage patterns"""
-    # Calculate average monthly usage
-    if medication.monthly_usage > 0:
-        avg_monthly = medication.monthly_usage
-    else:
-        # Fallback calculation based on recent transactions
-        recent_dispensing = StockTransaction.objects.filter(
-            medication=medication,
-            type='Dispensed',
-            created_at__gte=timezone.now() - timedelta(days=90)
-        ).aggregate(total=Sum('quantity'))['total'] or 0
-        
-        # Estimate monthly usage from 3-month data
-        avg_monthly = abs(recent_dispensing) // 3 if recent_dispensing else 10
+    # Average monthly usage over the last `days` days of the usage rollup
+    recent_dispensing = MedicationUsageDaily.objects.filter(
+        medication=medication,
+        date__gte=InventoryAnalytics.window_start(days)
+    ).aggregate(total=Sum('dispensed'))['total'] or 0
+    avg_monthly = recent_dispensing * 30 // days if recent_dispensing else 10
     
     # Suggest minimum stock (2 months supply)
     suggested_minimum = avg_monthly * 2
@@ -371,54 +206,47 @@ def optimize_inventory_levels(medication):
     return recommendations
 
 class InventoryAnalytics:
-    """Class for inventory analytics and reporting"""
+    """Class for inventory analytics and reporting (read from the daily usage rollup)"""
+    
+    @staticmethod
+    def window_start(days):
+        """First day of a window of `days` days ending today"""
+        return timezone.localdate() - timedelta(days=days - 1)
     
     @staticmethod
     def get_usage_trends(medication, days=90):
         """Get usage trends for a medication"""
-        end_date = timezone.now().date()
-        start_date = end_date - timedelta(days=days)
-        
-        transactions = StockTransaction.objects.filter(
+        return list(MedicationUsageDaily.objects.filter(
             medication=medication,
-            type='Dispensed',
-            created_at__date__range=[start_date, end_date]
-        ).values('created_at__date').annotate(
-            daily_usage=Sum('quantity')
-        ).order_by('created_at__date')
-        
-        return list(transactions)
+            date__gte=InventoryAnalytics.window_start(days)
+        ).values('date', 'dispensed', 'dispense_count', 'restocked', 'expired').order_by('date'))
     
     @staticmethod
     def get_slow_moving_items(days=180):
         """Identify slow-moving inventory items"""
-        cutoff_date = timezone.now() - timedelta(days=days)
+        # Medications in stock with no dispensing activity in the specified period
+        recent_activity = MedicationUsageDaily.objects.filter(
+            medication=OuterRef('pk'),
+            date__gte=InventoryAnalytics.window_start(days),
+            dispensed__gt=0
+        )
+        last_dispensed = MedicationUsageDaily.objects.filter(
+            medication=OuterRef('pk'),
+            dispensed__gt=0
+        ).order_by('-date').values('date')[:1]
         
-        # Medications with no dispensing activity in the specified period
-        recent_activity = StockTransaction.objects.filter(
-            type='Dispensed',
-            created_at__gte=cutoff_date
-        ).values_list('medication_id', flat=True)
-        
-        slow_moving = Medication.objects.exclude(
-            id__in=recent_activity
-        ).filter(current_stock__gt=0)
-        
-        return slow_moving
+        return Medication.objects.filter(current_stock__gt=0).filter(
+            ~Exists(recent_activity)
+        ).annotate(last_dispensed=Subquery(last_dispensed))
     
     @staticmethod
-    def get_fast_moving_items(days=30):
+    def get_fast_moving_items(days=30, threshold=100):
         """Identify fast-moving inventory items"""
-        cutoff_date = timezone.now() - timedelta(days=days)
-        
-        fast_moving = StockTransaction.objects.filter(
-            type='Dispensed',
-            created_at__gte=cutoff_date
-        ).values('medication').annotate(
-            total_dispensed=Sum('quantity'),
-            transaction_count=Count('id')
+        return MedicationUsageDaily.objects.filter(
+            date__gte=InventoryAnalytics.window_start(days)
+        ).values('medication', medication_name=F('medication__name')).annotate(
+            total_dispensed=Sum('dispensed'),
+            transaction_count=Sum('dispense_count')
         ).filter(
-            total_dispensed__gt=100  # Adjust threshold as needed
+            total_dispensed__gt=threshold
         ).order_by('-total_dispensed')
-        
-        return fast_moving
\ No newline at end of file
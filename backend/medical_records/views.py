@@ -1,18 +1,23 @@
 # viewsets.py
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from django.db.models import Q, F, Count, Sum
+from rest_framework.parsers import JSONParser, MultiPartParser
+from django.db.models import Q, F, Count, Sum, Exists, OuterRef, Value, Prefetch
+from django.db.models.functions import Greatest, Concat
+from django.contrib.postgres.search import TrigramSimilarity
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import logging
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
 from .models import (
     Patient, VitalReading, MedicalReport, TimelineEvent, Visit,
     ConsultationRoom, ConsultationSession, Medication, MedicationBatch,
-    Prescription, PrescriptionItem, PharmacyQueue, StockTransaction
+    Prescription, PrescriptionItem, PharmacyQueue, StockTransaction, User
 )
 from .serializers import (
     PatientSerializer, PatientDetailSerializer, VitalReadingSerializer,
@@ -21,9 +26,39 @@ from .serializers import (
     MedicationSerializer, MedicationBatchSerializer, PrescriptionSerializer,
     PrescriptionItemSerializer, PharmacyQueueSerializer, StockTransactionSerializer
 )
+from .pagination import PatientSearchPagination, KeysetPagination
+from .parsers import NDJSONParser
+from .events import (
+    publish_pharmacy_queue_created, publish_pharmacy_queue_change, publish_pharmacy_queue_removed,
+    publish_visit_event, publish_room_queue, visit_groups
+)
+from .consultation_queue import QueueError, room_queue, enqueue, dequeue, reorder, move, next_patient
+from .triage import triage_pool, open_rooms, pool_waits, assign_next
+from .interactions import find_interactions, interaction_index
+from .active_medications import screen, record_dispensed, release_prescription
+from .consultation_stats import record_session, window_stats
+from .patient_import import PatientImporter, ROW_READERS
+from .stock_ledger import dispense, receive_batch, dispensable_batches, InsufficientStockError
+from .usage_rollup import record as record_usage
+from .early_warning import record as record_early_warning, refresh as refresh_early_warning, at_risk
+from .vitals import (
+    METRICS as VITAL_METRICS, DEFAULT_METRICS, MAX_POINTS, MAX_INGEST_ROWS, MAX_LATEST_PATIENTS,
+    series as vital_series, ingest, ward_patients, latest_readings
+)
+from .utils import InventoryAnalytics, optimize_inventory_levels
 
 logger = logging.getLogger(__name__)
 
+TYPEAHEAD_LIMIT = 10
+MAX_TYPEAHEAD_LIMIT = 25
+
+def typeahead_limit(request):
+    """?limit= for the typeahead endpoints, clamped to 1..MAX_TYPEAHEAD_LIMIT"""
+    try:
+        return min(max(int(request.query_params.get('limit', TYPEAHEAD_LIMIT)), 1), MAX_TYPEAHEAD_LIMIT)
+    except ValueError:
+        return TYPEAHEAD_LIMIT
+
 class ConsultationRoomViewSet(viewsets.ModelViewSet):
     queryset = ConsultationRoom.objects.all()
     serializer_class = ConsultationRoomSerializer
@@ -35,6 +70,142 @@ class ConsultationRoomViewSet(viewsets.ModelViewSet):
             raise ValidationError({"assigned_doctor": "Assigned doctor is required for occupied rooms."})
         serializer.save()
 
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(*ConsultationRoomSerializer.prefetch_plan())
+
+    def _requested_visit(self, request):
+        try:
+            return Visit.objects.select_related('patient').get(pk=request.data.get('visit'))
+        except (Visit.DoesNotExist, ValueError, TypeError):
+            return None
+
+    def _queue_response(self, room, response_status=status.HTTP_200_OK, **extra):
+        queue = ConsultationRoomSerializer.queue_data(room_queue(room))
+        publish_room_queue(room, queue)
+        return Response({**extra, 'queue': queue}, status=response_status)
+
+    @action(detail=True, methods=['post'])
+    def enqueue(self, request, pk=None):
+        room = self.get_object()
+        visit = self._requested_visit(request)
+        if visit is None:
+            return Response({"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        previous_groups = visit_groups(visit)
+        try:
+            enqueue(room, visit, priority=request.data.get('priority'))
+        except QueueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            return Response({"detail": "Visit was queued concurrently; refresh and try again."}, status=status.HTTP_409_CONFLICT)
+
+        publish_visit_event('updated', visit, previous_groups)
+        logger.info(f"Queued visit {visit.id} for room {room.name}")
+        return self._queue_response(room, status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def dequeue(self, request, pk=None):
+        room = self.get_object()
+        visit = self._requested_visit(request)
+        if visit is None:
+            return Response({"detail": "Visit not found."}, status=status.HTTP_404_NOT_FOUND)
+        previous_groups = visit_groups(visit)
+        try:
+            dequeue(room, visit)
+        except QueueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        publish_visit_event('updated', visit, previous_groups)
+        return self._queue_response(room)
+
+    @action(detail=True, methods=['post'])
+    def reorder(self, request, pk=None):
+        """Body is either {"order": [visit ids, head first]} or {"visit": id, "position": n}"""
+        room = self.get_object()
+        try:
+            if 'order' in request.data:
+                reorder(room, [int(visit_id) for visit_id in request.data['order']])
+            else:
+                move(room, int(request.data['visit']), int(request.data['position']))
+        except (KeyError, ValueError, TypeError):
+            return Response(
+                {"detail": "Provide 'order' as a list of visit ids, or 'visit' and 'position'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except QueueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return self._queue_response(room)
+
+    @action(detail=True, methods=['post'])
+    def next_patient(self, request, pk=None):
+        room = self.get_object()
+        visit = next_patient(room)
+        if visit is None:
+            return Response({"detail": "No patients waiting."}, status=status.HTTP_404_NOT_FOUND)
+        publish_visit_event('status', visit)
+        logger.info(f"Room {room.name} started consultation for visit {visit.id}")
+        return self._queue_response(room, visit=VisitSerializer(visit).data)
+
+    def _requested_clinic(self, request):
+        clinic = request.data.get('clinic') if request.method == 'POST' else request.query_params.get('clinic')
+        return clinic if clinic in dict(Visit.CLINICS) else None
+
+    def _invalid_clinic(self):
+        return Response(
+            {"detail": f"Provide 'clinic' as one of: {', '.join(dict(Visit.CLINICS))}."},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(detail=False, methods=['get'])
+    def triage(self, request):
+        """A clinic's triage pool in routing order, with estimated waits, and the room it routes to next"""
+        clinic = self._requested_clinic(request)
+        if clinic is None:
+            return self._invalid_clinic()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 100)
+        except ValueError:
+            limit = 50
+
+        waiting = list(triage_pool(clinic).select_related('patient', 'consultation_room')[:limit])
+        rooms = list(open_rooms(clinic))
+        pool = VisitSerializer(waiting, many=True).data
+        for rank, (entry, wait) in enumerate(zip(pool, pool_waits(rooms, len(pool))), start=1):
+            entry['triage_rank'] = rank
+            entry['estimated_wait'] = wait
+        next_room = rooms[0] if rooms else None
+        return Response({
+            'clinic': clinic,
+            'waiting': pool,
+            'next_room': {'id': str(next_room.id), 'name': next_room.name, 'load': next_room.load} if next_room else None,
+        })
+
+    @action(detail=False, methods=['post'])
+    def assign_next(self, request):
+        """Route the next visit in a clinic's triage pool to its least-loaded open room"""
+        clinic = self._requested_clinic(request)
+        if clinic is None:
+            return self._invalid_clinic()
+        try:
+            assignment = assign_next(clinic)
+        except IntegrityError:
+            return Response({"detail": "Visit was queued concurrently; refresh and try again."}, status=status.HTTP_409_CONFLICT)
+        if assignment is None:
+            return Response(
+                {"detail": f"No {clinic} visit is waiting, or no open room can take one."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        visit, room = assignment.visit, assignment.room
+        publish_visit_event('status', visit)
+        logger.info(f"Triage routed visit {visit.id} to room {room.name} at position {assignment.position}")
+        return self._queue_response(
+            room, status.HTTP_201_CREATED,
+            visit=VisitSerializer(visit).data,
+            consultation_room=str(room.id),
+            position=assignment.position,
+            estimated_wait=assignment.estimated_wait,
+        )
+
 class ConsultationSessionViewSet(viewsets.ModelViewSet):
     queryset = ConsultationSession.objects.all()
     serializer_class = ConsultationSessionSerializer
@@ -44,12 +215,49 @@ class ConsultationSessionViewSet(viewsets.ModelViewSet):
         data = serializer.validated_data
         if data.get('start_time') > timezone.now():
             raise ValidationError({"start_time": "Start time cannot be in the future."})
-        serializer.save()
+        session = serializer.save()
+        if session.end_time:
+            record_session(session)
+
+    def perform_update(self, serializer):
+        already_ended = serializer.instance.end_time is not None
+        data = serializer.validated_data
+        if data.get('status') == 'completed' and not data.get('end_time') and not already_ended:
+            session = serializer.save(end_time=timezone.now())
+        else:
+            session = serializer.save()
+        # Durations are counted once, when the session first gets an end time
+        if session.end_time and not already_ended:
+            record_session(session)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Consultation-time statistics for ?room= or ?doctor= over the last ?days= days (default 7)"""
+        try:
+            days = min(max(int(request.query_params.get('days', 7)), 1), 366)
+        except ValueError:
+            return Response({"detail": "'days' must be a whole number."}, status=status.HTTP_400_BAD_REQUEST)
+
+        room_id = request.query_params.get('room')
+        doctor_id = request.query_params.get('doctor')
+        if not room_id and not doctor_id:
+            return Response({"detail": "Provide 'room' or 'doctor'."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if room_id:
+                room = ConsultationRoom.objects.get(pk=room_id)
+                data = {'room': str(room.id), 'room_name': room.name, **window_stats(days, room=room)}
+            else:
+                doctor = User.objects.get(pk=doctor_id)
+                data = {'doctor': str(doctor.id), 'doctor_name': doctor.name, **window_stats(days, doctor=doctor)}
+        except (ConsultationRoom.DoesNotExist, User.DoesNotExist, ValidationError):
+            return Response({"detail": "Room or doctor not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
 
 class VitalReadingViewSet(viewsets.ModelViewSet):
     queryset = VitalReading.objects.all()
     serializer_class = VitalReadingSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
     def create(self, request, *args, **kwargs):
         try:
@@ -62,20 +270,85 @@ class VitalReadingViewSet(viewsets.ModelViewSet):
             logger.error(f"Vital creation failed: {str(e)}")
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            record_early_warning([serializer.save()])
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            record_early_warning([serializer.save()])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            refresh_early_warning(instance.patient_id)
+
+    @action(detail=False, methods=['get'])
+    def latest(self, request):
+        """
+        The latest reading of each patient in ?patients=1,2,3, or of each patient with an
+        open visit in ?clinic= and/or at ?location=
+        """
+        params = request.query_params
+        if params.get('patients'):
+            try:
+                patients = {int(patient_id) for patient_id in params['patients'].split(',') if patient_id.strip()}
+            except ValueError:
+                return Response({"detail": "'patients' must be a comma-separated list of ids."}, status=status.HTTP_400_BAD_REQUEST)
+            if len(patients) > MAX_LATEST_PATIENTS:
+                return Response(
+                    {"detail": f"At most {MAX_LATEST_PATIENTS} patients per request."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        elif params.get('clinic') or params.get('location'):
+            patients = ward_patients(params.get('clinic'), params.get('location'))
+        else:
+            return Response(
+                {"detail": "Provide 'patients', or 'clinic' and/or 'location'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(self.get_serializer(latest_readings(patients), many=True).data)
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Ingest many readings, for any patients, in one request: a JSON array, {"readings": [...]}
+        or NDJSON (Content-Type: application/x-ndjson). Valid rows are stored even when others fail.
+        """
+        rows = request.data.get('readings') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            return Response(
+                {"detail": "Send a JSON array of readings, an object with a 'readings' array, or NDJSON."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(rows) > MAX_INGEST_ROWS:
+            return Response(
+                {"detail": f"At most {MAX_INGEST_ROWS} readings per request."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = ingest(rows)
+        created = sum(1 for result in results if 'id' in result)
+        logger.info(f"Ingested {created} of {len(results)} vital readings")
+        return Response({'created': created, 'failed': len(results) - created, 'results': results})
+
 class MedicalReportViewSet(viewsets.ModelViewSet):
     queryset = MedicalReport.objects.all()
     serializer_class = MedicalReportSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
 class TimelineEventViewSet(viewsets.ModelViewSet):
     queryset = TimelineEvent.objects.all()
     serializer_class = TimelineEventSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
 class VisitViewSet(viewsets.ModelViewSet):
-    queryset = Visit.objects.all()
+    queryset = Visit.objects.select_related('patient', 'consultation_room')
     serializer_class = VisitSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
 
     def create(self, request, *args, **kwargs):
         try:
@@ -88,6 +361,23 @@ class VisitViewSet(viewsets.ModelViewSet):
             logger.error(f"Visit creation failed: {str(e)}")
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    def perform_create(self, serializer):
+        visit = serializer.save()
+        publish_visit_event('created', visit)
+
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        previous_groups = visit_groups(serializer.instance)
+        visit = serializer.save()
+        publish_visit_event('status' if visit.status != previous_status else 'updated', visit, previous_groups)
+
+    def perform_destroy(self, instance):
+        visit_id = instance.id
+        instance.delete()
+        # delete() clears the primary key; publish the row as it was
+        instance.id = visit_id
+        publish_visit_event('deleted', instance)
+
 class PatientViewSet(viewsets.ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
@@ -107,6 +397,9 @@ class PatientViewSet(viewsets.ModelViewSet):
         
         if sponsor_id:
             queryset = queryset.filter(sponsor_id=sponsor_id)
+
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related(*PatientDetailSerializer.prefetch_plan())
             
         return queryset
 
@@ -159,67 +452,176 @@ class PatientViewSet(viewsets.ModelViewSet):
             logger.error(f"Patient creation failed: {str(e)}", exc_info=True)
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({"detail": "A CSV or NDJSON file is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('format') or ('ndjson' if upload.name.endswith(('.ndjson', '.jsonl')) else 'csv')
+        if file_format not in ROW_READERS:
+            return Response(
+                {"detail": f"Unsupported format. Must be one of: {', '.join(ROW_READERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        report = PatientImporter().run(ROW_READERS[file_format](upload))
+        logger.info(f"Patient import: {report['created']} created, {report['updated']} updated, {len(report['errors'])} errors")
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def vitals(self, request, pk=None):
         try:
             patient = self.get_object()
-            vitals = VitalReading.objects.filter(patient=patient)
+            vitals = self.paginate_queryset(patient.vitals.all())
             serializer = VitalReadingSerializer(vitals, many=True)
-            return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
         except Patient.DoesNotExist:
             logger.error(f"Patient {pk} not found for vitals")
             return Response({"detail": "Patient not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=False, methods=['get'])
+    def at_risk(self, request):
+        """
+        Patients whose current early-warning risk is above Low, highest score first;
+        ?clinic= and/or ?location= limit it to patients with an open visit there
+        """
+        try:
+            min_score = int(request.query_params['min_score']) if request.query_params.get('min_score') else None
+        except ValueError:
+            return Response({"detail": "'min_score' must be a whole number."}, status=status.HTTP_400_BAD_REQUEST)
+        clinic = request.query_params.get('clinic')
+        location = request.query_params.get('location')
+        patients = ward_patients(clinic, location) if clinic or location else None
+
+        return Response([{
+            'patient': warning.patient_id,
+            'patient_id': warning.patient.patient_id,
+            'name': f"{warning.patient.surname} {warning.patient.first_name}",
+            'score': warning.score,
+            'risk': warning.risk,
+            'scored_at': warning.scored_at,
+            'reading': warning.reading_id,
+        } for warning in at_risk(patients, min_score)])
+
+    @action(detail=True, methods=['get'], url_path='vitals/series')
+    def vitals_series(self, request, pk=None):
+        """
+        Downsampled vitals for charting: ?metrics=systolic,heart_rate&start=&end=&points=
+        (defaults: the usual observations over the last 7 days in 200 buckets)
+        """
+        patient = self.get_object()
+        params = request.query_params
+        metrics = [metric.strip() for metric in params.get('metrics', ','.join(DEFAULT_METRICS)).split(',') if metric.strip()]
+        unknown = [metric for metric in metrics if metric not in VITAL_METRICS]
+        if not metrics or unknown:
+            return Response(
+                {"detail": f"'metrics' must be a comma-separated list of: {', '.join(VITAL_METRICS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            end = parse_datetime(params['end']) if params.get('end') else timezone.now()
+            # An unparseable end has no default start to derive from it
+            start = parse_datetime(params['start']) if params.get('start') else (end and end - timedelta(days=7))
+            points = min(max(int(params.get('points', 200)), 1), MAX_POINTS)
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return Response(
+                {"detail": "'start' and 'end' must be ISO datetimes and 'points' a whole number."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end = (value if timezone.is_aware(value) else timezone.make_aware(value) for value in (start, end))
+        if start >= end:
+            return Response({"detail": "'start' must be before 'end'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'patient': patient.id,
+            'metrics': metrics,
+            'start': start,
+            'end': end,
+            'points': points,
+            **vital_series(patient.id, metrics, start, end, points),
+        })
+
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def reports(self, request, pk=None):
         try:
             patient = self.get_object()
-            reports = MedicalReport.objects.filter(patient=patient)
+            reports = self.paginate_queryset(patient.reports.all())
             serializer = MedicalReportSerializer(reports, many=True)
-            return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
         except Patient.DoesNotExist:
             logger.error(f"Patient {pk} not found for reports")
             return Response({"detail": "Patient not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def visits(self, request, pk=None):
         try:
             patient = self.get_object()
-            visits = Visit.objects.filter(patient=patient)
+            visits = self.paginate_queryset(patient.visits.select_related('consultation_room'))
             serializer = VisitSerializer(visits, many=True)
-            return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
         except Patient.DoesNotExist:
             logger.error(f"Patient {pk} not found for visits")
             return Response({"detail": "Patient not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
     def timeline(self, request, pk=None):
         try:
             patient = self.get_object()
-            events = TimelineEvent.objects.filter(patient=patient)
+            events = self.paginate_queryset(patient.timeline_events.all())
             serializer = TimelineEventSerializer(events, many=True)
-            return Response(serializer.data)
+            return self.get_paginated_response(serializer.data)
         except Patient.DoesNotExist:
             logger.error(f"Patient {pk} not found for timeline")
             return Response({"detail": "Patient not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    @action(detail=False, methods=['get'])
+    def _ranked_search(self, query):
+        """Patients matching `query` on personal number or name, best trigram similarity first"""
+        return Patient.objects.filter(
+            Q(personal_number__icontains=query) |
+            Q(surname__icontains=query) |
+            Q(first_name__icontains=query)
+        ).annotate(
+            rank=Greatest(
+                TrigramSimilarity('personal_number', query),
+                TrigramSimilarity('surname', query),
+                TrigramSimilarity('first_name', query)
+            )
+        ).order_by('-rank', 'surname', 'pk')
+
+    @action(detail=False, methods=['get'], pagination_class=PatientSearchPagination)
     def search(self, request):
-        query = self.request.query_params.get('q', '')
+        query = self.request.query_params.get('q', '').strip()
         try:
             if query:
-                patients = Patient.objects.filter(
-                    Q(personal_number__icontains=query) |
-                    Q(surname__icontains=query) |
-                    Q(first_name__icontains=query)
-                ).filter(patient_type__in=['Employee', 'Retiree'])
+                patients = self._ranked_search(query).filter(patient_type__in=['Employee', 'Retiree'])
             else:
                 patients = Patient.objects.none()
-            serializer = self.get_serializer(patients, many=True)
-            return Response(serializer.data)
+            page = self.paginate_queryset(patients)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         except Exception as e:
             logger.error(f"Search failed: {str(e)}", exc_info=True)
             return Response({"detail": "Search failed."}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def typeahead(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+
+        patients = self._ranked_search(query)
+        patient_type = request.query_params.get('patient_type')
+        if patient_type:
+            patients = patients.filter(patient_type__in=[pt.strip() for pt in patient_type.split(',')])
+
+        results = patients.annotate(
+            name=Concat('surname', Value(' '), 'first_name')
+        ).values('id', 'patient_id', 'name', 'patient_type')[:typeahead_limit(request)]
+        return Response(list(results))
         
 # viewsets.py
 class MedicationViewSet(viewsets.ModelViewSet):
@@ -252,28 +654,86 @@ class MedicationViewSet(viewsets.ModelViewSet):
         queryset = super().get_queryset()
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) |
-                Q(generic_name__icontains=search) |
-                Q(category__icontains=search)
-            )
+            queryset = queryset.filter(self._search_filter(search))
         return queryset
 
-    @action(detail=False, methods=['post'])
+    @staticmethod
+    def _search_filter(search):
+        # Category is a fixed choice list, so resolve it in Python and keep every branch of the OR indexable
+        categories = [category for category, _ in Medication.CATEGORIES if search.lower() in category.lower()]
+        return (
+            Q(name__icontains=search) |
+            Q(generic_name__icontains=search) |
+            Q(category__in=categories)
+        )
+
+    @action(detail=False, methods=['get'])
+    def barcode(self, request):
+        code = request.query_params.get('code', '').strip()
+        if not code:
+            return Response({'error': 'A barcode is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        medication = Medication.objects.filter(barcode=code).prefetch_related(
+            Prefetch('batches', queryset=dispensable_batches(), to_attr='active_batches')
+        ).first()
+        if medication is None:
+            return Response({'error': f'No medication with barcode {code}'}, status=status.HTTP_404_NOT_FOUND)
+
+        data = MedicationSerializer(medication).data
+        data['active_batches'] = MedicationBatchSerializer(medication.active_batches, many=True).data
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def typeahead(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+
+        results = Medication.objects.filter(self._search_filter(query)).annotate(
+            rank=Greatest(
+                TrigramSimilarity('name', query),
+                TrigramSimilarity('generic_name', query)
+            )
+        ).order_by(F('rank').desc(nulls_last=True), 'name').values(
+            'id', 'name', 'generic_name', 'strength', 'dosage_form', 'current_stock', 'status'
+        )[:typeahead_limit(request)]
+        return Response(list(results))
+
+    @action(detail=False, methods=['post'], url_path='check-interactions')
     def check_interactions(self, request):
+        """
+        Screen medications against the interaction rules.
+
+        Body is {"medication_ids": [...]} for one list, {"prescription": id} for a saved
+        prescription's items, or {"prescriptions": [ids]} to check several at once.
+        """
+        if 'prescriptions' in request.data or 'prescription' in request.data:
+            ids = request.data.get('prescriptions') or [request.data.get('prescription')]
+            if not isinstance(ids, list):
+                return Response({"detail": "'prescriptions' must be a list of ids."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                ids = [str(uuid.UUID(str(prescription_id))) for prescription_id in ids]
+            except ValueError:
+                return Response({"detail": "Prescription not found."}, status=status.HTTP_404_NOT_FOUND)
+
+            by_prescription = {prescription_id: [] for prescription_id in ids}
+            items = PrescriptionItem.objects.filter(prescription_id__in=ids).select_related('medication', 'substituted_with')
+            for item in items:
+                by_prescription[str(item.prescription_id)].append(item.substituted_with or item.medication)
+            index = interaction_index()
+            results = {prescription_id: index.interactions(medications) for prescription_id, medications in by_prescription.items()}
+            if 'prescription' in request.data and 'prescriptions' not in request.data:
+                return Response({'interactions': results[ids[0]]})
+            return Response({'results': results})
+
         medication_ids = request.data.get('medication_ids', [])
-        interactions = []
-        
-        if len(medication_ids) >= 2:
-            interactions.append({
-                'drug1': 'Medication A',
-                'drug2': 'Medication B',
-                'severity': 'Moderate',
-                'description': 'Both medications affect the liver',
-                'recommendation': 'Monitor liver function closely'
-            })
-        
-        return Response({'interactions': interactions})
+        try:
+            medications = Medication.objects.in_bulk([uuid.UUID(str(medication_id)) for medication_id in medication_ids])
+        except (ValueError, TypeError):
+            return Response({"detail": "'medication_ids' must be a list of medication ids."}, status=status.HTTP_400_BAD_REQUEST)
+        # Keep the caller's order so drug1 is the medication listed first
+        ordered = [medications[key] for key in (uuid.UUID(str(medication_id)) for medication_id in medication_ids) if key in medications]
+        return Response({'interactions': find_interactions(ordered)})
 
     @action(detail=True, methods=['post'])
     def add_batch(self, request, pk=None):
@@ -283,7 +743,6 @@ class MedicationViewSet(viewsets.ModelViewSet):
         expiry_date = request.data.get('expiry_date')
         pack_size = request.data.get('pack_size', medication.pack_size)
         packs_received = request.data.get('packs_received', 1)
-        total_tablets = pack_size * packs_received
         
         if not batch_number or not expiry_date:
             return Response(
@@ -300,34 +759,14 @@ class MedicationViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
-        with transaction.atomic():
-            batch = MedicationBatch.objects.create(
-                medication=medication,
-                batch_number=batch_number,
-                expiry_date=expiry_date,
-                total_tablets=total_tablets,
-                remaining_tablets=total_tablets,
-                date_received=timezone.now().date(),
-                pack_size=pack_size,
-                packs_received=packs_received,
-                opened_packs=0,
-                sealed_packs=packs_received,
-                supplier=medication.supplier,
-                status='Active'
-            )
-            
-            previous_stock = medication.current_stock
-            medication.save()
-            
-            StockTransaction.objects.create(
-                medication=medication,
-                type='Restocked',
-                quantity=total_tablets,
-                previous_stock=previous_stock,
-                new_stock=medication.current_stock,
-                performed_by=request.user.get_username() if request.user.is_authenticated else 'System',
-                reason=f'Added batch {batch_number}'
-            )
+        batch = receive_batch(
+            medication,
+            performed_by=request.user.get_username() if request.user.is_authenticated else 'System',
+            batch_number=batch_number,
+            expiry_date=expiry_date,
+            pack_size=pack_size,
+            packs_received=packs_received
+        )
         
         return Response({
             'message': 'Batch added successfully',
@@ -337,30 +776,79 @@ class MedicationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def stock_status(self, request):
-        total_items = Medication.objects.count()
-        in_stock = Medication.objects.filter(current_stock__gt=0).count()
-        low_stock = Medication.objects.filter(
-            current_stock__lte=F('minimum_stock'),
-            current_stock__gt=0
-        ).count()
-        out_of_stock = Medication.objects.filter(current_stock=0).count()
-        near_expiry = Medication.objects.filter(
-            batches__expiry_date__lte=timezone.now() + timezone.timedelta(days=30),
-            batches__expiry_date__gte=timezone.now(),
-            batches__remaining_tablets__gt=0
-        ).distinct().count()
-        expired = Medication.objects.filter(
-            batches__expiry_date__lt=timezone.now(),
-            batches__remaining_tablets__gt=0
-        ).distinct().count()
+        medications = Medication.objects.all()
+        for field in ('category', 'location', 'supplier'):
+            value = request.query_params.get(field)
+            if value:
+                medications = medications.filter(**{field: value})
+
+        def has_batches(batch_status):
+            return Exists(MedicationBatch.objects.filter(
+                medication=OuterRef('pk'), status=batch_status, remaining_tablets__gt=0
+            ))
+
+        # Batch statuses are rolled forward by the nightly sweep, so one pass over the formulary is enough
+        summary = medications.annotate(
+            has_near_expiry=has_batches('Near Expiry'),
+            has_expired=has_batches('Expired')
+        ).aggregate(
+            total_items=Count('pk'),
+            in_stock=Count('pk', filter=Q(current_stock__gt=0)),
+            low_stock=Count('pk', filter=Q(current_stock__lte=F('minimum_stock'), current_stock__gt=0)),
+            out_of_stock=Count('pk', filter=Q(current_stock=0)),
+            near_expiry=Count('pk', filter=Q(has_near_expiry=True)),
+            expired=Count('pk', filter=Q(has_expired=True))
+        )
         
+        return Response(summary)
+
+    @staticmethod
+    def _window_days(request, default):
+        """?days= clamped to 1..366; raises ValueError when it is not a whole number"""
+        return min(max(int(request.query_params.get('days', default)), 1), 366)
+
+    @action(detail=True, methods=['get'])
+    def usage(self, request, pk=None):
+        """Daily usage over the last ?days= days (default 90) with suggested stock levels"""
+        medication = self.get_object()
+        try:
+            days = self._window_days(request, 90)
+        except ValueError:
+            return Response({"detail": "'days' must be a whole number."}, status=status.HTTP_400_BAD_REQUEST)
+        daily = InventoryAnalytics.get_usage_trends(medication, days)
         return Response({
-            'total_items': total_items,
-            'in_stock': in_stock,
-            'low_stock': low_stock,
-            'out_of_stock': out_of_stock,
-            'near_expiry': near_expiry,
-            'expired': expired
+            'medication': str(medication.id),
+            'medication_name': medication.name,
+            'days': days,
+            'total_dispensed': sum(day['dispensed'] for day in daily),
+            'daily': daily,
+            'recommendations': optimize_inventory_levels(medication, days),
+        })
+
+    @action(detail=False, methods=['get'])
+    def slow_moving(self, request):
+        """Medications in stock that were not dispensed in the last ?days= days (default 180)"""
+        try:
+            days = self._window_days(request, 180)
+        except ValueError:
+            return Response({"detail": "'days' must be a whole number."}, status=status.HTTP_400_BAD_REQUEST)
+        medications = InventoryAnalytics.get_slow_moving_items(days).order_by('name').values(
+            'id', 'name', 'category', 'location', 'current_stock', 'last_dispensed'
+        )
+        return Response({'days': days, 'results': list(medications)})
+
+    @action(detail=False, methods=['get'])
+    def fast_moving(self, request):
+        """Medications with more than ?threshold= tablets (default 100) dispensed in the last ?days= days (default 30)"""
+        try:
+            days = self._window_days(request, 30)
+            threshold = max(int(request.query_params.get('threshold', 100)), 0)
+        except ValueError:
+            return Response({"detail": "'days' and 'threshold' must be whole numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'days': days,
+            'threshold': threshold,
+            'results': list(InventoryAnalytics.get_fast_moving_items(days, threshold)),
         })
 
 class PrescriptionViewSet(viewsets.ModelViewSet):
@@ -373,7 +861,86 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
         visit_id = self.request.query_params.get('visit', None)
         if visit_id:
             queryset = queryset.filter(visit_id=visit_id)
-        return queryset.select_related('visit', 'prescribed_by').prefetch_related('items')
+        return queryset.select_related('visit__patient', 'prescribed_by').prefetch_related('items')
+
+    ITEM_FIELDS = ('dosage', 'frequency', 'duration', 'route', 'quantity', 'instructions')
+
+    def _medications(self, items_data):
+        """Every medication the payload refers to, keyed by id, in one query"""
+        try:
+            ids = {uuid.UUID(str(item_data['medication'])) for item_data in items_data}
+        except (KeyError, ValueError, TypeError):
+            raise serializers.ValidationError({'items': 'Each item needs a valid medication id.'})
+        medications = Medication.objects.in_bulk(ids)
+        missing = ids - medications.keys()
+        if missing:
+            raise serializers.ValidationError({'items': f'Medication not found: {sorted(map(str, missing))[0]}'})
+        return medications
+
+    def _write_items(self, prescription, items_data, existing=()):
+        """
+        Make the prescription's items match `items_data`
+
+        Payload items are matched to existing items by 'id' when given, otherwise by
+        medication in order. Matched items are written only if something changed; the
+        rest are inserted or deleted in bulk. New items, and items whose medication or
+        quantity changed, go back to Pending for update_availability_status to resolve.
+        Returns the payload's medications in order.
+        """
+        medications = self._medications(items_data)
+        prescribed = []
+        unmatched = list(existing)
+        new_items, changed_items, changed_fields = [], [], set()
+        now = timezone.now()
+
+        for item_data in items_data:
+            medication = medications[uuid.UUID(str(item_data['medication']))]
+            prescribed.append(medication)
+            try:
+                values = {field: item_data[field] for field in self.ITEM_FIELDS if field != 'instructions'}
+                values['quantity'] = int(values['quantity'])
+                values['instructions'] = item_data.get('instructions') or ''
+            except (KeyError, ValueError, TypeError):
+                raise serializers.ValidationError({'items': f"Each item needs {', '.join(self.ITEM_FIELDS[:-1])}."})
+
+            item = next((item for item in unmatched if str(item.id) == str(item_data.get('id'))), None)
+            item = item or next((item for item in unmatched if item.medication_id == medication.id), None)
+            if item is None:
+                new_items.append(PrescriptionItem(prescription=prescription, medication=medication, status='Pending', **values))
+                continue
+            unmatched.remove(item)
+
+            values['medication_id'] = medication.id
+            # Blank and missing instructions are the same instructions
+            fields = [
+                field for field, value in values.items()
+                if ((getattr(item, field) or '') if field == 'instructions' else getattr(item, field)) != value
+            ]
+            if not fields:
+                continue
+            for field in fields:
+                setattr(item, field, values[field])
+            if item.status in ('Available', 'Out of Stock') and {'medication_id', 'quantity'} & set(fields):
+                item.status = 'Pending'
+                fields.append('status')
+            item.updated_at = now
+            changed_items.append(item)
+            changed_fields.update(fields)
+
+        if unmatched:
+            PrescriptionItem.objects.filter(id__in=[item.id for item in unmatched]).delete()
+        if new_items:
+            PrescriptionItem.objects.bulk_create(new_items)
+        if changed_items:
+            fields = ['medication' if field == 'medication_id' else field for field in changed_fields]
+            PrescriptionItem.objects.bulk_update(changed_items, sorted(fields) + ['updated_at'])
+        return prescribed
+
+    def create(self, request, *args, **kwargs):
+        self.interaction_warnings = []
+        response = super().create(request, *args, **kwargs)
+        response.data['interaction_warnings'] = self.interaction_warnings
+        return response
 
     def perform_create(self, serializer):
         with transaction.atomic():
@@ -396,32 +963,18 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
                 status='Pending'
             )
             
-            items_data = self.request.data.get('items', [])
-            for item_data in items_data:
-                medication = Medication.objects.get(id=item_data['medication'])
-                
-                item_status = 'Available' if medication.current_stock >= item_data['quantity'] else 'Out of Stock'
-                
-                PrescriptionItem.objects.create(
-                    prescription=prescription,
-                    medication=medication,
-                    dosage=item_data['dosage'],
-                    frequency=item_data['frequency'],
-                    duration=item_data['duration'],
-                    route=item_data['route'],
-                    quantity=item_data['quantity'],
-                    instructions=item_data.get('instructions', ''),
-                    status=item_status
-                )
-            
+            prescribed = self._write_items(prescription, self.request.data.get('items', []))
             prescription.update_availability_status()
+            # Screen against what the patient is already taking, not their whole history
+            self.interaction_warnings = screen(prescription.visit.patient_id, prescribed)
             
-            PharmacyQueue.objects.create(
+            queue_item = PharmacyQueue.objects.create(
                 prescription=prescription,
                 priority='Medium',
                 status='Pending',
                 wait_time_minutes=0
             )
+            publish_pharmacy_queue_created(queue_item)
 
     def update(self, request, *args, **kwargs):
         with transaction.atomic():
@@ -429,37 +982,24 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
             serializer = self.get_serializer(instance, data=request.data, partial=True)
             serializer.is_valid(raise_exception=True)
             
+            was_cancelled = instance.status == 'Cancelled'
             prescription = serializer.save()
-            
-            items_data = request.data.get('items', [])
-            PrescriptionItem.objects.filter(prescription=prescription).delete()
-            
-            for item_data in items_data:
-                medication = Medication.objects.get(id=item_data['medication'])
-                
-                item_status = 'Available' if medication.current_stock >= item_data['quantity'] else 'Out of Stock'
-                
-                PrescriptionItem.objects.create(
-                    prescription=prescription,
-                    medication=medication,
-                    dosage=item_data['dosage'],
-                    frequency=item_data['frequency'],
-                    duration=item_data['duration'],
-                    route=item_data['route'],
-                    quantity=item_data['quantity'],
-                    instructions=item_data.get('instructions', ''),
-                    status=item_status
-                )
-            
-            prescription.update_availability_status()
-            
+            if prescription.status == 'Cancelled' and not was_cancelled:
+                release_prescription(prescription)
+
+            if 'items' in request.data:
+                self._write_items(prescription, request.data['items'], list(instance.items.all()))
+                prescription.update_availability_status()
+
             return Response(serializer.data)
 
     @action(detail=True, methods=['patch'])
     def cancel(self, request, pk=None):
         prescription = self.get_object()
-        prescription.status = 'Cancelled'
-        prescription.save()
+        with transaction.atomic():
+            prescription.status = 'Cancelled'
+            prescription.save()
+            release_prescription(prescription)
         return Response({'status': 'Prescription cancelled'})
 
 class PrescriptionItemViewSet(viewsets.ModelViewSet):
@@ -485,13 +1025,16 @@ class PharmacyQueueViewSet(viewsets.ModelViewSet):
         if pharmacist_filter == 'current_user' and self.request.user.is_authenticated:
             queryset = queryset.filter(assigned_pharmacist=self.request.user)
             
-        return queryset.select_related(
-            'prescription', 
-            'prescription__visit', 
-            'prescription__visit__patient',
-            'prescription__visit__consultation_room',
-            'assigned_pharmacist'
-        ).prefetch_related('prescription__items__medication')
+        return PharmacyQueueSerializer.with_related(queryset)
+
+    def perform_update(self, serializer):
+        queue_item = serializer.save()
+        publish_pharmacy_queue_change('updated', queue_item)
+
+    def perform_destroy(self, instance):
+        queue_id = instance.id
+        instance.delete()
+        publish_pharmacy_queue_removed(queue_id)
 
     @action(detail=True, methods=['post'])
     def assign_to_me(self, request, pk=None):
@@ -514,6 +1057,7 @@ class PharmacyQueueViewSet(viewsets.ModelViewSet):
         queue_item.assigned_pharmacist = pharmacist
         queue_item.status = 'Processing'
         queue_item.save()
+        publish_pharmacy_queue_change('assigned', queue_item)
         return Response({'status': 'success'})
 
     @action(detail=True, methods=['post'])
@@ -521,6 +1065,7 @@ class PharmacyQueueViewSet(viewsets.ModelViewSet):
         queue_item = self.get_object()
         queue_item.status = 'Ready'
         queue_item.save()
+        publish_pharmacy_queue_change('ready', queue_item)
         return Response({'status': 'success'})
 
     @action(detail=True, methods=['post'])
@@ -534,112 +1079,81 @@ class PharmacyQueueViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            dispensed_count = 0
-            total_items = queue_item.prescription.items.count()
-            
-            for item_data in items_data:
-                if not isinstance(item_data, dict):
-                    continue
-                    
-                try:
-                    item_id = item_data.get('item_id')
-                    quantity_to_dispense = item_data.get('quantity_to_dispense', 1)
-                    
-                    if not item_id:
-                        continue
-                        
-                    item = queue_item.prescription.items.get(id=item_id)
-                    
-                    try:
-                        quantity_to_dispense = int(quantity_to_dispense)
-                    except (ValueError, TypeError):
-                        quantity_to_dispense = item.quantity
-                    
-                    medication = item.medication
-                    previous_stock = medication.current_stock
-                    
-                    if medication.current_stock >= quantity_to_dispense:
-                        active_batches = medication.batches.filter(
-                            remaining_tablets__gt=0,
-                            expiry_date__gte=timezone.now().date(),
-                            status='Active'
-                        ).order_by('expiry_date')
-                        
-                        remaining_to_dispense = quantity_to_dispense
-                        for batch in active_batches:
-                            if remaining_to_dispense <= 0:
-                                break
-                            
-                            quantity_from_batch = min(batch.remaining_tablets, remaining_to_dispense)
-                            
-                            batch.remaining_tablets -= quantity_from_batch
-                            
-                            tablets_used_total = batch.total_tablets - batch.remaining_tablets
-                            new_opened_packs = max(0, (tablets_used_total + batch.pack_size - 1) // batch.pack_size -
-                                                  (batch.total_tablets - batch.remaining_tablets - quantity_from_batch + batch.pack_size - 1) // batch.pack_size)
-                            batch.opened_packs += new_opened_packs
-                            batch.sealed_packs = max(0, batch.sealed_packs - new_opened_packs)
-                            
-                            if batch.expiry_date < timezone.now().date():
-                                batch.status = 'Expired'
-                            elif batch.expiry_date <= timezone.now().date() + timezone.timedelta(days=30):
-                                batch.status = 'Near Expiry'
-                            
-                            batch.save()
-                            remaining_to_dispense -= quantity_from_batch
-                        
-                        medication.save()
-                        
-                        dispensed_by = request.user.get_username() if request.user.is_authenticated else 'System'
-                        
-                        StockTransaction.objects.create(
-                            medication=medication,
-                            type='Dispensed',
-                            quantity=-quantity_to_dispense,
-                            previous_stock=previous_stock,
-                            new_stock=medication.current_stock,
-                            performed_by=dispensed_by,
-                            visit=queue_item.prescription.visit,
-                            prescription=queue_item.prescription,
-                            batch_number=active_batches.first().batch_number if active_batches.exists() else ''
-                        )
-                        
-                        item.status = 'Dispensed'
-                        item.dispensed_quantity = quantity_to_dispense
-                        item.dispensed_date = timezone.now()
-                        item.dispensed_by = dispensed_by
-                        item.save()
-                        
-                        dispensed_count += 1
-                    else:
-                        return Response(
-                            {'error': f'Insufficient stock for {medication.name}. Available: {medication.current_stock}, Required: {quantity_to_dispense}'}, 
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                        
-                except PrescriptionItem.DoesNotExist:
-                    return Response(
-                        {'error': f'Prescription item not found: {item_id}'}, 
-                        status=status.HTTP_404_NOT_FOUND
-                    )
-                except Exception as e:
-                    logger.error(f"Error dispensing item {item_id}: {str(e)}")
-                    continue
-            
-            if dispensed_count == 0:
+        prescription = queue_item.prescription
+        quantities = {}
+        for item_data in items_data:
+            if not isinstance(item_data, dict) or not item_data.get('item_id'):
+                continue
+            try:
+                item_id = str(uuid.UUID(str(item_data['item_id'])))
+            except ValueError:
+                return Response(
+                    {'error': f"Prescription item not found: {item_data['item_id']}"}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            quantities[item_id] = item_data.get('quantity_to_dispense', 1)
+
+        items = {str(item.id): item for item in prescription.items.filter(id__in=quantities)}
+        missing = [item_id for item_id in quantities if item_id not in items]
+        if missing:
+            return Response(
+                {'error': f'Prescription item not found: {missing[0]}'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if not items:
+            return Response(
+                {'error': 'No items were dispensed. Please check the items and try again.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        for item_id, quantity_to_dispense in quantities.items():
+            try:
+                quantities[item_id] = int(quantity_to_dispense)
+            except (ValueError, TypeError):
+                quantities[item_id] = items[item_id].quantity
+            if quantities[item_id] <= 0:
                 return Response(
-                    {'error': 'No items were dispensed. Please check the items and try again.'},
+                    {'error': f'Quantity to dispense must be positive for item {item_id}'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            if dispensed_count == total_items:
+
+        dispensed_by = request.user.get_username() if request.user.is_authenticated else 'System'
+
+        with transaction.atomic():
+            try:
+                dispense(
+                    [(items[item_id].dispensed_medication_id, quantity) for item_id, quantity in quantities.items()],
+                    performed_by=dispensed_by,
+                    visit=prescription.visit,
+                    prescription=prescription
+                )
+            except InsufficientStockError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            now = timezone.now()
+            for item_id, item in items.items():
+                item.status = 'Dispensed'
+                item.dispensed_quantity = quantities[item_id]
+                item.dispensed_date = now
+                item.dispensed_by = dispensed_by
+                item.updated_at = now
+            PrescriptionItem.objects.bulk_update(
+                items.values(), ['status', 'dispensed_quantity', 'dispensed_date', 'dispensed_by', 'updated_at']
+            )
+            record_dispensed(prescription, items.values(), now)
+
+            dispensed_count = len(items)
+            prescription.update_availability_status()
+            total_items = prescription.total_items
+
+            if prescription.dispensed_items == total_items:
                 queue_item.status = 'Dispensed'
-            elif dispensed_count > 0:
+            else:
                 queue_item.status = 'Partially Dispensed'
-            
+
             queue_item.save()
-            queue_item.prescription.update_availability_status()
+            publish_pharmacy_queue_change('dispensed', queue_item, items.values())
         
         return Response({
             'status': 'success', 
@@ -676,6 +1190,7 @@ class PharmacyQueueViewSet(viewsets.ModelViewSet):
                 item.status = 'Substituted'
                 item.substitution_reason = reason
                 item.save()
+                publish_pharmacy_queue_change('substituted', queue_item, [item])
                 
                 original_medication = item.medication
                 StockTransaction.objects.create(
@@ -701,4 +1216,12 @@ class PharmacyQueueViewSet(viewsets.ModelViewSet):
 class StockTransactionViewSet(viewsets.ModelViewSet):
     queryset = StockTransaction.objects.all()
     serializer_class = StockTransactionSerializer
-    permission_classes = [AllowAny]
\ No newline at end of file
+    permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
+    # Ledger rows are append-only: editing or deleting one would leave the usage rollup behind
+    http_method_names = ['get', 'post', 'head', 'options']
+
+    def perform_create(self, serializer):
+        # Manual ledger entries count towards the usage rollup like the stock ledger's own
+        with transaction.atomic():
+            record_usage([serializer.save()])
\ No newline at end of file
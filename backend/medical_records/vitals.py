@@ -0,0 +1,180 @@
+# vitals.py - Vital sign ingest and history for charts and ward views
+
+from datetime import timedelta, timezone as dt_timezone
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Avg, Count, FloatField, Max, Min, Q, Value
+from django.db.models.functions import Extract, Floor, Least
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Patient, VitalReading, Visit
+from .patient_import import PARSE_ERROR
+from . import early_warning
+
+METRICS = (
+    'systolic', 'diastolic', 'heart_rate', 'blood_sugar', 'rbs', 'temperature', 'weight',
+    'height', 'respiratory_rate', 'oxygen_saturation', 'pain_scale',
+)
+DEFAULT_METRICS = ('systolic', 'diastolic', 'heart_rate', 'temperature', 'respiratory_rate', 'oxygen_saturation')
+MAX_POINTS = 2000
+MAX_INGEST_ROWS = 10000
+MAX_LATEST_PATIENTS = 500
+TEXT_FIELDS = ('comment', 'recorded_by')
+# Visits whose patient is on the premises, for ward-scoped views
+PRESENT_VISIT_STATUSES = ('Confirmed', 'In Progress', 'In Nursing Pool', 'Queued')
+# Monitor clocks drift; readings this far ahead of the server are still accepted
+CLOCK_SKEW = timedelta(minutes=5)
+
+def ward_patients(clinic=None, location=None):
+    """Subquery of the patients with an open visit in `clinic` and/or at `location`"""
+    visits = Visit.objects.filter(status__in=PRESENT_VISIT_STATUSES)
+    if clinic:
+        visits = visits.filter(clinic=clinic)
+    if location:
+        visits = visits.filter(visit_location=location)
+    return visits.values('patient_id')
+
+def latest_readings(patient_ids):
+    """
+    Each patient's most recent reading, for a list or subquery of patient ids
+
+    One DISTINCT ON (patient_id) query walking the (patient, -date, -id) index; patients
+    without readings are simply absent.
+    """
+    return VitalReading.objects.filter(patient_id__in=patient_ids).order_by(
+        'patient_id', '-date', '-id'
+    ).distinct('patient_id')
+
+def series(patient_id, metrics, start, end, points):
+    """
+    A patient's readings between `start` and `end` cut into `points` equal time buckets,
+    with min, max and mean of each metric per bucket
+
+    One grouped query over the (patient, date) index; empty buckets are left out, so the
+    result never has more than `points` entries however many readings fall in the range.
+    """
+    width = max((end - start).total_seconds() / points, 1)
+    # Epoch of the UTC wall clock; extracting in the local zone would shift every bucket
+    epoch = Extract('date', 'epoch', tzinfo=dt_timezone.utc, output_field=FloatField())
+    bucket = Least(
+        Floor((epoch - Value(start.timestamp())) / Value(width)),
+        Value(points - 1),
+        output_field=FloatField(),
+    )
+    recorded = Q()
+    for metric in metrics:
+        recorded |= Q(**{f'{metric}__isnull': False})
+
+    aggregates = {'count': Count('id')}
+    for metric in metrics:
+        aggregates[f'{metric}__min'] = Min(metric)
+        aggregates[f'{metric}__max'] = Max(metric)
+        aggregates[f'{metric}__mean'] = Avg(metric)
+    rows = VitalReading.objects.filter(
+        recorded, patient_id=patient_id, date__gte=start, date__lte=end
+    ).annotate(bucket=bucket).values('bucket').annotate(**aggregates).order_by('bucket')
+
+    buckets = []
+    for row in rows:
+        entry = {'time': start + timedelta(seconds=row['bucket'] * width), 'count': row['count']}
+        for metric in metrics:
+            mean = row[f'{metric}__mean']
+            entry[metric] = None if mean is None else {
+                'min': row[f'{metric}__min'],
+                'max': row[f'{metric}__max'],
+                'mean': round(mean, 2),
+            }
+        buckets.append(entry)
+    return {'bucket_seconds': width, 'series': buckets}
+
+def _clean(row, now):
+    """(cleaned field values, None) for a valid ingest row, or (None, errors)"""
+    if not isinstance(row, dict):
+        return None, {'row': 'Expected an object.'}
+    if PARSE_ERROR in row:
+        return None, {'row': row[PARSE_ERROR]}
+
+    errors = {}
+    data = {}
+    unknown = set(row) - {'patient', 'date', *METRICS, *TEXT_FIELDS}
+    for field in sorted(unknown):
+        errors[field] = 'Unknown field.'
+
+    patient = row.get('patient')
+    if isinstance(patient, bool) or not isinstance(patient, (int, str)) or not str(patient).isdigit():
+        errors['patient'] = 'A patient id is required.'
+    else:
+        data['patient_id'] = int(patient)
+
+    if row.get('date') is not None:
+        try:
+            taken = parse_datetime(row['date']) if isinstance(row['date'], str) else None
+        except ValueError:
+            taken = None
+        if taken is None:
+            errors['date'] = 'Expected an ISO 8601 datetime.'
+        else:
+            taken = taken if timezone.is_aware(taken) else timezone.make_aware(taken)
+            if taken > now + CLOCK_SKEW:
+                errors['date'] = 'Reading is in the future.'
+            data['date'] = taken
+
+    for metric in METRICS:
+        value = row.get(metric)
+        if value is None:
+            continue
+        try:
+            if isinstance(value, bool):
+                raise ValidationError('')
+            data[metric] = VitalReading._meta.get_field(metric).to_python(value)
+        except ValidationError:
+            errors[metric] = 'Expected a number.'
+    if data.get('systolic') is not None and data['systolic'] < 0:
+        errors['systolic'] = 'Systolic pressure cannot be negative.'
+
+    for field in TEXT_FIELDS:
+        if row.get(field) is not None:
+            if not isinstance(row[field], str):
+                errors[field] = 'Expected a string.'
+            else:
+                data[field] = row[field]
+    return (None, errors) if errors else (data, None)
+
+def ingest(rows, batch_size=1000):
+    """
+    Validate and insert a batch of readings for any number of patients
+
+    Rows are checked in one pass, their patients looked up with one query and the valid
+    readings scored and written with bulk_create; invalid rows are reported and skipped.
+    Returns one result per row, in order: {'row', 'id', 'early_warning_score',
+    'early_warning_risk'} when stored, {'row', 'errors'} when not.
+    """
+    now = timezone.now()
+    results = []
+    cleaned = []
+    for number, row in enumerate(rows, start=1):
+        data, errors = _clean(row, now)
+        if errors:
+            results.append({'row': number, 'errors': errors})
+        else:
+            results.append({'row': number})
+            cleaned.append((results[-1], data))
+
+    known = Patient.objects.only('id').in_bulk({data['patient_id'] for _, data in cleaned})
+    readings = []
+    for result, data in cleaned:
+        if data['patient_id'] not in known:
+            result['errors'] = {'patient': 'Patient not found.'}
+            continue
+        readings.append((result, VitalReading(**data)))
+
+    stored = [reading for _, reading in readings]
+    VitalReading.score(stored)
+    with transaction.atomic():
+        VitalReading.objects.bulk_create(stored, batch_size=batch_size)
+        early_warning.record(stored)
+    for result, reading in readings:
+        result['id'] = reading.id
+        result['early_warning_score'] = reading.early_warning_score
+        result['early_warning_risk'] = reading.early_warning_risk
+    return results
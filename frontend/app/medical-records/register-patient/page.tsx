@@ -316,8 +316,8 @@ export default function RegisterPatient() {
       
       const data = await res.json();
       
-      // Check if multiple results
-      const results = Array.isArray(data) ? data : [data];
+      // Search results are paginated and ranked, best match first
+      const results = Array.isArray(data) ? data : (data.results || [data]);
       const sponsor = results.find((p: any) => p.patient_type === "Employee" || p.patient_type === "Retiree");
       
       if (!sponsor) {
@@ -58,7 +58,7 @@ interface ConsultationRoom {
   consultationStartTime?: string;
   estimatedEndTime?: string;
   doctor?: string;
-  queue: any[];  // Array of { patient_id: string, position: number }
+  queue: any[];  // Array of { visit, patient, patient_name, status, priority, position, enqueued_at }
   totalConsultationsToday: number;
   averageConsultationTime: number; // in minutes
 }
@@ -131,7 +131,7 @@ const ConsultationRoomQueue = () => {
         const data = await response.json();
         setRooms((data.results || data).map((r: any) => ({
           ...r,
-          queue: r.queue || [],  // Patient objects via join if needed; minimal: use patient_id
+          queue: r.queue || [],
         })));
       }
     } catch (err) {
@@ -164,7 +164,7 @@ const ConsultationRoomQueue = () => {
     const availableRooms = rooms.filter(room => room.status === "available").length;
     const totalConsultationsToday = rooms.reduce((acc, room) => acc + room.totalConsultationsToday, 0);
     const avgWaitTime = rooms.reduce((acc, room) => {
-      const queueWait = room.queue.reduce((qAcc: number, qItem: any) => qAcc + getMinutesDifference(qItem.assignedAt || new Date().toISOString()), 0);
+      const queueWait = room.queue.reduce((qAcc: number, qItem: any) => qAcc + getMinutesDifference(qItem.enqueued_at || new Date().toISOString()), 0);
       return acc + queueWait;
     }, 0) / Math.max(1, totalPatients);
 
@@ -175,7 +175,7 @@ const ConsultationRoomQueue = () => {
       totalConsultationsToday,
       avgWaitTime: Math.round(avgWaitTime),
       emergencyPatients: rooms.reduce((acc, room) => {
-        const emergencyInQueue = room.queue.filter((q: any) => q.priority === "Emergency").length;  // Assume priority in queue
+        const emergencyInQueue = room.queue.filter((q: any) => q.priority === "Emergency").length;
         const emergencyInProgress = room.currentPatient?.priority === "Emergency" ? 1 : 0;
         return acc + emergencyInQueue + emergencyInProgress;
       }, 0),
@@ -197,7 +197,7 @@ const ConsultationRoomQueue = () => {
         room.doctor?.toLowerCase().includes(term) ||
         room.currentPatient?.name.toLowerCase().includes(term) ||
         room.queue.some((q: any) => 
-          q.patient_id.toLowerCase().includes(term)  // Minimal: use patient_id
+          (q.patient_name || "").toLowerCase().includes(term) || String(q.visit).includes(term)
         )
       );
     }
@@ -210,14 +210,18 @@ const ConsultationRoomQueue = () => {
     if (fromRoomId === toRoomId) return;
 
     try {
-      // Fetch rooms
-      const fromRoomResponse = await fetch(`${API_URL}/api/rooms/${fromRoomId}/`);
-      const fromRoom = await fromRoomResponse.json();
-      const toRoomResponse = await fetch(`${API_URL}/api/rooms/${toRoomId}/`);
-      const toRoom = await toRoomResponse.json();
+      const toRoom = rooms.find(r => r.id === toRoomId);
 
-      const newQueuePosition = (toRoom.queue || []).length + 1;
-      const newQueue = [...(toRoom.queue || []), { patient_id: patientId, position: newQueuePosition }];
+      // Enqueueing in the target room also removes the visit from its current room's queue
+      const response = await fetch(`${API_URL}/api/rooms/${toRoomId}/enqueue/`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        credentials: "include",
+        body: JSON.stringify({ visit: patientId }),
+      });
+      if (!response.ok) throw new Error("Failed to reassign patient");
+      const { queue } = await response.json();
+      const newQueuePosition = queue.find((entry: any) => String(entry.visit) === patientId)?.position ?? queue.length;
 
       // Update visit
       await fetch(`${API_URL}/api/visits/${patientId}/`, {
@@ -225,32 +229,13 @@ const ConsultationRoomQueue = () => {
         headers: { "Content-Type": "application/json" },
         credentials: "include",
         body: JSON.stringify({
-          consultation_room: toRoomId,
-          queue_position: newQueuePosition,
           status: "Queued",
-          location: `${toRoom.name} (Queue Position: ${newQueuePosition})`,
+          location: `${toRoom?.name} (Queue Position: ${newQueuePosition})`,
         }),
       });
 
-      // Update fromRoom queue (remove)
-      const updatedFromQueue = (fromRoom.queue || []).filter((q: any) => q.patient_id !== patientId);
-      await fetch(`${API_URL}/api/rooms/${fromRoomId}/`, {
-        method: "PATCH",
-        headers: { "Content-Type": "application/json" },
-        credentials: "include",
-        body: JSON.stringify({ queue: updatedFromQueue }),
-      });
-
-      // Update toRoom queue
-      await fetch(`${API_URL}/api/rooms/${toRoomId}/`, {
-        method: "PATCH",
-        headers: { "Content-Type": "application/json" },
-        credentials: "include",
-        body: JSON.stringify({ queue: newQueue }),
-      });
-
       await fetchRooms();  // Refresh
-      toast.success(`Reassigned patient ${patientId} to ${toRoom.name}`);
+      toast.success(`Reassigned patient ${patientId} to ${toRoom?.name}`);
       setReassignDialogOpen(false);
       setSelectedPatient(null);
       setTargetRoomId("");
@@ -488,7 +473,7 @@ const ConsultationRoomQueue = () => {
                   
                   {room.queue.map((qItem: any, index: number) => (
                     <div 
-                      key={qItem.patient_id} 
+                      key={qItem.visit} 
                       className="p-3 border rounded-lg bg-card hover:bg-accent/50 transition-colors"
                     >
                       <div className="flex items-center justify-between mb-2">
@@ -496,26 +481,25 @@ const ConsultationRoomQueue = () => {
                           <Badge variant="secondary" className="text-xs">
                             #{index + 1}
                           </Badge>
-                          {/* Priority from visit if available; minimal placeholder */}
                           <Badge className="bg-gray-100 text-gray-800 border-gray-200" variant="outline">
-                            Medium  {/* Fetch if needed */}
+                            {qItem.priority}
                           </Badge>
                         </div>
                         
                         <div className="text-xs text-muted-foreground">
-                          Waiting: {getMinutesDifference(qItem.assignedAt || new Date().toISOString())} min
+                          Waiting: {getMinutesDifference(qItem.enqueued_at || new Date().toISOString())} min
                         </div>
                       </div>
                       
                       <div className="text-sm space-y-1">
-                        <div><strong>Patient ID: {qItem.patient_id}</strong></div>  {/* Enhance: fetch name */}
+                        <div><strong>{qItem.patient_name || `Visit ${qItem.visit}`}</strong></div>
                         <div className="text-gray-600 text-xs">Position: {qItem.position}</div>
                       </div>
                       
                       <div className="mt-3 flex gap-2">
                         <Button variant="outline" size="sm"
                           onClick={() => {
-                            setSelectedPatient({ id: qItem.patient_id, name: "Patient " + qItem.patient_id });  // Minimal
+                            setSelectedPatient({ id: String(qItem.visit), name: qItem.patient_name || `Visit ${qItem.visit}` });
                             setReassignDialogOpen(true);
                           }}
                         >
@@ -564,7 +548,7 @@ const ConsultationRoomQueue = () => {
                   </SelectTrigger>
                   <SelectContent>
                     {rooms
-                      .filter(room => room.id !== rooms.find(r => r.queue.some((q: any) => q.patient_id === selectedPatient.id))?.id)
+                      .filter(room => room.id !== rooms.find(r => r.queue.some((q: any) => String(q.visit) === selectedPatient.id))?.id)
                       .map(room => (
                         <SelectItem key={room.id} value={room.id}>
                           {room.name} 
@@ -586,7 +570,7 @@ const ConsultationRoomQueue = () => {
             <Button 
               onClick={() => {
                 if (selectedPatient && targetRoomId) {
-                  const currentRoom = rooms.find(r => r.queue.some((q: any) => q.patient_id === selectedPatient.id));
+                  const currentRoom = rooms.find(r => r.queue.some((q: any) => String(q.visit) === selectedPatient.id));
                   if (currentRoom) {
                     handleReassignPatient(selectedPatient.id, currentRoom.id, targetRoomId);
                   }
@@ -279,6 +279,22 @@ export default function PatientVitals() {
       const patientIds = [...new Set(visits.map((v: any) => v.patient))];
       const patientsWithVitals: Patient[] = [];
 
+      // Latest reading of every patient on the list in one request
+      const latestByPatient = new Map<unknown, any>();
+      if (patientIds.length > 0) {
+        const latestResponse = await fetch(`${API_URL}/api/vitals/latest/?patients=${patientIds.join(",")}`, {
+          headers: { "Content-Type": "application/json" },
+          credentials: "include",
+        });
+        if (latestResponse.ok) {
+          for (const reading of await latestResponse.json()) {
+            latestByPatient.set(reading.patient, reading);
+          }
+        } else {
+          console.warn(`Failed to fetch latest vitals: ${latestResponse.statusText}`);
+        }
+      }
+
       for (const patientId of patientIds) {
         try {
           const patientResponse = await fetch(`${API_URL}/api/patients/${patientId}/`, {
@@ -292,46 +308,34 @@ export default function PatientVitals() {
           }
 
           const patientData = await patientResponse.json();
-          const vitalsResponse = await fetch(`${API_URL}/api/vitals/?patient=${patientId}`, {
-            headers: { "Content-Type": "application/json" },
-            credentials: "include",
-          });
 
           let vitalsData: VitalsData | undefined;
           let vitalsAlerts: string[] = [];
 
-          if (vitalsResponse.ok) {
-            const vitalsResult = await vitalsResponse.json();
-            const vitalsList = vitalsResult.results || vitalsResult;
-
-            if (vitalsList.length > 0) {
-              const latestVitals = vitalsList.sort((a: any, b: any) =>
-                new Date(b.date).getTime() - new Date(a.date).getTime()
-              )[0];
-
-              vitalsData = {
-                id: latestVitals.id,
-                height: latestVitals.height?.toString() || "",
-                weight: latestVitals.weight?.toString() || "",
-                temperature: latestVitals.temperature?.toString() || "",
-                pulse: latestVitals.heart_rate?.toString() || "",
-                respiratoryRate: latestVitals.respiratory_rate?.toString() || "",
-                bloodPressureSystolic: latestVitals.systolic?.toString() || "",
-                bloodPressureDiastolic: latestVitals.diastolic?.toString() || "",
-                oxygenSaturation: latestVitals.oxygen_saturation?.toString() || "",
-                fbs: latestVitals.blood_sugar?.toString() || "",
-                rbs: latestVitals.rbs?.toString() || "",
-                painScale: latestVitals.pain_scale?.toString() || "",
-                bodymassindex: latestVitals.height && latestVitals.weight
-                  ? calculateBMI(latestVitals.height.toString(), latestVitals.weight.toString())
-                  : "",
-                comment: latestVitals.comment || "",
-                recordedAt: latestVitals.date,
-                recordedBy: latestVitals.recorded_by || "Unknown",
-              };
-
-              vitalsAlerts = computeVitalsAlerts(vitalsData);
-            }
+          const latestVitals = latestByPatient.get(patientId);
+          if (latestVitals) {
+            vitalsData = {
+              id: latestVitals.id,
+              height: latestVitals.height?.toString() || "",
+              weight: latestVitals.weight?.toString() || "",
+              temperature: latestVitals.temperature?.toString() || "",
+              pulse: latestVitals.heart_rate?.toString() || "",
+              respiratoryRate: latestVitals.respiratory_rate?.toString() || "",
+              bloodPressureSystolic: latestVitals.systolic?.toString() || "",
+              bloodPressureDiastolic: latestVitals.diastolic?.toString() || "",
+              oxygenSaturation: latestVitals.oxygen_saturation?.toString() || "",
+              fbs: latestVitals.blood_sugar?.toString() || "",
+              rbs: latestVitals.rbs?.toString() || "",
+              painScale: latestVitals.pain_scale?.toString() || "",
+              bodymassindex: latestVitals.height && latestVitals.weight
+                ? calculateBMI(latestVitals.height.toString(), latestVitals.weight.toString())
+                : "",
+              comment: latestVitals.comment || "",
+              recordedAt: latestVitals.date,
+              recordedBy: latestVitals.recorded_by || "Unknown",
+            };
+
+            vitalsAlerts = computeVitalsAlerts(vitalsData);
           } else {
             console.warn(`No vitals found for patient ${patientId}`);
           }
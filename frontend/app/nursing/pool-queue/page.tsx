@@ -896,8 +896,17 @@ const PoolQueue = () => {
       });
       if (!roomResponse.ok) throw new Error("Failed to fetch room");
       const roomData = await roomResponse.json();
-      const currentQueue = roomData.queue || [];
-      const queuePosition = currentQueue.length + 1;
+
+      // Join the room queue (moves the visit out of any other room's queue)
+      const enqueueResponse = await fetch(`${API_URL}/api/rooms/${roomId}/enqueue/`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        credentials: "include",
+        body: JSON.stringify({ visit: selectedPatientId, priority: patient.priority }),
+      });
+      if (!enqueueResponse.ok) throw new Error("Failed to add patient to room queue");
+      const { queue } = await enqueueResponse.json();
+      const queuePosition = queue.find((entry: any) => String(entry.visit) === String(selectedPatientId))?.position ?? queue.length;
       
       // Determine the new status based on room availability
       const newStatus = roomData.status === "available" ? "In Progress" : "Queued";
@@ -917,15 +926,6 @@ const PoolQueue = () => {
       });
       if (!visitResponse.ok) throw new Error("Failed to update visit");
 
-      // Update room queue (PATCH)
-      const updatedQueue = [...currentQueue, { patient_id: selectedPatientId, position: queuePosition }];
-      await fetch(`${API_URL}/api/rooms/${roomId}/`, {
-        method: "PATCH",
-        headers: { "Content-Type": "application/json" },
-        credentials: "include",
-        body: JSON.stringify({ queue: updatedQueue }),
-      });
-
       // Update room status if it was available
       if (roomData.status === "available") {
         setConsultationRooms(prev => 
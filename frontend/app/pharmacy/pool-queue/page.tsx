@@ -296,15 +296,79 @@ export default function PharmacyPoolQueue() {
     
     loadData();
 
-    // Set up polling for real-time updates
+    // Statistics are still polled; the queue itself is pushed over the socket below
     const interval = setInterval(() => {
-      fetchQueue();
       fetchStatistics();
     }, 30000); // Poll every 30 seconds
 
     return () => clearInterval(interval);
   }, [fetchQueue, fetchStatistics]);
 
+  // Live queue updates: a snapshot on connect, then compact diffs per transition
+  useEffect(() => {
+    const matchesFilters = (entry: any) =>
+      (statusFilter === "All" || entry.status === statusFilter) &&
+      (priorityFilter === "All" || entry.priority === priorityFilter);
+
+    const applyDiff = (entry: PharmacyQueueItem, diff: any): PharmacyQueueItem => {
+      const { items: itemDiffs, ...fields } = diff;
+      const items = itemDiffs
+        ? entry.prescription_details.items.map(item => {
+            const changed = itemDiffs.find((d: any) => d.id === item.id);
+            return changed ? { ...item, ...changed } : item;
+          })
+        : entry.prescription_details.items;
+      return { ...entry, ...fields, prescription_details: { ...entry.prescription_details, items } };
+    };
+
+    const handleMessage = (message: { type: string; data: any }) => {
+      switch (message.type) {
+        case "queue.snapshot":
+          setQueue(message.data.filter(matchesFilters));
+          break;
+        case "queue.created":
+          if (matchesFilters(message.data)) {
+            setQueue(prev => [...prev.filter(entry => entry.id !== message.data.id), message.data]);
+          }
+          break;
+        case "queue.removed":
+          setQueue(prev => prev.filter(entry => entry.id !== message.data.id));
+          break;
+        default:
+          // assigned, ready, dispensed, substituted, updated
+          setQueue(prev =>
+            prev
+              .map(entry => (entry.id === message.data.id ? applyDiff(entry, message.data) : entry))
+              .filter(matchesFilters)
+          );
+      }
+    };
+
+    let fallback: ReturnType<typeof setInterval> | null = null;
+    const ws = new WebSocket(`${API_URL.replace(/^http/, "ws")}/ws/pharmacy-queue/`);
+
+    ws.onmessage = (e) => {
+      try {
+        handleMessage(JSON.parse(e.data));
+      } catch (error) {
+        console.error("Error parsing pharmacy queue message:", error);
+      }
+    };
+
+    ws.onclose = () => {
+      // Fall back to polling if the socket is unavailable
+      if (!fallback) {
+        fallback = setInterval(fetchQueue, 30000);
+      }
+    };
+
+    return () => {
+      ws.onclose = null;
+      ws.close();
+      if (fallback) clearInterval(fallback);
+    };
+  }, [statusFilter, priorityFilter, fetchQueue]);
+
   // Handle prescription selection for dispensing
   const handlePrescriptionSelection = (queueId: string, prescriptionItemId: string, selected: boolean) => {
     setQueue(prev =>
@@ -337,6 +337,22 @@ const ConsultationSession: React.FC<ConsultationSessionProps> = ({ roomId, initi
     fetchPatients();
   }, [fetchRoom, fetchPatients]);
 
+  // Refresh the room's patient list when one of its visits or its queue changes
+  useEffect(() => {
+    const ws = new WebSocket(`${API_URL.replace(/^http/, "ws")}/ws/visits/?room=${roomId}`);
+    ws.onmessage = (e) => {
+      try {
+        const message = JSON.parse(e.data);
+        if (message.type === "visit.update" || message.type === "visit.deleted" || message.type === "queue.update") {
+          fetchPatients();
+        }
+      } catch (error) {
+        console.error("Error parsing visit event:", error);
+      }
+    };
+    return () => ws.close();
+  }, [roomId, fetchPatients]);
+
   // Separate effect for fetching current patient vitals
   useEffect(() => {
     if (currentPatient && !currentPatient.vitals && currentPatient.patientId) {
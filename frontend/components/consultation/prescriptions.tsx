@@ -259,7 +259,13 @@ const Prescriptions: React.FC<PrescriptionsProps> = ({ visitId }) => {
 
       if (response.ok) {
         const result = await response.json();
-        
+
+        // Interactions with each other or with what the patient is already taking
+        const warnings: DrugInteraction[] = result.interaction_warnings || [];
+        if (warnings.length > 0) {
+          alert(`Interaction warnings:\n${warnings.map((w) => `${w.drug1} + ${w.drug2} (${w.severity}): ${w.description}`).join('\n')}`);
+        }
+
         // Refresh prescriptions list
         await fetchPrescriptions();
         
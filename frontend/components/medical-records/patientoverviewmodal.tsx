@@ -324,7 +324,7 @@ export default function PatientOverviewModalContent({
           }
         } else {
           const vitalsData = await vitalsRes.json();
-          setVitals(vitalsData);
+          setVitals(vitalsData.results || vitalsData);
         }
 
         // Mock reports data since the endpoint doesn't exist yet
@@ -350,7 +350,7 @@ export default function PatientOverviewModalContent({
           }
         } else {
           const visitsData = await visitsRes.json();
-          setVisits(visitsData);
+          setVisits(visitsData.results || visitsData);
         }
 
         // Mock timeline data since the endpoint doesn't exist yet
@@ -481,7 +481,7 @@ export default function PatientOverviewModalContent({
 
       if (visitsRes.ok) {
         const visitsData = await visitsRes.json();
-        setVisits(visitsData);
+        setVisits(visitsData.results || visitsData);
       } else if (visitsRes.status === 404) {
         setVisits([]);
       }